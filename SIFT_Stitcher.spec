@@ -14,6 +14,18 @@ added_files = [
     ('web', 'web'),  # webフォルダを含める
     ('src/api.py', 'src'),  # api.pyを含める
     ('src/main.py', 'src'),  # main.pyを含める（参照用）
+    ('src/blending.py', 'src'),  # api.py/main.pyから参照される共通処理
+    ('src/canvas.py', 'src'),
+    ('src/feature_cache.py', 'src'),
+    ('src/job_scheduler.py', 'src'),
+    ('src/job_store.py', 'src'),
+    ('src/manifest.py', 'src'),
+    ('src/matching.py', 'src'),
+    ('src/metrics.py', 'src'),
+    ('src/pipeline.py', 'src'),
+    ('src/shared_arrays.py', 'src'),
+    ('src/thread_budget.py', 'src'),
+    ('src/timing.py', 'src'),
 ]
 
 # 隠しインポートの指定（OpenCVとFlask関連）
@@ -91,6 +91,9 @@ def main():
         api.UPLOAD_FOLDER = uploads_dir
         api.RESULTS_FOLDER = results_dir
 
+        # 期限切れのジョブとそのファイルを定期的に削除する
+        api.start_job_reaper()
+
         print("Flask アプリケーションを初期化しました")
         print()
 
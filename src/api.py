@@ -9,34 +9,60 @@ from werkzeug.utils import secure_filename
 import os
 import json
 import uuid
-import threading
-import time
 from datetime import datetime
 import cv2 as cv
 import numpy as np
 import glob
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+import shutil
 import multiprocessing
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
 # Import existing SIFT logic
 import sys
 sys.path.insert(0, os.path.dirname(__file__))
 
+from blending import warp_and_blend_roi
+from feature_cache import cached_detect_and_compute
+from job_scheduler import JobScheduler, estimate_job_memory
+from job_store import JobStore
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from matching import (
+    build_overview_index, keypoints_to_points, query_overview_index, ratio_test
+)
+from thread_budget import (
+    apply_stage_threads, describe_thread_budget, estimate_image_pixels, plan_thread_budget
+)
+from timing import TimingRecorder, format_timing_report, span
+
 # --- 高速化パラメータ ---
 USE_FLANN = True  # FLANNマッチャーを使用（BFMatcherより高速）
 MAX_FEATURES = 5000  # SIFT特徴点の上限（メモリと速度の最適化）
 DOWNSAMPLE_FOR_MATCHING = True  # マッチング用にダウンサンプリング
 DOWNSAMPLE_SCALE = 0.5  # マッチング時のダウンサンプリング倍率
 USE_PARALLEL = True  # 並列処理を使用
-MAX_WORKERS = None  # 並列処理のワーカー数（Noneで自動：CPU数）
-
-# OpenCV最適化設定
-cv.setNumThreads(multiprocessing.cpu_count())  # OpenCVのマルチスレッド有効化
+MAX_WORKERS = None  # 並列処理のワーカー数（Noneで THREAD_BUDGET_MODE に従って自動）
+THREAD_BUDGET_MODE = 'auto'  # ワーカー数と OpenCV スレッド数の配分 (auto / outer / inner)
 
 # --- Configuration ---
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'uploads')
 RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'results')
+FEATURE_CACHE_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'feature_cache')
+FEATURE_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 特徴量キャッシュの容量上限（超過分は古いものから削除）
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+MAX_UPLOAD_FILE_BYTES = 512 * 1024 ** 2  # 1ファイルあたりのアップロード上限（合計サイズの上限はなし）
+UPLOAD_CHUNK_BYTES = 1024 * 1024  # アップロードをディスクに書き出す単位
+PREFETCH_WORKERS = 1  # アップロード中に特徴量を先に計算するスレッド数
+JOB_DB_PATH = os.path.join(RESULTS_FOLDER, 'jobs.sqlite3')  # ジョブ情報の保存先（再起動後も参照できる）
+MAX_JOBS_IN_MEMORY = 100  # メモリに置くジョブ数の上限（超えた終了済みジョブは SQLite のみに残す）
+JOB_TTL_SECONDS = 24 * 3600  # 終了済み・未開始のジョブとそのファイルを削除するまでの時間
+JOB_REAPER_INTERVAL_SECONDS = 600  # 期限切れジョブの削除を実行する間隔
+JOB_LOG_LIMIT = 500  # ジョブごとに保持するログの件数（古いものから捨てる）
+JOB_EVENT_LIMIT = 1000  # ジョブごとに保持する SSE イベントの件数
+SSE_KEEPALIVE_SECONDS = 15  # イベントがない間に SSE のコメント行を送る間隔（接続の切断防止）
+MAX_CONCURRENT_JOBS = 2  # 同時に合成するジョブ数の上限（超えた分は待ち行列に入る）
+JOB_MEMORY_BUDGET_BYTES = 8 * 1024 ** 3  # 実行中ジョブのメモリ見積もりの合計の上限（Noneで制限なし）
 
 app = Flask(__name__,
             static_folder=os.path.join(os.path.dirname(__file__), '..', 'web'),
@@ -44,14 +70,46 @@ app = Flask(__name__,
 CORS(app)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['RESULTS_FOLDER'] = RESULTS_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max
+app.config['MAX_CONTENT_LENGTH'] = None  # 上限はファイル単位で確認する (MAX_UPLOAD_FILE_BYTES)
 
 # Create directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
 # Global processing state
-processing_jobs = {}
+processing_jobs = JobStore(
+    JOB_DB_PATH, MAX_JOBS_IN_MEMORY, JOB_TTL_SECONDS, JOB_LOG_LIMIT, JOB_EVENT_LIMIT
+)
+job_scheduler = JobScheduler(MAX_CONCURRENT_JOBS, JOB_MEMORY_BUDGET_BYTES)
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='feature-prefetch')
+
+# Operational metrics, exposed in Prometheus text format at /metrics
+metrics = MetricsRegistry()
+jobs_started = metrics.counter('stitch_jobs_started_total', 'Stitching jobs that started processing')
+jobs_finished = metrics.counter(
+    'stitch_jobs_finished_total', 'Stitching jobs that finished, by final status', ['status']
+)
+job_duration = metrics.histogram(
+    'stitch_job_duration_seconds', 'Processing time of stitching jobs, by final status', ['status']
+)
+closeups_accepted = metrics.counter('stitch_closeups_accepted_total', 'Closeups blended onto the canvas')
+closeups_skipped = metrics.counter(
+    'stitch_closeups_skipped_total', 'Closeups that were not blended, by reason', ['reason']
+)
+stage_latency = metrics.histogram(
+    'stitch_stage_seconds', 'Latency of pipeline stages (timing spans)', ['stage']
+)
+uploaded_bytes = metrics.counter('stitch_upload_bytes_total', 'Bytes of uploaded images')
+canvas_bytes = metrics.gauge('stitch_canvas_bytes', 'Memory held by the canvases of running jobs')
+metrics.gauge('stitch_queue_depth', 'Jobs waiting in the scheduler queue').set_function(
+    lambda: job_scheduler.stats()['queued']
+)
+metrics.gauge('stitch_active_jobs', 'Jobs being processed').set_function(
+    lambda: job_scheduler.stats()['running']
+)
+metrics.gauge(
+    'stitch_scheduled_memory_bytes', 'Memory estimate of the running jobs (admission control)'
+).set_function(lambda: job_scheduler.stats()['running_memory_bytes'])
 
 # SIFT detector initialization
 try:
@@ -68,17 +126,6 @@ except AttributeError:
         print("[CRITICAL ERROR] SIFT is not available")
         sys.exit(1)
 
-# FLANNマッチャーの初期化
-if USE_FLANN:
-    # FLANN parameters for SIFT
-    FLANN_INDEX_KDTREE = 1
-    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-    search_params = dict(checks=50)  # より高い値で精度向上、低い値で速度向上
-    flann = cv.FlannBasedMatcher(index_params, search_params)
-else:
-    flann = None
-
-
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -104,19 +151,152 @@ def downsample_for_matching(img, scale=0.5):
     return downsampled, scale
 
 
+class JobCancelled(Exception):
+    """Raised inside a job when /api/cancel has been requested"""
+
+
+def check_cancelled(job_id):
+    """Raise JobCancelled if cancellation was requested for the job"""
+    job = processing_jobs.get(job_id)
+    if job is not None and job['cancel_event'].is_set():
+        raise JobCancelled()
+
+
+def publish_event(job_id, event_type, data):
+    """Append an event to the job's event list and wake up SSE subscribers"""
+    job = processing_jobs.get(job_id)
+    if job is None:
+        return
+    with job['event_cond']:
+        # Event ids start at 1 and increase by one; old events drop out of the ring buffer
+        job['last_event_id'] += 1
+        job['events'].append({'id': job['last_event_id'], 'type': event_type, 'data': data})
+        job['event_cond'].notify_all()
+
+
+def progress_snapshot(job_id):
+    """Progress event payload (status, progress and queue position while queued)"""
+    job = processing_jobs[job_id]
+    data = {'progress': job['progress'], 'status': job['status']}
+    if job['status'] == 'queued':
+        data['queue_position'] = job_scheduler.queue_position(job_id)
+    return data
+
+
+def set_progress(job_id, progress):
+    """Update job progress (percent) and notify subscribers"""
+    if job_id in processing_jobs:
+        processing_jobs[job_id]['progress'] = progress
+        publish_event(job_id, 'progress', progress_snapshot(job_id))
+
+
+def set_status(job_id, status):
+    """Update job status and notify subscribers (terminal statuses end the stream)"""
+    if job_id not in processing_jobs:
+        return
+    job = processing_jobs[job_id]
+    job['status'] = status
+    processing_jobs.save(job_id)
+    publish_event(job_id, 'progress', progress_snapshot(job_id))
+
+    if status in ('completed', 'failed', 'cancelled'):
+        jobs_finished.inc(status=status)
+        publish_event(job_id, *terminal_event(job))
+
+
+def terminal_event(job):
+    """Final SSE event (type, data) for a job in a terminal status"""
+    if job['status'] == 'completed':
+        return 'complete', job.get('stats', {})
+    if job['status'] == 'failed':
+        return 'error', {'error': job.get('error', 'Unknown error')}
+    return 'cancelled', {}
+
+
+def publish_queue_positions():
+    """Notify queued jobs that their queue position changed"""
+    for queued_id in job_scheduler.queued_job_ids():
+        if queued_id in processing_jobs:
+            publish_event(queued_id, 'progress', progress_snapshot(queued_id))
+
+
 def log_message(job_id, message):
     """Add log message to job"""
     if job_id in processing_jobs:
-        processing_jobs[job_id]['logs'].append({
+        log = {
             'timestamp': datetime.now().isoformat(),
             'message': message
-        })
+        }
+        processing_jobs[job_id]['logs'].append(log)
+        publish_event(job_id, 'log', log)
+
+
+def detect_and_compute(img, sift_detector, scale=1.0, path=None, detector_params=None):
+    """
+    Compute SIFT features on a (optionally downsampled) image.
+    When path and detector_params are given, features are cached on disk
+    keyed by file content hash + detector parameters + scale.
+
+    Returns:
+        (points, descriptors) where points is an (N, 2) float32 array
+    """
+    def compute():
+        if scale < 1.0:
+            h, w = img.shape[:2]
+            with span('downsample'):
+                img_for_match = cv.resize(
+                    img, (int(w * scale), int(h * scale)), interpolation=cv.INTER_AREA
+                )
+        else:
+            img_for_match = img
+        with span('detectAndCompute'):
+            img_gray = cv.cvtColor(img_for_match, cv.COLOR_BGR2GRAY)
+            return sift_detector.detectAndCompute(img_gray, None)
+
+    if path is None or detector_params is None:
+        keypoints, descriptors = compute()
+        return keypoints_to_points(keypoints), descriptors
+
+    return cached_detect_and_compute(
+        path, dict(detector_params, scale=scale), compute,
+        FEATURE_CACHE_FOLDER, FEATURE_CACHE_MAX_BYTES, return_points=True
+    )
+
+
+def make_detector_params(params):
+    """SIFT detector parameters for a job (also part of the feature cache key)"""
+    return dict(
+        nfeatures=params.get('max_features', 5000),
+        nOctaveLayers=5,
+        contrastThreshold=0.03,
+        edgeThreshold=15
+    )
+
+
+def feature_scales(params):
+    """
+    Downsampling scales used for feature extraction: (overview scale, closeup scale).
+    The overview scale defaults to the closeup scale (downsample_scale).
+    """
+    downsample_matching = params.get('downsample_matching', True)
+    downsample_scale = params.get('downsample_scale', 0.5)
+    overview_scale = params.get('overview_scale')
+    if overview_scale is None:
+        overview_scale = downsample_scale
+    scale1 = float(overview_scale) if downsample_matching and 0 < overview_scale < 1.0 else 1.0
+    scale2 = downsample_scale if downsample_matching and downsample_scale < 1.0 else 1.0
+    return scale1, scale2
 
 
-def homography_sift(img, k1, d1, job_id=None, params=None, scale1=1.0):
+def homography_sift(img, p1, d1, job_id=None, params=None, scale1=1.0, path=None, stats=None):
     """
     Compute homography using SIFT features
+    (p1: overview keypoint coordinates as an (N, 2) array, d1: overview descriptors)
+
+    stats: optional dict; when no homography is returned, stats['reject_reason'] says why
     """
+    if stats is None:
+        stats = {}
     if params is None:
         params = {
             'min_matches': 12,
@@ -125,7 +305,7 @@ def homography_sift(img, k1, d1, job_id=None, params=None, scale1=1.0):
             'downsample_matching': True,
             'downsample_scale': 0.5,
             'sift_detector': sift,
-            'matcher': None
+            'overview_index': None
         }
 
     try:
@@ -133,81 +313,73 @@ def homography_sift(img, k1, d1, job_id=None, params=None, scale1=1.0):
         downsample_matching = params.get('downsample_matching', True)
         downsample_scale_val = params.get('downsample_scale', 0.5)
         sift_detector = params.get('sift_detector', sift)
-        matcher = params.get('matcher', None)
+        overview_index = params.get('overview_index', None)
 
-        # マッチング用にダウンサンプリング
+        # マッチング用にダウンサンプリングして特徴量を計算（キャッシュがあれば再利用）
         if downsample_matching and downsample_scale_val < 1.0:
-            h, w = img.shape[:2]
-            new_w = int(w * downsample_scale_val)
-            new_h = int(h * downsample_scale_val)
-            img_for_match = cv.resize(img, (new_w, new_h), interpolation=cv.INTER_AREA)
             scale2 = downsample_scale_val
         else:
-            img_for_match = img
             scale2 = 1.0
 
-        img_gray = cv.cvtColor(img_for_match, cv.COLOR_BGR2GRAY)
-        k2, d2 = sift_detector.detectAndCompute(img_gray, None)
+        p2, d2 = detect_and_compute(
+            img, sift_detector, scale2, path, params.get('detector_params')
+        )
 
         if d2 is None or len(d2) < params['min_matches']:
             if job_id:
                 log_message(job_id, f"Not enough features: {len(d2) if d2 is not None else 0}")
+            stats['reject_reason'] = 'not_enough_features'
             return None
 
-        # マッチング（FLANN または BFMatcher）
-        if matcher is not None:
-            matches = matcher.knnMatch(d1, d2, k=2)
-        else:
-            # Fallback to BFMatcher
-            bf = cv.BFMatcher()
-            matches = bf.knnMatch(d1, d2, k=2)
-
-        good = []
-        for m_n in matches:
-            if len(m_n) == 2:
-                m, n = m_n
-                if m.distance < params['ratio_test'] * n.distance:
-                    good.append(m)
-
-        if len(good) < params['min_matches']:
+        # マッチング: closeup の各特徴点について、overview 側インデックスから2近傍を探す
+        if overview_index is None:
+            # Fallback: build an index for this call only
+            overview_index = build_overview_index(d1, use_flann=False)
+
+        with span('knnMatch'):
+            indices, distances = query_overview_index(overview_index, d2, k=2)
+
+        # Lowe's ratio test on the distance arrays (no per-match Python objects)
+        with span('ratio_test'):
+            base_idx, img_idx = ratio_test(indices, distances, params['ratio_test'])
+        good_count = len(img_idx)
+
+        if good_count < params['min_matches']:
             if job_id:
-                log_message(job_id, f"Not enough good matches: {len(good)}/{params['min_matches']}")
+                log_message(job_id, f"Not enough good matches: {good_count}/{params['min_matches']}")
+            stats['reject_reason'] = 'not_enough_matches'
             return None
 
         if job_id:
-            log_message(job_id, f"Found {len(good)} good matches")
+            log_message(job_id, f"Found {good_count} good matches")
 
         # ダウンサンプリングを考慮してキーポイント座標をスケーリング
-        src_pts = np.float32([
-            [k1[m.queryIdx].pt[0] / scale1, k1[m.queryIdx].pt[1] / scale1]
-            for m in good
-        ]).reshape(-1, 1, 2)
-
-        dst_pts = np.float32([
-            [k2[m.trainIdx].pt[0] / scale2, k2[m.trainIdx].pt[1] / scale2]
-            for m in good
-        ]).reshape(-1, 1, 2)
-
-        H, mask = cv.findHomography(
-            dst_pts, src_pts,
-            method=cv.RANSAC,
-            ransacReprojThreshold=params['ransac_threshold'],
-            maxIters=5000,
-            confidence=0.995
-        )
+        src_pts = (p1[base_idx] / scale1).astype(np.float32).reshape(-1, 1, 2)
+        dst_pts = (p2[img_idx] / scale2).astype(np.float32).reshape(-1, 1, 2)
+
+        with span('findHomography'):
+            H, mask = cv.findHomography(
+                dst_pts, src_pts,
+                method=cv.RANSAC,
+                ransacReprojThreshold=params['ransac_threshold'],
+                maxIters=5000,
+                confidence=0.995
+            )
 
         if H is None:
+            stats['reject_reason'] = 'no_homography'
             return None
 
         if mask is not None:
             inliers = np.sum(mask)
-            inlier_ratio = inliers / len(good)
+            inlier_ratio = inliers / good_count
             if job_id:
-                log_message(job_id, f"RANSAC inliers: {inliers}/{len(good)} ({inlier_ratio:.1%})")
+                log_message(job_id, f"RANSAC inliers: {inliers}/{good_count} ({inlier_ratio:.1%})")
 
             if inlier_ratio < 0.03:  # 0.1 → 0.03 に緩和
                 if job_id:
                     log_message(job_id, f"Low inlier ratio: {inlier_ratio:.1%}")
+                stats['reject_reason'] = 'low_inlier_ratio'
                 return None
 
         return H
@@ -215,12 +387,19 @@ def homography_sift(img, k1, d1, job_id=None, params=None, scale1=1.0):
     except Exception as e:
         if job_id:
             log_message(job_id, f"Error in homography_sift: {e}")
+        stats['reject_reason'] = 'error'
         return None
 
 
-def validate_homography(H, job_id=None):
-    """Validate homography matrix"""
+def validate_homography(H, job_id=None, stats=None):
+    """
+    Validate homography matrix
+    (stats: optional dict; when the matrix is rejected, stats['reject_reason'] says why)
+    """
+    if stats is None:
+        stats = {}
     if H is None:
+        stats['reject_reason'] = 'no_homography'
         return False
 
     try:
@@ -228,17 +407,20 @@ def validate_homography(H, job_id=None):
         if cond > 30.0:  # 10.0 → 30.0 に緩和
             if job_id:
                 log_message(job_id, f"High condition number: {cond:.2f}")
+            stats['reject_reason'] = 'high_condition_number'
             return False
 
         det = np.linalg.det(H)
         if det < 0.01 or det > 100.0:  # 0.01 → 0.003, 100.0 → 300.0 に緩和するとやりすぎ。
             if job_id:
                 log_message(job_id, f"Abnormal determinant: {det:.4f}")
+            stats['reject_reason'] = 'abnormal_determinant'
             return False
 
         if abs(H[2, 0]) > 0.01 or abs(H[2, 1]) > 0.01:  # 0.01 → 0.02 に緩和
             if job_id:
                 log_message(job_id, f"Large perspective components")
+            stats['reject_reason'] = 'large_perspective'
             return False
 
         return True
@@ -246,59 +428,134 @@ def validate_homography(H, job_id=None):
     except Exception as e:
         if job_id:
             log_message(job_id, f"Error validating homography: {e}")
+        stats['reject_reason'] = 'error'
         return False
 
 
 def warp_and_blend(canvas, img, H, strength=31):
-    """Warp and blend image onto canvas"""
-    h_canvas, w_canvas = canvas.shape[:2]
-    h_img, w_img = img.shape[:2]
+    """Warp and blend image onto canvas (only within the warped ROI)"""
+    try:
+        warp_and_blend_roi(canvas, img, H, strength)
+
+    except Exception as e:
+        raise Exception(f"Error in warp_and_blend: {e}")
+
+
+def process_single_closeup(path, p1, d1, job_id, sift_params, scale1, Hscale):
+    """
+    Read one closeup and estimate its homography (runs in a worker thread)
+
+    Returns:
+        (filename, status, H_to_canvas, img, error_msg)
+    """
+    filename = os.path.basename(path)
+
+    def skip(error_msg, reason):
+        closeups_skipped.inc(reason=reason)
+        return (filename, 'skip', None, None, error_msg)
 
     try:
-        warped = cv.warpPerspective(img, H, (w_canvas, h_canvas))
-        mask = np.ones((h_img, w_img), dtype=np.uint8) * 255
-        mask_warped = cv.warpPerspective(mask, H, (w_canvas, h_canvas))
+        # 中断されたジョブの残りのクローズアップは読み込まずに返す
+        job = processing_jobs[job_id]
+        if job['cancel_event'].is_set():
+            return skip('cancelled', 'cancelled')
+
+        # Spans measured below are recorded for this closeup in the job's timing report
+        stats = {}
+        with job['timing'].scope(filename):
+            with span('imread'):
+                img = cv.imread(path)
+            if img is None:
+                return skip('Failed to read', 'read_failed')
 
-        blend_strength = strength if strength % 2 == 1 else strength + 1
-        mask_blur = cv.GaussianBlur(mask_warped, (blend_strength, blend_strength), 0)
-        mask_float = mask_blur.astype(np.float32) / 255.0
-        mask_float_3ch = cv.cvtColor(mask_float, cv.COLOR_GRAY2BGR)
+            H = homography_sift(img, p1, d1, job_id, sift_params, scale1=scale1, path=path, stats=stats)
+            if H is None:
+                return skip('homography failed', stats.get('reject_reason', 'no_homography'))
 
-        canvas_float = canvas.astype(np.float32)
-        warped_float = warped.astype(np.float32)
+            with span('validate'):
+                valid = validate_homography(H, job_id, stats)
+            if not valid:
+                return skip('invalid homography', stats.get('reject_reason', 'invalid_homography'))
 
-        blended = (canvas_float * (1.0 - mask_float_3ch) + warped_float * mask_float_3ch)
-        canvas[:] = np.clip(blended, 0, 255).astype(np.uint8)
+        return (filename, 'success', Hscale @ H, img, None)
 
     except Exception as e:
-        raise Exception(f"Error in warp_and_blend: {e}")
+        return skip(f'Error: {e}', 'error')
+
+
+def prefetch_features(job_id, path, kind):
+    """
+    Compute and cache SIFT features for an uploaded file while the rest is still uploading.
+    Uses the stitching params given at job creation, so process_stitching hits the cache.
+    """
+    job = processing_jobs.get(job_id)
+    if job is None or job['cancel_event'].is_set():
+        return
+
+    params = job.get('prefetch_params') or {}
+    img = cv.imread(path)
+    if img is None:
+        return
+    scale1, scale2 = feature_scales(params)
+    detector_params = make_detector_params(params)
+    detect_and_compute(
+        img, cv.SIFT_create(**detector_params), scale1 if kind == 'overview' else scale2,
+        path, detector_params
+    )
+
+
+def wait_for_prefetch(job_id):
+    """Drop prefetches that have not started and wait for the running ones"""
+    futures = processing_jobs[job_id].pop('prefetch_futures', [])
+    for future in futures:
+        future.cancel()
+    wait(futures)
 
 
 def process_stitching(job_id, overview_path, closeup_paths, params):
     """
     Main stitching processing function (runs in background thread)
     """
+    started_at = time.monotonic()
+    canvas_nbytes = 0
     try:
-        processing_jobs[job_id]['status'] = 'processing'
+        check_cancelled(job_id)
+        set_status(job_id, 'processing')
+        jobs_started.inc()
+        publish_queue_positions()
         log_message(job_id, 'Starting image stitching process')
 
+        # Per-stage timing: spans on this thread (overview, canvas, save) count for the whole job,
+        # worker threads record theirs per closeup (see process_single_closeup)
+        timing = TimingRecorder(on_span=lambda name, seconds: stage_latency.observe(seconds, stage=name))
+        timing.bind()
+        processing_jobs[job_id]['timing'] = timing
+
+        # Features computed during a chunked upload are picked up from the feature cache
+        wait_for_prefetch(job_id)
+
         # Load overview image
         log_message(job_id, f'Loading overview image: {overview_path}')
-        base = cv.imread(overview_path)
+        with span('imread'):
+            base = cv.imread(overview_path)
         if base is None:
             raise Exception(f'Failed to read overview image')
 
-        processing_jobs[job_id]['progress'] = 10
+        set_progress(job_id, 10)
 
         # Prepare canvas
         h_base, w_base = base.shape[:2]
         canvas_scale = params.get('canvas_scale', 2)
         new_w = w_base * canvas_scale
         new_h = h_base * canvas_scale
-        canvas = cv.resize(base, (new_w, new_h), interpolation=cv.INTER_CUBIC)
+        with span('canvas'):
+            canvas = cv.resize(base, (new_w, new_h), interpolation=cv.INTER_CUBIC)
+        canvas_nbytes = canvas.nbytes
+        canvas_bytes.inc(canvas_nbytes)
 
         log_message(job_id, f'Canvas created: {new_w}x{new_h} (scale: {canvas_scale}x)')
-        processing_jobs[job_id]['progress'] = 20
+        set_progress(job_id, 20)
+        check_cancelled(job_id)
 
         # Extract advanced parameters
         use_flann = params.get('use_flann', True)
@@ -310,34 +567,60 @@ def process_stitching(job_id, overview_path, closeup_paths, params):
 
         # Create SIFT detector with dynamic max_features
         log_message(job_id, f'Initializing SIFT detector (max_features={max_features})')
-        sift_detector = cv.SIFT_create(
-            nfeatures=max_features,
-            nOctaveLayers=5,
-            contrastThreshold=0.03,
-            edgeThreshold=15
+        sift_detector_params = make_detector_params(params)
+        sift_detector = cv.SIFT_create(**sift_detector_params)
+
+        # Feature cache (keyed by image content hash + detector parameters)
+        use_feature_cache = params.get('use_feature_cache', True)
+        detector_params = sift_detector_params if use_feature_cache else None
+
+        # Overview feature scale (independent of the closeup scale; defaults to the same value)
+        # p1 stays in downsampled coordinates and is divided by scale1 in homography_sift,
+        # so homographies always map closeup pixels to base (overview) pixels.
+        scale1, _ = feature_scales(params)
+
+        # Split cores between per-closeup workers and OpenCV's internal threads
+        sorted_paths = sorted(closeup_paths)
+        thread_plan = plan_thread_budget(
+            len(sorted_paths),
+            estimate_image_pixels(sorted_paths[0] if sorted_paths else None),
+            max_workers=max_workers if use_parallel else 1,
+            mode=params.get('thread_budget', THREAD_BUDGET_MODE),
+            # 同時に実行されるジョブでコアを分け合う
+            cpus=max(1, multiprocessing.cpu_count() // MAX_CONCURRENT_JOBS)
         )
+        log_message(job_id, f'[CONFIG] {describe_thread_budget(thread_plan)}')
 
-        # Create matcher based on use_flann parameter
+        # Compute base SIFT features (cached per content hash + parameters + scale)
+        apply_stage_threads(thread_plan['single_cv_threads'])
+        log_message(job_id, f'Computing SIFT features for overview image (scale={scale1:.2f})')
+        p1, d1 = detect_and_compute(
+            base, sift_detector, scale1, overview_path, detector_params
+        )
+
+        if d1 is None or len(p1) == 0:
+            raise Exception('Failed to compute SIFT features from overview image')
+
+        log_message(job_id, f'Found {len(p1)} SIFT keypoints in overview')
+        check_cancelled(job_id)
+
+        # Build the matcher index over the overview descriptors once per job
+        # (shared read-only by all workers; persisted FLANN indexes are reused)
         if use_flann:
             log_message(job_id, 'Using FLANN matcher (fast mode)')
-            FLANN_INDEX_KDTREE = 1
-            index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-            search_params = dict(checks=50)
-            matcher = cv.FlannBasedMatcher(index_params, search_params)
         else:
             log_message(job_id, 'Using BFMatcher (accurate mode)')
-            matcher = cv.BFMatcher()
-
-        # Compute base SIFT features
-        log_message(job_id, 'Computing SIFT features for overview image')
-        base_gray = cv.cvtColor(base, cv.COLOR_BGR2GRAY)
-        k1, d1 = sift_detector.detectAndCompute(base_gray, None)
-
-        if d1 is None or len(k1) == 0:
-            raise Exception('Failed to compute SIFT features from overview image')
+        with span('build_index'):
+            overview_index = build_overview_index(
+                d1, use_flann=use_flann,
+                cache_dir=FEATURE_CACHE_FOLDER if use_feature_cache else None,
+                cache_max_bytes=FEATURE_CACHE_MAX_BYTES
+            )
+        if overview_index['loaded']:
+            log_message(job_id, 'Loaded saved FLANN index for overview')
 
-        log_message(job_id, f'Found {len(k1)} SIFT keypoints in overview')
-        processing_jobs[job_id]['progress'] = 30
+        set_progress(job_id, 30)
+        check_cancelled(job_id)
 
         # Scaling matrix
         Hscale = np.array([
@@ -358,69 +641,142 @@ def process_stitching(job_id, overview_path, closeup_paths, params):
             'downsample_matching': downsample_matching,
             'downsample_scale': downsample_scale,
             'sift_detector': sift_detector,
-            'matcher': matcher
+            'detector_params': detector_params,
+            'overview_index': overview_index
         }
+        strength = params.get('strength', 31)
+        closeup_results = {}  # filename -> status, homography to the canvas, skip reason
 
-        for idx, path in enumerate(sorted(closeup_paths)):
-            filename = os.path.basename(path)
-            log_message(job_id, f'Processing [{idx+1}/{total_closeups}]: {filename}')
-
-            img = cv.imread(path)
-            if img is None:
-                log_message(job_id, f'Failed to read: {filename}')
-                skip_count += 1
-                continue
-
-            # Compute homography
-            H = homography_sift(img, k1, d1, job_id, sift_params, scale1=1.0)
+        def blend_result(result):
+            """Blend one worker result onto the canvas (main job thread only)"""
+            nonlocal success_count, skip_count
+            filename, status, H_to_canvas, img, error_msg = result
 
-            if H is None:
-                log_message(job_id, f'Skipped (homography failed): {filename}')
+            if status == 'skip':
+                log_message(job_id, f'Skipped ({error_msg}): {filename}')
                 skip_count += 1
-                continue
+                closeup_results[filename] = {'status': 'skip', 'H': None, 'error': error_msg}
+                return
 
-            # Validate homography
-            if not validate_homography(H, job_id):
-                log_message(job_id, f'Skipped (invalid homography): {filename}')
-                skip_count += 1
-                continue
-
-            # Blend
             try:
-                H_to_canvas = Hscale @ H
-                strength = params.get('strength', 31)
-                warp_and_blend(canvas, img, H_to_canvas, strength)
+                with timing.scope(filename):
+                    warp_and_blend(canvas, img, H_to_canvas, strength)
                 log_message(job_id, f'Blended: {filename}')
                 success_count += 1
+                closeups_accepted.inc()
+                closeup_results[filename] = {
+                    'status': 'success', 'H': np.asarray(H_to_canvas, dtype=np.float64).tolist(), 'error': None
+                }
             except Exception as e:
                 log_message(job_id, f'Error blending {filename}: {e}')
                 skip_count += 1
+                closeups_skipped.inc(reason='blend_error')
+                closeup_results[filename] = {'status': 'skip', 'H': None, 'error': f'Error blending: {e}'}
+
+        if use_parallel:
+            workers = thread_plan['workers']
+            log_message(
+                job_id,
+                f"Using parallel processing with {workers} workers "
+                f"({thread_plan['cv_threads']} OpenCV threads each)"
+            )
+            apply_stage_threads(thread_plan['cv_threads'])
+
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                future_to_index = {
+                    executor.submit(
+                        process_single_closeup, path, p1, d1, job_id,
+                        sift_params, scale1, Hscale
+                    ): idx
+                    for idx, path in enumerate(sorted_paths)
+                }
+
+                # Results are blended in filename order: completed futures wait
+                # in `pending` until every earlier closeup has been blended
+                pending = {}
+                next_index = 0
+                completed = 0
+
+                for future in as_completed(future_to_index):
+                    check_cancelled(job_id)
+                    idx = future_to_index[future]
+                    try:
+                        pending[idx] = future.result()
+                    except Exception as e:
+                        filename = os.path.basename(sorted_paths[idx])
+                        pending[idx] = (filename, 'skip', None, None, f'Error: {e}')
+
+                    completed += 1
+                    log_message(job_id, f'Matched [{completed}/{total_closeups}]: {pending[idx][0]}')
+
+                    while next_index in pending:
+                        blend_result(pending.pop(next_index))
+                        next_index += 1
+
+                    # Update progress
+                    progress = 30 + int(completed / total_closeups * 60)
+                    set_progress(job_id, progress)
+            finally:
+                # On cancellation drop closeups that have not started yet
+                executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            log_message(job_id, 'Using sequential processing')
+            apply_stage_threads(thread_plan['cv_threads'])
+
+            for idx, path in enumerate(sorted_paths):
+                check_cancelled(job_id)
+                filename = os.path.basename(path)
+                log_message(job_id, f'Processing [{idx+1}/{total_closeups}]: {filename}')
 
-            # Update progress
-            progress = 30 + int((idx + 1) / total_closeups * 60)
-            processing_jobs[job_id]['progress'] = progress
+                blend_result(process_single_closeup(
+                    path, p1, d1, job_id, sift_params, scale1, Hscale
+                ))
+
+                # Update progress
+                progress = 30 + int((idx + 1) / total_closeups * 60)
+                set_progress(job_id, progress)
 
         # Save result
-        processing_jobs[job_id]['progress'] = 95
+        check_cancelled(job_id)
+        set_progress(job_id, 95)
         result_path = os.path.join(app.config['RESULTS_FOLDER'], f'{job_id}.png')
-        cv.imwrite(result_path, canvas)
+        with span('imwrite'):
+            cv.imwrite(result_path, canvas)
 
         log_message(job_id, f'Result saved: {result_path}')
         log_message(job_id, f'Processing complete - Success: {success_count}, Skipped: {skip_count}')
+        timing_report = timing.report()
+        for line in format_timing_report(timing_report):
+            log_message(job_id, f'[TIMING] {line}')
 
-        processing_jobs[job_id]['status'] = 'completed'
         processing_jobs[job_id]['progress'] = 100
         processing_jobs[job_id]['result_path'] = result_path
         processing_jobs[job_id]['stats'] = {
             'success_count': success_count,
             'skip_count': skip_count,
-            'total_closeups': total_closeups
+            'total_closeups': total_closeups,
+            'canvas_scale': canvas_scale,
+            'closeups': closeup_results,
+            'timing': timing_report
         }
+        set_status(job_id, 'completed')
+
+    except JobCancelled:
+        canvas = None  # free the canvas before the job thread picks up the next job
+        log_message(job_id, 'Processing cancelled')
+        set_status(job_id, 'cancelled')
 
     except Exception as e:
         log_message(job_id, f'Error: {str(e)}')
-        processing_jobs[job_id]['status'] = 'failed'
         processing_jobs[job_id]['error'] = str(e)
+        set_status(job_id, 'failed')
+
+    finally:
+        canvas_bytes.dec(canvas_nbytes)
+        job = processing_jobs.get(job_id)
+        if job is not None and job['status'] in ('completed', 'failed', 'cancelled'):
+            job_duration.observe(time.monotonic() - started_at, status=job['status'])
 
 
 @app.route('/')
@@ -429,9 +785,43 @@ def index():
     return send_file(os.path.join(os.path.dirname(__file__), '..', 'web', 'index.html'))
 
 
+def save_upload(file, path):
+    """
+    Stream an uploaded part to disk, stopping at MAX_UPLOAD_FILE_BYTES.
+    (The multipart parser may still buffer the part in a temporary file; large sets should use
+    the chunked upload, which streams the request body directly.)
+
+    Returns:
+        bool: False if the file is larger than the limit (the partial file is removed)
+    """
+    written = 0
+    with open(path, 'wb') as f:
+        while True:
+            chunk = file.stream.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > MAX_UPLOAD_FILE_BYTES:
+                break
+            f.write(chunk)
+    uploaded_bytes.inc(min(written, MAX_UPLOAD_FILE_BYTES))
+    if written > MAX_UPLOAD_FILE_BYTES:
+        os.remove(path)
+        return False
+    return True
+
+
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
     """Handle image uploads"""
+    job_dir = None
+
+    def reject(error, code):
+        # Nothing is registered for a rejected upload, so its files would never be cleaned up
+        if job_dir is not None:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({'error': error}), code
+
     try:
         # Check if files are present
         if 'overview' not in request.files:
@@ -448,11 +838,12 @@ def upload_files():
         # Save overview
         overview_file = request.files['overview']
         if not allowed_file(overview_file.filename):
-            return jsonify({'error': 'Invalid overview file type'}), 400
+            return reject('Invalid overview file type', 400)
 
         overview_filename = secure_filename(overview_file.filename)
         overview_path = os.path.join(job_dir, f'overview_{overview_filename}')
-        overview_file.save(overview_path)
+        if not save_upload(overview_file, overview_path):
+            return reject(f'File too large: {overview_filename}', 413)
 
         # Save closeups
         closeup_files = request.files.getlist('closeups')
@@ -464,21 +855,21 @@ def upload_files():
 
             closeup_filename = secure_filename(closeup_file.filename)
             closeup_path = os.path.join(job_dir, f'closeup_{idx:03d}_{closeup_filename}')
-            closeup_file.save(closeup_path)
+            if not save_upload(closeup_file, closeup_path):
+                return reject(f'File too large: {closeup_filename}', 413)
             closeup_paths.append(closeup_path)
 
         if not closeup_paths:
-            return jsonify({'error': 'No valid closeup images uploaded'}), 400
+            return reject('No valid closeup images uploaded', 400)
 
         # Initialize job
-        processing_jobs[job_id] = {
+        processing_jobs.create(job_id, {
             'status': 'uploaded',
             'progress': 0,
             'overview_path': overview_path,
             'closeup_paths': closeup_paths,
-            'logs': [],
             'created_at': datetime.now().isoformat()
-        }
+        })
 
         return jsonify({
             'job_id': job_id,
@@ -487,7 +878,206 @@ def upload_files():
         }), 200
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return reject(str(e), 500)
+
+
+def upload_target(job_id, kind, filename, index=None):
+    """
+    Destination path of a chunked upload (None if the kind/filename/index is invalid).
+    Closeups are keyed on the client's index like the legacy upload (closeup_{idx:03d}_...),
+    so names that sanitize to the same string (e.g. non-ASCII names) do not collide.
+    """
+    if kind not in ('overview', 'closeup') or not allowed_file(filename):
+        return None
+    stem, ext = filename.rsplit('.', 1)
+    stem = secure_filename(stem)
+    if kind == 'closeup':
+        if index is None or index < 0:
+            return None
+        prefix = f'closeup_{index:03d}'
+    else:
+        prefix = 'overview'
+    name = f'{prefix}_{stem}.{ext.lower()}' if stem else f'{prefix}.{ext.lower()}'
+    return os.path.join(app.config['UPLOAD_FOLDER'], job_id, name)
+
+
+def closeup_index(path):
+    """Client index of a chunked closeup upload (from closeup_{idx:03d}_...)"""
+    return int(re.match(r'closeup_(\d+)', os.path.basename(path)).group(1))
+
+
+def index_in_use(path):
+    """Whether another file was already uploaded (or is uploading) with the same closeup index"""
+    job_dir, name = os.path.split(path)
+    prefix = f'closeup_{closeup_index(path):03d}'
+    for other in os.listdir(job_dir):
+        other = other[:-len('.part')] if other.endswith('.part') else other
+        if other != name and re.match(rf'{prefix}[._]', other):
+            return True
+    return False
+
+
+def parse_content_range(header, content_length):
+    """
+    Parse 'bytes start-end/total'. Without the header the body is the whole file.
+
+    Returns:
+        (start, end, total) with end exclusive, or None if malformed or the body is empty
+    """
+    if not content_length:
+        return None  # an empty body would register an empty file as complete
+    if not header:
+        return 0, content_length, content_length
+    m = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+)', header.strip())
+    if not m:
+        return None
+    start, end, total = int(m.group(1)), int(m.group(2)) + 1, int(m.group(3))
+    if not start < end <= total:
+        return None
+    return start, end, total
+
+
+def received_bytes(path):
+    """Bytes already stored for a chunked upload and whether it is complete"""
+    if os.path.exists(path):
+        return os.path.getsize(path), True
+    if os.path.exists(path + '.part'):
+        return os.path.getsize(path + '.part'), False
+    return 0, False
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Create an empty job for chunked uploads"""
+    data = request.get_json(silent=True) or {}
+    job_id = str(uuid.uuid4())
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], job_id), exist_ok=True)
+
+    job = processing_jobs.create(job_id, {
+        'status': 'uploading',
+        'progress': 0,
+        'overview_path': None,
+        'closeup_paths': [],
+        'created_at': datetime.now().isoformat()
+    })
+    # Stitching params to extract features with while uploading (feature cache must be on)
+    if data.get('prefetch_features') and data.get('params', {}).get('use_feature_cache', True):
+        job['prefetch_params'] = data.get('params', {})
+
+    return jsonify({'job_id': job_id}), 200
+
+
+@app.route('/api/upload/<job_id>/<kind>/<filename>', methods=['GET'])
+def get_upload_offset(job_id, kind, filename):
+    """Number of bytes received so far (to resume an interrupted upload)"""
+    if job_id not in processing_jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    path = upload_target(job_id, kind, filename, request.args.get('index', type=int))
+    if path is None:
+        return jsonify({'error': 'Invalid file'}), 400
+
+    offset, complete = received_bytes(path)
+    return jsonify({'offset': offset, 'complete': complete}), 200
+
+
+@app.route('/api/upload/<job_id>/<kind>/<filename>', methods=['PUT'])
+def upload_chunk(job_id, kind, filename):
+    """
+    Append one chunk of a file (Content-Range: bytes start-end/total).
+    The body is streamed to disk; the file is registered when the last byte arrives.
+    """
+    if job_id not in processing_jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    job = processing_jobs[job_id]
+    if job['status'] != 'uploading':
+        return jsonify({'error': 'Job is not accepting uploads'}), 400
+
+    path = upload_target(job_id, kind, filename, request.args.get('index', type=int))
+    if path is None:
+        return jsonify({'error': 'Invalid file'}), 400
+
+    content_range = parse_content_range(request.headers.get('Content-Range'), request.content_length)
+    if content_range is None:
+        return jsonify({'error': 'Invalid Content-Range'}), 400
+    start, end, total = content_range
+    if total > MAX_UPLOAD_FILE_BYTES:
+        return jsonify({'error': f'File too large (max {MAX_UPLOAD_FILE_BYTES} bytes)'}), 413
+
+    part_path = path + '.part'
+    if os.path.exists(path):
+        # Already complete: a retry of the last chunk or a duplicate name/index; keep the file
+        return jsonify({
+            'error': 'File already uploaded', 'offset': os.path.getsize(path), 'complete': True
+        }), 409
+    if kind == 'closeup' and index_in_use(path):
+        return jsonify({'error': 'Closeup index already used by another file'}), 409
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if start != offset:
+        return jsonify({'error': 'Chunk does not start at the current offset', 'offset': offset}), 409
+
+    try:
+        with open(part_path, 'ab') as f:
+            remaining = end - start
+            while remaining > 0:
+                chunk = request.stream.read(min(UPLOAD_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        uploaded_bytes.inc(end - start - remaining)
+        offset = os.path.getsize(part_path)
+
+        if offset < total:
+            return jsonify({'offset': offset, 'complete': False}), 200
+
+        os.replace(part_path, path)
+    except OSError:
+        # The upload directory was removed by /api/cancel while this chunk was being written
+        if job['status'] != 'uploading':
+            return jsonify({'error': 'Job is not accepting uploads'}), 400
+        raise
+    if job['status'] != 'uploading':
+        return jsonify({'error': 'Job is not accepting uploads'}), 400
+    if kind == 'overview':
+        job['overview_path'] = path
+    elif path not in job['closeup_paths']:
+        job['closeup_paths'].append(path)
+    processing_jobs.save(job_id)
+
+    if job.get('prefetch_params') is not None:
+        job.setdefault('prefetch_futures', []).append(
+            prefetch_executor.submit(prefetch_features, job_id, path, kind)
+        )
+
+    return jsonify({'offset': offset, 'complete': True}), 200
+
+
+@app.route('/api/upload/<job_id>/complete', methods=['POST'])
+def complete_upload(job_id):
+    """Finish a chunked upload; the job can then be started with /api/stitch"""
+    if job_id not in processing_jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    job = processing_jobs[job_id]
+    if job['status'] != 'uploading':
+        return jsonify({'error': 'Job is not accepting uploads'}), 400
+
+    job_dir = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
+    partial = [os.path.basename(p)[:-len('.part')] for p in glob.glob(os.path.join(job_dir, '*.part'))]
+    if partial:
+        return jsonify({'error': 'Incomplete uploads', 'files': partial}), 400
+    if not job['overview_path']:
+        return jsonify({'error': 'Overview image is required'}), 400
+    if not job['closeup_paths']:
+        return jsonify({'error': 'At least one closeup image is required'}), 400
+
+    job['closeup_paths'].sort(key=closeup_index)
+    set_status(job_id, 'uploaded')
+
+    return jsonify({
+        'job_id': job_id,
+        'overview_count': 1,
+        'closeup_count': len(job['closeup_paths'])
+    }), 200
 
 
 @app.route('/api/stitch', methods=['POST'])
@@ -505,26 +1095,73 @@ def start_stitching():
 
         # Get parameters
         params = data.get('params', {})
+        priority = int(data.get('priority', 0))  # 小さいほど先に実行
 
-        # Start processing in background thread
-        thread = threading.Thread(
-            target=process_stitching,
-            args=(
-                job_id,
-                processing_jobs[job_id]['overview_path'],
-                processing_jobs[job_id]['closeup_paths'],
-                params
-            )
+        # Admission control: estimate canvas memory from the overview size x canvas_scale
+        job = processing_jobs[job_id]
+        memory_estimate = estimate_job_memory(
+            estimate_image_pixels(job['overview_path']),
+            float(params.get('canvas_scale', 2))
         )
-        thread.daemon = True
-        thread.start()
+        job['status'] = 'queued'
+        job['memory_estimate'] = memory_estimate
+        processing_jobs.save(job_id)
+        position = job_scheduler.submit(
+            job_id,
+            process_stitching,
+            args=(job_id, job['overview_path'], job['closeup_paths'], params),
+            priority=priority,
+            memory_estimate=memory_estimate
+        )
+        if position:
+            log_message(job_id, f'Queued at position {position} (estimated memory: {memory_estimate / 1024 ** 2:.0f} MB)')
+            publish_queue_positions()
 
-        return jsonify({'status': 'started', 'job_id': job_id}), 200
+        return jsonify({
+            'status': 'queued' if position else 'started',
+            'job_id': job_id,
+            'queue_position': position
+        }), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/cancel/<job_id>', methods=['POST'])
+def cancel_stitching(job_id):
+    """Cancel a queued or running job"""
+    if job_id not in processing_jobs:
+        return jsonify({'error': 'Job not found'}), 404
+
+    job = processing_jobs[job_id]
+    if job['status'] in ('completed', 'failed', 'cancelled'):
+        return jsonify({'error': f"Job already {job['status']}"}), 400
+
+    job['cancel_event'].set()
+
+    # A job still receiving chunks is cancelled right away and its partial uploads are dropped
+    if job['status'] == 'uploading':
+        job.pop('prefetch_params', None)
+        job['overview_path'] = None
+        job['closeup_paths'] = []
+        log_message(job_id, 'Upload cancelled')
+        set_status(job_id, 'cancelled')
+        wait_for_prefetch(job_id)
+        shutil.rmtree(os.path.join(app.config['UPLOAD_FOLDER'], job_id), ignore_errors=True)
+        return jsonify({'status': 'cancelled', 'job_id': job_id}), 200
+
+    # A job that has not started yet is removed from the queue right away;
+    # a running job stops at its next check (between closeups / stages)
+    if job['status'] == 'uploaded' or job_scheduler.remove(job_id):
+        log_message(job_id, 'Processing cancelled')
+        set_status(job_id, 'cancelled')
+        publish_queue_positions()
+        return jsonify({'status': 'cancelled', 'job_id': job_id}), 200
+
+    log_message(job_id, 'Cancellation requested')
+    return jsonify({'status': 'cancelling', 'job_id': job_id}), 200
+
+
 @app.route('/api/status/<job_id>')
 def get_status(job_id):
     """Get job status"""
@@ -536,10 +1173,12 @@ def get_status(job_id):
         'job_id': job_id,
         'status': job['status'],
         'progress': job['progress'],
-        'logs': job['logs'][-10:],  # Last 10 logs
+        'logs': list(job['logs'])[-10:],  # Last 10 logs
     }
 
-    if job['status'] == 'completed':
+    if job['status'] == 'queued':
+        response['queue_position'] = job_scheduler.queue_position(job_id)
+    elif job['status'] == 'completed':
         response['stats'] = job.get('stats', {})
     elif job['status'] == 'failed':
         response['error'] = job.get('error', 'Unknown error')
@@ -550,35 +1189,56 @@ def get_status(job_id):
 @app.route('/api/stream/<job_id>')
 def stream_status(job_id):
     """Server-Sent Events stream for real-time updates"""
+    if job_id not in processing_jobs:
+        return Response(f"data: {json.dumps({'error': 'Job not found'})}\n\n", mimetype='text/event-stream')
+
+    # A reconnecting EventSource sends the id of the last event it received;
+    # only the events after it are sent again
+    try:
+        last_event_id = max(0, int(request.headers.get('Last-Event-ID', 0)))
+    except ValueError:
+        last_event_id = 0
+
+    job = processing_jobs[job_id]
+    cond = job['event_cond']
+    events = job['events']
+
     def generate():
-        last_log_count = 0
+        sent = last_event_id
+        yield 'retry: 2000\n\n'
         while True:
-            if job_id not in processing_jobs:
-                yield f"data: {json.dumps({'error': 'Job not found'})}\n\n"
-                break
-
-            job = processing_jobs[job_id]
+            # Sleep until log_message / set_progress / set_status publishes something
+            with cond:
+                if job['last_event_id'] <= sent and job['status'] in ('completed', 'failed', 'cancelled'):
+                    # Nothing newer is buffered (a job reloaded from SQLite has no
+                    # events at all); send the final event again so the client
+                    # closes the stream instead of reconnecting forever
+                    event_type, data = terminal_event(job)
+                    new_events = [{'id': max(sent, job['last_event_id']), 'type': event_type, 'data': data}]
+                elif cond.wait_for(lambda: job['last_event_id'] > sent, timeout=SSE_KEEPALIVE_SECONDS):
+                    new_events = [event for event in events if event['id'] > sent]
+                else:
+                    new_events = None
 
-            # Send new logs only
-            new_logs = job['logs'][last_log_count:]
-            if new_logs:
-                for log in new_logs:
-                    yield f"data: {json.dumps({'type': 'log', 'data': log})}\n\n"
-                last_log_count = len(job['logs'])
+            if new_events is None:
+                yield ': keepalive\n\n'
+                continue
 
-            # Send progress update
-            yield f"data: {json.dumps({'type': 'progress', 'data': {'progress': job['progress'], 'status': job['status']}})}\n\n"
+            for event in new_events:
+                payload = json.dumps({'type': event['type'], 'data': event['data']})
+                yield f"id: {event['id']}\ndata: {payload}\n\n"
+                if event['type'] in ('complete', 'error', 'cancelled'):
+                    return
+            sent = new_events[-1]['id']
 
-            if job['status'] in ['completed', 'failed']:
-                if job['status'] == 'completed':
-                    yield f"data: {json.dumps({'type': 'complete', 'data': job.get('stats', {})})}\n\n"
-                else:
-                    yield f"data: {json.dumps({'type': 'error', 'data': {'error': job.get('error', 'Unknown error')}})}\n\n"
-                break
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-            time.sleep(0.5)
 
-    return Response(generate(), mimetype='text/event-stream')
+@app.route('/metrics')
+def get_metrics():
+    """Server metrics in Prometheus text format (jobs, closeups, stage latencies, queue, uploads)"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 
 @app.route('/api/result/<job_id>')
@@ -617,8 +1277,32 @@ def download_result(job_id):
     return send_file(result_path, as_attachment=True, download_name='stitched_result.png')
 
 
+def remove_job_files(expired):
+    """Delete uploads and results of expired jobs, plus files of jobs no longer in the store"""
+    for job_id, job in expired.items():
+        shutil.rmtree(os.path.join(app.config['UPLOAD_FOLDER'], job_id), ignore_errors=True)
+        if job.get('result_path') and os.path.exists(job['result_path']):
+            os.remove(job['result_path'])
+
+    # Files left behind by jobs that are unknown to the store (e.g. created before it existed)
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for path in glob.glob(os.path.join(app.config['UPLOAD_FOLDER'], '*')):
+        if os.path.getmtime(path) < cutoff and os.path.basename(path) not in processing_jobs:
+            shutil.rmtree(path, ignore_errors=True)
+    for path in glob.glob(os.path.join(app.config['RESULTS_FOLDER'], '*.png')):
+        job_id = os.path.splitext(os.path.basename(path))[0]
+        if os.path.getmtime(path) < cutoff and job_id not in processing_jobs:
+            os.remove(path)
+
+
+def start_job_reaper():
+    """Start the background thread that removes expired jobs and their files"""
+    return processing_jobs.start_reaper(JOB_REAPER_INTERVAL_SECONDS, remove_job_files)
+
+
 if __name__ == '__main__':
     print("Starting SIFT Image Stitching API Server...")
     print(f"Upload folder: {UPLOAD_FOLDER}")
     print(f"Results folder: {RESULTS_FOLDER}")
+    start_job_reaper()
     app.run(debug=True, host='127.0.0.1', port=5000, threaded=True)
@@ -0,0 +1,502 @@
+"""
+ワープとブレンディングの共通処理。
+
+src/main.py と src/api.py の warp_and_blend から利用される。
+クローズアップの四隅を H で射影して canvas 上の書き込み範囲(ROI)を求め、
+ワープ・マスク生成・ブレンディングをその範囲内だけで行う。
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import cv2 as cv
+import numpy as np
+
+from timing import span
+
+
+def odd_strength(strength):
+    """
+    ブレンディング強度をガウシアンカーネルサイズとして使える奇数に揃える。
+    """
+    return strength if strength % 2 == 1 else strength + 1
+
+
+def compute_warp_roi(H, img_shape, canvas_shape, margin=0):
+    """
+    img を H でワープしたときに canvas 上で値が入りうる矩形範囲を求める。
+
+    Args:
+        H: img 座標系 -> canvas 座標系のホモグラフィ
+        img_shape: ワープ元画像の shape
+        canvas_shape: canvas の shape
+        margin: 矩形の外側に追加する余白（ピクセル）
+
+    Returns:
+        (x0, y0, x1, y1) の矩形（canvas 内にクリップ済み）。canvas と重ならない場合は None
+    """
+    h_img, w_img = img_shape[:2]
+    h_canvas, w_canvas = canvas_shape[:2]
+    H = np.asarray(H, dtype=np.float64)
+
+    # バイリニア補間で値が入りうる範囲まで含めるため 1px 外側の四隅を使う
+    corners = np.array([
+        [-1, -1], [w_img, -1], [w_img, h_img], [-1, h_img]
+    ], dtype=np.float64)
+
+    # 射影の分母が 0 以下になる頂点がある場合は範囲が求まらないので canvas 全体とする
+    denom = corners @ H[2, :2] + H[2, 2]
+    if np.any(denom <= 1e-9):
+        return (0, 0, w_canvas, h_canvas)
+
+    projected = cv.perspectiveTransform(corners.reshape(-1, 1, 2), H).reshape(-1, 2)
+    if not np.all(np.isfinite(projected)):
+        return (0, 0, w_canvas, h_canvas)
+
+    x0 = max(int(np.floor(projected[:, 0].min())) - margin, 0)
+    y0 = max(int(np.floor(projected[:, 1].min())) - margin, 0)
+    x1 = min(int(np.ceil(projected[:, 0].max())) + margin + 1, w_canvas)
+    y1 = min(int(np.ceil(projected[:, 1].max())) + margin + 1, h_canvas)
+
+    if x0 >= x1 or y0 >= y1:
+        return None
+
+    return (x0, y0, x1, y1)
+
+
+def translate_homography(H, x0, y0):
+    """
+    canvas 座標系のホモグラフィを、(x0, y0) を原点とする部分矩形の座標系に平行移動する。
+    """
+    T = np.array([
+        [1, 0, -x0],
+        [0, 1, -y0],
+        [0, 0, 1]
+    ], dtype=np.float64)
+    return T @ np.asarray(H, dtype=np.float64)
+
+
+# ぼかしの減衰テーブルの刻み（1ピクセルあたりの分割数）
+FALLOFF_OVERSAMPLE = 64
+# 減衰テーブルを作り分けるエッジの傾斜幅の刻み（粗いと縮小したクローズアップのエッジで 2 階調ほどずれる）
+RAMP_WIDTH_STEP = 1 / 64
+
+
+@lru_cache(maxsize=64)
+def falloff_table(blend_strength, ramp_width=1.0):
+    """
+    直線のエッジから符号付き距離 d（内側が正）にある画素のマスク値 (0.0 ～ 1.0) の表を返す。
+
+    エッジの値 clip(d / ramp_width + 0.5, 0, 1)（バイリニア補間でワープしたマスクのエッジは、
+    拡大率の分だけ幅のある傾斜になる）を blend_strength の 1 次元ガウシアンカーネル
+    （GaussianBlur と同じ係数）で畳み込んだ値を、1/FALLOFF_OVERSAMPLE ピクセル刻みで並べたもの。
+    ガウシアンは等方的なので、斜めのエッジでもエッジに垂直な距離だけで値が決まる。
+
+    Returns:
+        (table, radius)。table[i] は d = i / FALLOFF_OVERSAMPLE - radius の値
+    """
+    kernel = cv.getGaussianKernel(blend_strength, 0).ravel()
+    half = blend_strength // 2
+    radius = half + int(np.ceil(ramp_width / 2)) + 1
+    d = np.arange(-radius * FALLOFF_OVERSAMPLE, radius * FALLOFF_OVERSAMPLE + 1) / FALLOFF_OVERSAMPLE
+    offsets = np.arange(-half, half + 1)
+    coverage = np.clip((d[:, None] + offsets[None, :]) / ramp_width + 0.5, 0.0, 1.0)
+    table = (coverage @ kernel).astype(np.float32)
+    table.setflags(write=False)
+    return table, radius
+
+
+def _ramp_widths(H, quad_src, quad):
+    """
+    四角形の各辺で、ワープ後のマスクのエッジの傾斜幅（ワープ元の1ピクセルが canvas 上で何ピクセルか、
+    辺に垂直な方向）を RAMP_WIDTH_STEP 単位に丸めて返す。
+    """
+    H_inv = np.linalg.inv(H)
+    widths = []
+    for i in range(4):
+        # 辺の中点で、辺に垂直なワープ元座標（左右の辺は u、上下の辺は v）の勾配の大きさの逆数
+        mx, my = (quad[i] + quad[(i + 1) % 4]) / 2
+        axis = 1 if i % 2 == 0 else 0
+        num = H_inv[axis] @ (mx, my, 1.0)
+        den = H_inv[2] @ (mx, my, 1.0)
+        grad = (H_inv[axis, :2] * den - H_inv[2, :2] * num) / (den * den)
+        width = 1.0 / max(np.hypot(grad[0], grad[1]), 1e-6)
+        widths.append(max(RAMP_WIDTH_STEP, round(width / RAMP_WIDTH_STEP) * RAMP_WIDTH_STEP))
+    return widths
+
+
+def _offset_quad(quad, normals, offsets, orientation):
+    """
+    凸四角形の各辺を内側に offset だけ平行移動した四角形を返す（外側へは負の値）。
+    平行移動で向きが反転した（四角形が潰れた）場合は None。
+    """
+    constants = np.einsum('ij,ij->i', normals, quad) + offsets
+    result = np.empty_like(quad)
+    for i in range(4):
+        # 頂点 i は辺 i-1 と辺 i の交点
+        A = np.array([normals[i - 1], normals[i]])
+        result[i] = np.linalg.solve(A, [constants[i - 1], constants[i]])
+    edges = np.roll(result, -1, axis=0) - result
+    crosses = edges[:, 0] * np.roll(edges[:, 1], -1) - edges[:, 1] * np.roll(edges[:, 0], -1)
+    if not np.all(crosses * orientation > 0):
+        return None
+    return result
+
+
+def _fill_quad(image, quad, value):
+    """
+    四角形を image に塗りつぶす（頂点は 1/16 ピクセル精度）。
+    """
+    points = np.round(quad * 16).astype(np.int32)
+    cv.fillConvexPoly(image, points, value, lineType=cv.LINE_8, shift=4)
+
+
+def footprint_mask(H, img_shape, rect, blend_strength):
+    """
+    img を H でワープしたときの範囲（四隅を射影した四角形）のぼかしたマスクを、
+    rect 内に直接ラスタライズする。
+
+    四角形の各辺からの符号付き距離を falloff_table で減衰値に変換し、掛け合わせる
+    （直交する2辺の角では、ガウシアンぼかしが x・y に分離できるので積と一致する）。
+    減衰値の計算は辺の周囲の帯だけで行い、帯より内側は 255、外側は 0 で塗りつぶす。
+    定数マスクのワープと GaussianBlur を置き換えるもので、エッジ付近で 1～2 階調の差が出る
+    （大きく縮小するクローズアップを小さいブレンド強度で合成する場合は、ワープしたマスクのエッジの
+    ギザギザがなくなる分、それ以上の差が出る）
+    （canvas の端では GaussianBlur が端の画素を折り返す分の差も出る）。
+
+    Returns:
+        rect の大きさの uint8 マスク。四角形が凸でない（射影が退化している）場合は None
+    """
+    h_img, w_img = img_shape[:2]
+    x0, y0, x1, y1 = rect
+
+    # バイリニア補間で定数マスクをワープした場合の 50% の位置（画素の外周）を四角形の辺とする
+    corners = np.array([
+        [-0.5, -0.5], [w_img - 0.5, -0.5], [w_img - 0.5, h_img - 0.5], [-0.5, h_img - 0.5]
+    ], dtype=np.float64)
+    H = np.asarray(H, dtype=np.float64)
+    if np.any(corners @ H[2, :2] + H[2, 2] <= 1e-9):
+        return None
+    H_rect = translate_homography(H, x0, y0)
+    quad = cv.perspectiveTransform(corners.reshape(-1, 1, 2), H_rect).reshape(-1, 2)
+    if not np.all(np.isfinite(quad)):
+        return None
+
+    edges = np.roll(quad, -1, axis=0) - quad
+    crosses = edges[:, 0] * np.roll(edges[:, 1], -1) - edges[:, 1] * np.roll(edges[:, 0], -1)
+    if not (np.all(crosses > 0) or np.all(crosses < 0)):
+        return None
+    orientation = 1.0 if crosses[0] > 0 else -1.0
+
+    # 各辺の内向きの単位法線
+    lengths = np.hypot(edges[:, 0], edges[:, 1])
+    normals = orientation * np.stack([-edges[:, 1], edges[:, 0]], axis=1) / lengths[:, None]
+
+    tables = [falloff_table(blend_strength, width) for width in _ramp_widths(H_rect, corners, quad)]
+    band = max(radius for _, radius in tables) + 1  # ラスタライズの誤差を見込んだ帯の半幅
+    shape = (y1 - y0, x1 - x0)
+
+    # 1. 帯より内側を 255 で塗る
+    mask = np.zeros(shape, dtype=np.uint8)
+    inner = _offset_quad(quad, normals, np.full(4, float(band)), orientation)
+    if inner is not None:
+        _fill_quad(mask, inner, 255)
+
+    # 2. 帯（外側に band 広げた四角形から内側を除いた範囲）の画素を求める
+    in_band = np.zeros(shape, dtype=np.uint8)
+    _fill_quad(in_band, _offset_quad(quad, normals, np.full(4, -float(band)), orientation), 1)
+    if inner is not None:
+        _fill_quad(in_band, inner, 0)
+    points = cv.findNonZero(in_band)
+    if points is None:
+        return mask
+    points = points.reshape(-1, 2)
+    xs, ys = points[:, 0], points[:, 1]
+
+    # 3. 帯の画素で各辺からの距離を減衰値にして掛け合わせる
+    xs_f = xs.astype(np.float32)
+    ys_f = ys.astype(np.float32)
+    falloff = np.ones(len(xs), dtype=np.float32)
+    for (nx, ny), (px, py), (table, radius) in zip(normals, quad, tables):
+        last = len(table) - 1
+        c = radius - (nx * px + ny * py)
+        index = (nx * xs_f + ny * ys_f + c) * FALLOFF_OVERSAMPLE + 0.5
+        np.clip(index, 0, last, out=index)
+        falloff *= table[index.astype(np.intp)]
+
+    mask[ys, xs] = (falloff * 255.0 + 0.5).astype(np.uint8)
+    return mask
+
+
+def warp_rect(img, H, rect, blend_strength):
+    """
+    img を H に従って canvas 上の矩形 rect 内だけにワープし、ぼかしたマスクと共に返す。
+
+    Returns:
+        (warped, mask_blur)。どちらも rect の大きさ
+    """
+    h_img, w_img = img.shape[:2]
+    x0, y0, x1, y1 = rect
+    H_rect = translate_homography(H, x0, y0)
+
+    with span('warp'):
+        # 1. img を rect サイズにワープ
+        warped = cv.warpPerspective(img, H_rect, (x1 - x0, y1 - y0))
+
+        # 2. ワープ後の範囲の四角形から直接ぼかしたマスクを作る
+        mask_blur = footprint_mask(H, img.shape, rect, blend_strength)
+        if mask_blur is None:
+            # 射影が退化している場合は、定数マスクをワープしてぼかす
+            mask = np.full((h_img, w_img), 255, dtype=np.uint8)
+            mask_warped = cv.warpPerspective(mask, H_rect, (x1 - x0, y1 - y0))
+            mask_blur = cv.GaussianBlur(
+                mask_warped, (blend_strength, blend_strength), 0
+            )
+
+    return warped, mask_blur
+
+
+def warp_footprint(H, img_shape, canvas_shape, strength):
+    """
+    img を H でワープしてブレンドしたときに canvas 上で変化しうる範囲（ぼかしの余白込み）を返す。
+
+    Returns:
+        (x0, y0, x1, y1) の矩形。canvas と重ならない場合は None
+    """
+    margin = odd_strength(strength) // 2 + 1
+    return compute_warp_roi(H, img_shape, canvas_shape, margin)
+
+
+def warp_roi(canvas_shape, img, H, strength):
+    """
+    img を H に従って ROI 内だけにワープし、ぼかしたマスクと共に返す。
+
+    Returns:
+        (roi, warped, mask_blur)。canvas と重ならない場合は None
+    """
+    # 1. ワープ結果が書き込まれる範囲 (ROI) を求める（ぼかしがマスクを広げる分の余白込み）
+    roi = warp_footprint(H, img.shape, canvas_shape, strength)
+    if roi is None:
+        return None
+
+    # 2. ROI 内だけでワープ・マスク生成
+    # ROI 端には余白を取っているので、canvas 全体でぼかした場合と同じ結果になる
+    warped, mask_blur = warp_rect(img, H, roi, odd_strength(strength))
+
+    return roi, warped, mask_blur
+
+
+def blend_roi(canvas, roi, warped, mask_blur):
+    """
+    ワープ済みの ROI を canvas の該当スライスにアルファブレンディングする。
+    canvas はインプレースで更新される。
+
+    blended = canvas * (1 - mask) + warped * mask を cv.blendLinear で計算する。
+    8bit のマスクから作る重みは1チャンネルの float32 だけで、canvas・warped の float32 のコピーは作らない。
+    結果は四捨五入なので、float32 で計算して切り捨てていた以前の方式とは最大1階調の差が出る
+    （tools/benchmark_blend.py で確認できる）。
+    """
+    x0, y0, x1, y1 = roi
+    canvas_roi = canvas[y0:y1, x0:x1]
+
+    with span('blend'):
+        weights = mask_blur.astype(np.float32)
+        weights *= 1.0 / 255.0
+        canvas_roi[:] = cv.blendLinear(warped, canvas_roi, weights, 1.0 - weights)
+
+
+def warp_and_blend_roi(canvas, img, H, strength):
+    """
+    img を H に従ってワープし、ROI 内だけで canvas にブレンディングする。
+    canvas はインプレースで更新される。
+
+    Returns:
+        bool: canvas に書き込んだ場合 True（canvas 外に射影された場合 False）
+    """
+    prepared = warp_roi(canvas.shape, img, H, strength)
+    if prepared is None:
+        return False
+
+    roi, warped, mask_blur = prepared
+    blend_roi(canvas, roi, warped, mask_blur)
+    return True
+
+
+def warp_and_blend_tiles(canvas, img, H, strength, tile_size=1024):
+    """
+    img を H に従ってワープし、ROI をタイル単位に分けてワープ・ブレンディングする。
+    canvas はインプレースで更新される。
+
+    一時配列はタイル（+ぼかしの余白）の大きさに収まるので、np.memmap の canvas でも
+    メモリ使用量が canvas や ROI の大きさに比例しない。
+    結果は warp_and_blend_roi と同じ（ワープ座標の丸めの違いで最大1階調の差が出る画素がある）。
+
+    Returns:
+        bool: canvas に書き込んだ場合 True（canvas 外に射影された場合 False）
+    """
+    h_canvas, w_canvas = canvas.shape[:2]
+    blend_strength = odd_strength(strength)
+    margin = blend_strength // 2 + 1
+
+    roi = compute_warp_roi(H, img.shape, canvas.shape, margin)
+    if roi is None:
+        return False
+
+    tiles = make_tile_grid(canvas.shape, tile_size)
+    for key in tiles_for_rect(roi, tile_size):
+        part = intersect_rect(roi, tiles[key])
+        if part is None:
+            continue
+
+        # ぼかしがタイル境界をまたいで効く分だけ広げてワープし、タイル部分だけ使う
+        px0, py0, px1, py1 = part
+        ext = (
+            max(px0 - margin, 0), max(py0 - margin, 0),
+            min(px1 + margin, w_canvas), min(py1 + margin, h_canvas)
+        )
+        warped, mask_blur = warp_rect(img, H, ext, blend_strength)
+        ox, oy = px0 - ext[0], py0 - ext[1]
+        blend_roi(
+            canvas, part,
+            warped[oy:oy + py1 - py0, ox:ox + px1 - px0],
+            mask_blur[oy:oy + py1 - py0, ox:ox + px1 - px0]
+        )
+
+    return True
+
+
+def intersect_rect(a, b):
+    """
+    2つの矩形 (x0, y0, x1, y1) の共通部分を返す。重ならない場合は None。
+    """
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def make_tile_grid(canvas_shape, tile_size):
+    """
+    canvas をタイルサイズ単位の格子に分割する。
+
+    Returns:
+        (row, col) -> タイル矩形 (x0, y0, x1, y1) の辞書
+    """
+    h_canvas, w_canvas = canvas_shape[:2]
+    tiles = {}
+    for row, y0 in enumerate(range(0, h_canvas, tile_size)):
+        for col, x0 in enumerate(range(0, w_canvas, tile_size)):
+            tiles[(row, col)] = (
+                x0, y0, min(x0 + tile_size, w_canvas), min(y0 + tile_size, h_canvas)
+            )
+    return tiles
+
+
+def tiles_for_rect(rect, tile_size):
+    """
+    矩形が重なるタイルの (row, col) を行優先で返す。
+    """
+    x0, y0, x1, y1 = rect
+    return [
+        (row, col)
+        for row in range(y0 // tile_size, (y1 - 1) // tile_size + 1)
+        for col in range(x0 // tile_size, (x1 - 1) // tile_size + 1)
+    ]
+
+
+def blend_roi_in_rect(canvas, roi, warped, mask_blur, rect):
+    """
+    ワープ済み ROI のうち rect と重なる部分だけを canvas にブレンディングする。
+    画素単位の計算なので、ROI 全体を一度にブレンドした場合と同一の結果になる。
+    """
+    part = intersect_rect(roi, rect)
+    if part is None:
+        return
+
+    x0, y0 = roi[0], roi[1]
+    px0, py0, px1, py1 = part
+    blend_roi(
+        canvas, part,
+        warped[py0 - y0:py1 - y0, px0 - x0:px1 - x0],
+        mask_blur[py0 - y0:py1 - y0, px0 - x0:px1 - x0]
+    )
+
+
+def warp_and_blend_into_rects(canvas, img, H, strength, rects):
+    """
+    img を ROI にワープし、指定した矩形（タイル）と重なる部分だけを canvas にブレンディングする。
+    各矩形内の結果は warp_and_blend_roi と同一になる。
+
+    Returns:
+        bool: canvas に書き込んだ場合 True
+    """
+    prepared = warp_roi(canvas.shape, img, H, strength)
+    if prepared is None:
+        return False
+
+    roi, warped, mask_blur = prepared
+    for rect in rects:
+        blend_roi_in_rect(canvas, roi, warped, mask_blur, rect)
+    return True
+
+
+def composite_tiled(canvas, items, strength, tile_size=1024, max_workers=None):
+    """
+    canvas をタイルに分割し、複数のクローズアップをタイル単位で並列に合成する。
+
+    1. 各クローズアップを ROI へワープ（クローズアップ単位で並列）
+    2. ワープ後の ROI が重なるタイルに割り当てる
+    3. タイル単位で並列にブレンド（タイル内では items の順序を保つ）
+
+    各タイルへの書き込みは1スレッドだけが行い、タイル内のブレンド順は
+    items の順序と同じなので、items を順番に warp_and_blend_roi した結果と一致する。
+
+    Args:
+        canvas: 合成先の canvas（インプレースで更新される）
+        items: 合成順に並んだ (img, H) のリスト
+        strength: ブレンディング強度
+        tile_size: タイルの一辺（ピクセル）
+        max_workers: スレッド数（Noneで自動）
+
+    Returns:
+        items と同じ長さのリスト。合成できた場合は None、できなかった場合はその理由
+    """
+    errors = [None] * len(items)
+
+    def prepare(index):
+        img, H = items[index]
+        try:
+            prepared = warp_roi(canvas.shape, img, H, strength)
+        except Exception as e:
+            errors[index] = f"Error in warp: {e}"
+            return None
+        if prepared is None:
+            errors[index] = "warped closeup does not overlap the canvas"
+        return prepared
+
+    # cv2 の処理中は GIL が解放されるため、スレッドプールで並列化できる
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 1. クローズアップ単位でワープ
+        prepared_list = list(executor.map(prepare, range(len(items))))
+
+        # 2. タイルへの割り当て（items の順序を保つ）
+        tiles = make_tile_grid(canvas.shape, tile_size)
+        tile_items = {}
+        for index, prepared in enumerate(prepared_list):
+            if prepared is None:
+                continue
+            for key in tiles_for_rect(prepared[0], tile_size):
+                tile_items.setdefault(key, []).append(index)
+
+        # 3. タイル単位でブレンド
+        def blend_tile(key):
+            rect = tiles[key]
+            for index in tile_items[key]:
+                roi, warped, mask_blur = prepared_list[index]
+                blend_roi_in_rect(canvas, roi, warped, mask_blur, rect)
+
+        for _ in executor.map(blend_tile, sorted(tile_items)):
+            pass
+
+    return errors
@@ -0,0 +1,99 @@
+"""
+合成先 canvas の確保。
+
+canvas はオーバービューを整数倍に拡大した画像で、通常はメモリ上の配列として確保する。
+出力が巨大になる場合（ギガピクセル級）は、ローカルディスク上のファイルに対応付けた
+np.memmap として確保し、拡大も行単位の帯 (band) ごとに書き込むことで、
+プロセスのメモリ使用量を canvas の大きさに比例させない。
+"""
+
+import os
+
+import cv2 as cv
+import numpy as np
+
+CANVAS_BACKENDS = ("memory", "memmap")
+
+
+def resize_into(base, out, scale, band_rows=256, interpolation=cv.INTER_CUBIC):
+    """
+    base を scale 倍に拡大した結果を、行方向の帯ごとに out へ書き込む。
+
+    帯の上下に補間カーネル分の元画像の行を余分に含めて拡大し、端を切り捨てるので、
+    整数倍の拡大であれば base 全体を一度に cv.resize した結果と一致する。
+
+    Args:
+        base: 元画像
+        out: 出力先 (h * scale, w * scale, C) の配列（np.memmap も可）
+        scale: 拡大倍率（整数）
+        band_rows: 1回に処理する元画像の行数
+        interpolation: 補間方法
+    """
+    h_base, w_base = base.shape[:2]
+    # INTER_CUBIC は上下2行ずつを参照する
+    pad = 2
+
+    for y0 in range(0, h_base, band_rows):
+        y1 = min(y0 + band_rows, h_base)
+        src0 = max(y0 - pad, 0)
+        src1 = min(y1 + pad, h_base)
+
+        band = cv.resize(
+            base[src0:src1], (w_base * scale, (src1 - src0) * scale),
+            interpolation=interpolation
+        )
+        top = (y0 - src0) * scale
+        out[y0 * scale:y1 * scale] = band[top:top + (y1 - y0) * scale]
+
+
+def create_canvas(base, scale, backend="memory", memmap_path=None, band_rows=256):
+    """
+    base を scale 倍に拡大した canvas を作る。
+
+    Args:
+        base: オーバービュー画像
+        scale: 拡大倍率（整数）
+        backend: "memory"（通常の配列）または "memmap"（ディスク上のファイルに対応付けた配列）
+        memmap_path: backend="memmap" のときのファイルパス
+        band_rows: backend="memmap" のとき、1回に拡大する元画像の行数
+
+    Returns:
+        canvas (h * scale, w * scale, C) uint8
+    """
+    h_base, w_base = base.shape[:2]
+    new_w = w_base * scale
+    new_h = h_base * scale
+
+    if backend == "memory":
+        return cv.resize(base, (new_w, new_h), interpolation=cv.INTER_CUBIC)
+
+    if backend != "memmap":
+        raise ValueError(f"Unknown canvas backend: {backend} (expected one of {CANVAS_BACKENDS})")
+    if memmap_path is None:
+        raise ValueError("memmap_path is required for the memmap canvas backend")
+
+    directory = os.path.dirname(memmap_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    canvas = np.memmap(
+        memmap_path, dtype=np.uint8, mode="w+", shape=(new_h, new_w) + base.shape[2:]
+    )
+    resize_into(base, canvas, scale, band_rows)
+    return canvas
+
+
+def release_canvas(canvas):
+    """
+    np.memmap の canvas をディスクに書き出し、対応するファイルを削除する（通常の配列では何もしない）。
+    """
+    if not isinstance(canvas, np.memmap):
+        return
+
+    path = canvas.filename
+    canvas.flush()
+    try:
+        os.remove(path)
+    except OSError:
+        # Windows では対応付けが残っている間は削除できない（次回の実行で上書きされる）
+        pass
@@ -0,0 +1,243 @@
+"""
+SIFT特徴量のディスクキャッシュ。
+
+画像ファイルの内容ハッシュと検出パラメータ（特徴点数、オクターブ層数、閾値、
+ダウンサンプリング倍率など）をキーとして、キーポイント（座標・サイズ・角度・
+レスポンス・オクターブ）と float32 のディスクリプタ行列を .npz ファイルに保存する。
+キャッシュ全体のサイズ（同じディレクトリに保存される FLANN インデックスの .flann を含む）が
+上限を超えた場合は、最終アクセスが古いものから削除する (LRU)。
+合計サイズはプロセス内で保存のたびに加算して持ち、上限を超えたときだけディレクトリを走査する。
+
+src/main.py と src/api.py の homography_sift およびベース画像の特徴量計算から利用される。
+"""
+
+import glob
+import hashlib
+import json
+import os
+import threading
+
+import cv2 as cv
+import numpy as np
+
+# キャッシュ形式を変更した場合は上げる（古いキャッシュはキーが変わって使われなくなる）
+FEATURE_CACHE_VERSION = 1
+
+# キャッシュとして容量を数え、削除の対象にするファイルの拡張子（.flann は matching.py が保存する）
+CACHE_FILE_PATTERNS = ("*.npz", "*.flann")
+
+# 削除処理・合計サイズの更新の同時実行を防ぐロック（保存自体は一時ファイル + os.replace でアトミック）
+_evict_lock = threading.Lock()
+# キャッシュディレクトリ -> 合計サイズ（バイト）。初回の保存時に走査し、以降は保存のたびに加算する
+_cache_sizes = {}
+
+
+def file_content_hash(path, chunk_size=1024 * 1024):
+    """
+    ファイル内容の SHA-256 ハッシュ（16進文字列）を返す。
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(content_hash, detector_params):
+    """
+    内容ハッシュと検出パラメータからキャッシュキーを作る。
+
+    Args:
+        content_hash: file_content_hash の戻り値
+        detector_params: 特徴量の計算結果に影響するパラメータの辞書
+            （nfeatures, nOctaveLayers, contrastThreshold, edgeThreshold, scale など）
+    """
+    payload = json.dumps({
+        "version": FEATURE_CACHE_VERSION,
+        "opencv": cv.__version__,
+        "content": content_hash,
+        "params": detector_params,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def pack_keypoints(keypoints):
+    """
+    cv.KeyPoint のリストを NumPy 配列に詰める。
+
+    Returns:
+        (kp_array, octaves)
+        kp_array: (N, 5) float32 [x, y, size, angle, response]
+        octaves: (N,) int32
+    """
+    kp_array = np.array(
+        [(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response) for kp in keypoints],
+        dtype=np.float32
+    ).reshape(-1, 5)
+    octaves = np.array([kp.octave for kp in keypoints], dtype=np.int32)
+    return kp_array, octaves
+
+
+def unpack_keypoints(kp_array, octaves):
+    """
+    pack_keypoints で詰めた配列から cv.KeyPoint のタプルを復元する。
+    """
+    return tuple(
+        cv.KeyPoint(
+            x=float(x), y=float(y), size=float(size), angle=float(angle),
+            response=float(response), octave=int(octave)
+        )
+        for (x, y, size, angle, response), octave in zip(kp_array, octaves)
+    )
+
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.npz")
+
+
+def load_features(cache_dir, key):
+    """
+    キャッシュから特徴量を読み込む。
+
+    Returns:
+        (kp_array, octaves, descriptors) または None（キャッシュなし・破損）
+    """
+    path = _cache_path(cache_dir, key)
+    try:
+        with np.load(path) as data:
+            kp_array = data["keypoints"]
+            octaves = data["octaves"]
+            descriptors = data["descriptors"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+    # LRU 用に最終アクセス時刻を更新
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+    return kp_array, octaves, descriptors
+
+
+def store_features(cache_dir, key, kp_array, octaves, descriptors, max_bytes=None):
+    """
+    特徴量をキャッシュに保存し、必要なら古いエントリを削除する。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, key)
+    tmp_path = os.path.join(
+        cache_dir, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    )
+
+    np.savez(tmp_path, keypoints=kp_array, octaves=octaves, descriptors=descriptors)
+    replaced = os.path.getsize(path) if os.path.exists(path) else 0
+    os.replace(tmp_path, path)
+
+    record_cache_file(cache_dir, path, max_bytes, replaced)
+
+
+def record_cache_file(cache_dir, path, max_bytes=None, replaced_bytes=0):
+    """
+    キャッシュに保存したファイルを合計サイズに加え、max_bytes を超えた場合は古いものから削除する。
+
+    Args:
+        cache_dir: キャッシュディレクトリ
+        path: 保存したファイル
+        max_bytes: キャッシュ全体のサイズ上限（None で削除しない）
+        replaced_bytes: 同じパスにあったファイルを置き換えた場合、そのサイズ
+    """
+    key = os.path.abspath(cache_dir)
+    with _evict_lock:
+        total = _cache_sizes.get(key)
+        if total is None:
+            total = sum(size for _, size, _ in _cache_entries(cache_dir))
+        else:
+            try:
+                total += os.path.getsize(path) - replaced_bytes
+            except OSError:
+                pass
+        _cache_sizes[key] = total
+    if max_bytes is not None and total > max_bytes:
+        evict_lru(cache_dir, max_bytes)
+
+
+def _cache_entries(cache_dir):
+    """
+    キャッシュのファイルの (最終アクセス時刻, サイズ, パス) のリスト（書き込み中の一時ファイルは除く）。
+    """
+    entries = []
+    for pattern in CACHE_FILE_PATTERNS:
+        for path in glob.glob(os.path.join(cache_dir, pattern)):
+            if path.endswith(".tmp.npz"):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def evict_lru(cache_dir, max_bytes):
+    """
+    キャッシュの合計サイズが max_bytes 以下になるまで、最終アクセスが古いものから削除する。
+    """
+    with _evict_lock:
+        entries = _cache_entries(cache_dir)
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        _cache_sizes[os.path.abspath(cache_dir)] = total
+
+
+def cached_detect_and_compute(path, detector_params, compute, cache_dir, max_bytes=None,
+                              return_points=False):
+    """
+    キャッシュがあれば読み込み、なければ compute() で特徴量を計算して保存する。
+
+    Args:
+        path: 特徴量を計算する画像ファイルのパス（内容ハッシュの計算に使用）
+        detector_params: キャッシュキーに含める検出パラメータの辞書
+        compute: 引数なしで (keypoints, descriptors) を返す関数（detectAndCompute 相当）
+        cache_dir: キャッシュディレクトリ
+        max_bytes: キャッシュ全体のサイズ上限（None で無制限）
+        return_points: True の場合 cv.KeyPoint ではなく (N, 2) float32 の座標配列を返す
+
+    Returns:
+        (keypoints, descriptors)。descriptors は特徴点がない場合 None（detectAndCompute と同じ）
+    """
+    key = make_cache_key(file_content_hash(path), detector_params)
+
+    cached = load_features(cache_dir, key)
+    if cached is not None:
+        kp_array, octaves, descriptors = cached
+        if return_points:
+            points = np.ascontiguousarray(kp_array[:, :2])
+            return points, (descriptors if len(descriptors) > 0 else None)
+        if len(descriptors) == 0:
+            return (), None
+        return unpack_keypoints(kp_array, octaves), descriptors
+
+    keypoints, descriptors = compute()
+
+    kp_array, octaves = pack_keypoints(keypoints)
+    if descriptors is None:
+        stored = np.empty((0, 128), dtype=np.float32)
+    else:
+        stored = descriptors
+    try:
+        store_features(cache_dir, key, kp_array, octaves, stored, max_bytes)
+    except OSError:
+        # キャッシュに書けなくても計算結果はそのまま使える
+        pass
+
+    if return_points:
+        return np.ascontiguousarray(kp_array[:, :2]), descriptors
+    return keypoints, descriptors
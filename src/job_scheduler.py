@@ -0,0 +1,140 @@
+"""
+Web API の合成ジョブのスケジューラ。
+
+ジョブは優先度付きの待ち行列（同じ優先度なら FIFO）に入り、固定数のワーカースレッドで実行される。
+同時実行数の上限に加え、ジョブごとのメモリ見積もり（canvas の大きさなど）の合計が
+上限を超えないように実行開始を待たせる（アドミッション制御）。
+先頭のジョブが開始できない間は後ろのジョブも開始しない（大きなジョブが後回しにされ続けるのを防ぐ）。
+"""
+
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def estimate_job_memory(overview_pixels, canvas_scale, channels=3):
+    """
+    合成ジョブのメモリ使用量を見積もる（バイト）。
+
+    canvas（オーバービュー x canvas_scale^2）と、オーバービュー本体、
+    ブレンディング時の ROI 単位の一時配列（canvas と同程度を上限とみなす）を合計する。
+    """
+    overview_bytes = overview_pixels * channels
+    canvas_bytes = overview_bytes * canvas_scale * canvas_scale
+    return overview_bytes + canvas_bytes * 2
+
+
+class JobScheduler:
+    """
+    優先度付き待ち行列とメモリ見積もりによるアドミッション制御を持つジョブ実行器。
+
+    Args:
+        max_concurrent_jobs: 同時に実行するジョブ数の上限
+        memory_budget_bytes: 実行中ジョブのメモリ見積もりの合計の上限（None で制限なし）。
+            1つのジョブだけで上限を超える場合でも、他に実行中のジョブがなければ実行する
+    """
+
+    def __init__(self, max_concurrent_jobs=2, memory_budget_bytes=None):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.memory_budget_bytes = memory_budget_bytes
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_jobs, thread_name_prefix="stitch-job"
+        )
+        self._lock = threading.Lock()
+        self._queue = []  # (priority, seq, job_id, func, args, memory_estimate)
+        self._seq = itertools.count()
+        self._running = {}  # job_id -> memory_estimate
+
+    def submit(self, job_id, func, args=(), priority=0, memory_estimate=0):
+        """
+        ジョブを待ち行列に入れる（priority が小さいほど先に実行）。
+
+        Returns:
+            待ち行列内の順位（1始まり）。すぐに開始した場合は 0
+        """
+        with self._lock:
+            heapq.heappush(
+                self._queue, (priority, next(self._seq), job_id, func, args, memory_estimate)
+            )
+            runnable = self._pop_runnable_locked()
+            position = self._position_locked(job_id) or 0
+        self._start(runnable)
+        return position
+
+    def queue_position(self, job_id):
+        """
+        待ち行列内の順位（1始まり）。待ち行列にない場合は None。
+        """
+        with self._lock:
+            return self._position_locked(job_id)
+
+    def queued_job_ids(self):
+        """
+        待ち行列内のジョブ ID（実行される順）。
+        """
+        with self._lock:
+            return [entry[2] for entry in sorted(self._queue)]
+
+    def remove(self, job_id):
+        """
+        まだ開始していないジョブを待ち行列から取り除く。
+
+        Returns:
+            bool: 取り除いた場合 True（実行中・未登録の場合 False）
+        """
+        with self._lock:
+            for index, entry in enumerate(self._queue):
+                if entry[2] == job_id:
+                    self._queue.pop(index)
+                    heapq.heapify(self._queue)
+                    return True
+            return False
+
+    def stats(self):
+        """
+        実行中・待機中のジョブ数とメモリ見積もりの合計。
+        """
+        with self._lock:
+            return {
+                'running': len(self._running),
+                'queued': len(self._queue),
+                'running_memory_bytes': sum(self._running.values()),
+                'max_concurrent_jobs': self.max_concurrent_jobs,
+                'memory_budget_bytes': self.memory_budget_bytes,
+            }
+
+    def _position_locked(self, job_id):
+        for position, entry in enumerate(sorted(self._queue), start=1):
+            if entry[2] == job_id:
+                return position
+        return None
+
+    def _admissible_locked(self, memory_estimate):
+        if len(self._running) >= self.max_concurrent_jobs:
+            return False
+        if self.memory_budget_bytes is None or not self._running:
+            return True
+        return sum(self._running.values()) + memory_estimate <= self.memory_budget_bytes
+
+    def _pop_runnable_locked(self):
+        # 先頭のジョブから順に、開始できる間だけ待ち行列から取り出す（実行中として数える）
+        runnable = []
+        while self._queue and self._admissible_locked(self._queue[0][5]):
+            _, _, job_id, func, args, memory_estimate = heapq.heappop(self._queue)
+            self._running[job_id] = memory_estimate
+            runnable.append((job_id, func, args))
+        return runnable
+
+    def _start(self, runnable):
+        # ロックの外で開始する（すぐに終わったジョブでは add_done_callback がこのスレッドで
+        # _on_done を呼ぶため、ロックを持ったままだとデッドロックする）
+        for job_id, func, args in runnable:
+            future = self._executor.submit(func, *args)
+            future.add_done_callback(lambda _, job_id=job_id: self._on_done(job_id))
+
+    def _on_done(self, job_id):
+        with self._lock:
+            self._running.pop(job_id, None)
+            runnable = self._pop_runnable_locked()
+        self._start(runnable)
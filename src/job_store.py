@@ -0,0 +1,235 @@
+"""
+Web API のジョブ状態の保存先（src/api.py の processing_jobs）。
+
+ジョブはメモリ上の辞書として扱い、状態が変わるたびに SQLite に書き出す（サーバーを再起動しても
+ジョブの情報と結果を参照できる）。メモリに置くジョブ数には上限があり、超えた分は終了済みのジョブから
+最後に参照された順が古いものをメモリから外す（SQLite には残り、次に参照されたときに読み戻す）。
+終了してから ttl_seconds を過ぎたジョブは SQLite からも削除する（expire_jobs）。
+
+ログと SSE のイベントは件数の上限つき（古いものから捨てる）のリングバッファで持つ。
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+# SQLite に保存するジョブの項目（ログ以外）。スレッド同期用のオブジェクトなどは保存しない
+PERSISTED_FIELDS = (
+    'status', 'progress', 'overview_path', 'closeup_paths', 'created_at',
+    'result_path', 'stats', 'error', 'memory_estimate', 'finished_at',
+)
+
+
+class JobStore:
+    """
+    ジョブ ID -> ジョブの辞書の保存先。dict と同じように `in` / [] / get で参照する。
+
+    Args:
+        db_path: SQLite のファイルパス（None で保存しない）
+        max_jobs_in_memory: メモリに置くジョブ数の上限（実行中・待機中のジョブは外さない）
+        ttl_seconds: 終了済み・未開始のジョブを削除するまでの時間（最後の更新から）
+        log_limit: ジョブごとに保持するログの件数
+        event_limit: ジョブごとに保持する SSE イベントの件数
+    """
+
+    def __init__(self, db_path=None, max_jobs_in_memory=100, ttl_seconds=24 * 3600,
+                 log_limit=500, event_limit=1000):
+        self.max_jobs_in_memory = max_jobs_in_memory
+        self.ttl_seconds = ttl_seconds
+        self.log_limit = log_limit
+        self.event_limit = event_limit
+        self._lock = threading.RLock()
+        self._jobs = OrderedDict()  # 最後に参照された順（末尾が最新）
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, status TEXT, updated_at REAL, data TEXT)'
+            )
+            self._db.commit()
+            self._mark_interrupted()
+
+    def create(self, job_id, fields):
+        """
+        ジョブを登録して保存する。
+
+        Returns:
+            ジョブの辞書（ログ・イベントのリングバッファなどを追加したもの）
+        """
+        job = self._new_job(fields)
+        with self._lock:
+            self._jobs[job_id] = job
+            self._save_locked(job_id, job)
+            self._evict_locked()
+        return job
+
+    def save(self, job_id):
+        """
+        ジョブの現在の状態を SQLite に書き出す（状態が変わったときに呼ぶ）。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if job['status'] in FINISHED_STATUSES and job.get('finished_at') is None:
+                job['finished_at'] = time.time()
+            self._save_locked(job_id, job)
+            self._evict_locked()
+
+    def get(self, job_id, default=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._load_locked(job_id)
+                if job is None:
+                    return default
+                self._jobs[job_id] = job
+                self._evict_locked()
+            self._jobs.move_to_end(job_id)
+            return job
+
+    def __getitem__(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def __contains__(self, job_id):
+        return self.get(job_id) is not None
+
+    def discard(self, job_id):
+        """
+        ジョブをメモリと SQLite から削除する（ファイルは削除しない）。
+
+        Returns:
+            削除したジョブの辞書。存在しない場合は None
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                job = self._load_locked(job_id)
+            if self._db is not None:
+                self._db.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+                self._db.commit()
+            return job
+
+    def expire_jobs(self, now=None):
+        """
+        終了済み・未開始（アップロード中を含む）のまま ttl_seconds を過ぎたジョブを削除する。
+
+        Returns:
+            削除したジョブ ID -> ジョブの辞書（ファイルの削除に使う）
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.ttl_seconds
+        expired = {}
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if self._expirable(job) and self._updated_at(job) < cutoff:
+                    expired[job_id] = self._jobs.pop(job_id)
+
+            if self._db is not None:
+                rows = self._db.execute(
+                    'SELECT job_id, data FROM jobs WHERE updated_at < ? AND status IN (?, ?, ?, ?, ?)',
+                    (cutoff, 'uploading', 'uploaded') + FINISHED_STATUSES
+                ).fetchall()
+                for job_id, data in rows:
+                    expired.setdefault(job_id, json.loads(data))
+                self._db.executemany(
+                    'DELETE FROM jobs WHERE job_id = ?', [(job_id,) for job_id in expired]
+                )
+                self._db.commit()
+        return expired
+
+    def start_reaper(self, interval_seconds, on_expire):
+        """
+        expire_jobs を定期的に呼ぶデーモンスレッドを開始する。
+
+        Args:
+            interval_seconds: 実行間隔
+            on_expire: on_expire(expired)。expire_jobs の戻り値を受け取る（ファイルの削除など）
+        """
+        def reaper():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    on_expire(self.expire_jobs())
+                except Exception as e:
+                    print(f"[WARN] Job reaper failed: {e}")
+
+        thread = threading.Thread(target=reaper, name='job-reaper', daemon=True)
+        thread.start()
+        return thread
+
+    def _new_job(self, fields, logs=()):
+        job = dict(fields)
+        job['logs'] = deque(logs, maxlen=self.log_limit)
+        job['events'] = deque(maxlen=self.event_limit)
+        job['last_event_id'] = 0
+        job['event_cond'] = threading.Condition()
+        job['cancel_event'] = threading.Event()
+        job['updated_at'] = time.time()
+        return job
+
+    @staticmethod
+    def _expirable(job):
+        return job['status'] in FINISHED_STATUSES or job['status'] in ('uploading', 'uploaded')
+
+    @staticmethod
+    def _updated_at(job):
+        return job.get('finished_at') or job['updated_at']
+
+    def _save_locked(self, job_id, job):
+        job['updated_at'] = time.time()
+        if self._db is None:
+            return
+        data = {field: job.get(field) for field in PERSISTED_FIELDS}
+        data['logs'] = list(job['logs'])
+        self._db.execute(
+            'INSERT OR REPLACE INTO jobs (job_id, status, updated_at, data) VALUES (?, ?, ?, ?)',
+            (job_id, job['status'], self._updated_at(job), json.dumps(data))
+        )
+        self._db.commit()
+
+    def _load_locked(self, job_id):
+        if self._db is None:
+            return None
+        row = self._db.execute('SELECT data, updated_at FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        logs = data.pop('logs', [])
+        job = self._new_job(data, logs)
+        job['updated_at'] = row[1]
+        return job
+
+    def _evict_locked(self):
+        # 終了済み・未開始のジョブを古い順にメモリから外す（SQLite には残る）
+        excess = len(self._jobs) - self.max_jobs_in_memory
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if self._expirable(job)][:excess]:
+            if self._db is None:
+                break  # 保存先がない場合は外すと失われるので残す
+            del self._jobs[job_id]
+
+    def _mark_interrupted(self):
+        # 前回の終了時に実行中・待機中だったジョブは再開できないので失敗扱いにする
+        rows = self._db.execute(
+            "SELECT job_id, data FROM jobs WHERE status IN ('queued', 'processing')"
+        ).fetchall()
+        for job_id, data in rows:
+            data = json.loads(data)
+            data['status'] = 'failed'
+            data['error'] = 'Interrupted by server restart'
+            data['finished_at'] = time.time()
+            self._db.execute(
+                'UPDATE jobs SET status = ?, updated_at = ?, data = ? WHERE job_id = ?',
+                ('failed', data['finished_at'], json.dumps(data), job_id)
+            )
+        self._db.commit()
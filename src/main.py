@@ -4,8 +4,41 @@ import glob
 import sys
 from datetime import datetime
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import multiprocessing
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from blending import (
+    blend_roi, composite_tiled, make_tile_grid, tiles_for_rect, warp_and_blend_into_rects,
+    warp_and_blend_roi, warp_and_blend_tiles, warp_footprint, warp_roi
+)
+from canvas import create_canvas, release_canvas
+from feature_cache import cached_detect_and_compute, file_content_hash
+from manifest import (
+    diff_closeups, dirty_rects, load_manifest, make_entry, manifest_path, save_manifest,
+    settings_match
+)
+from pipeline import format_stage_stats, run_pipeline
+from shared_arrays import attach_shared_arrays, release_shared_arrays, share_arrays
+from thread_budget import (
+    apply_stage_threads, describe_thread_budget, estimate_image_pixels, plan_pipeline_threads,
+    plan_thread_budget
+)
+from timing import (
+    TimingRecorder, format_timing_report, save_timing_report, span, timing_report_path
+)
+from matching import (
+    build_overview_index, build_spatial_grid, expand_bbox_polygon, keypoints_to_points,
+    query_overview_index, ratio_test, restrict_to_region
+)
+
+# watchdog があればファイル追加イベント (inotify 等) で監視モードを即座に起こす（なければポーリングのみ）
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
 
 # --- 2. ファイルI/Oとパス (固定値) ---
 OVERVIEW = "overview.jpg"
@@ -21,51 +54,108 @@ SIFT_RATIO_TEST = 0.75
 
 # --- 高速化パラメータ ---
 USE_FLANN = True  # FLANNマッチャーを使用（BFMatcherより高速）
+FLANN_TREES = 5  # オーバービュー側 KD-tree の本数
+FLANN_CHECKS = 50  # より高い値で精度向上、低い値で速度向上
+PERSIST_FLANN_INDEX = True  # 構築したFLANNインデックスを FEATURE_CACHE_DIR に保存して再利用
+
+# --- 2段階 (coarse-to-fine) 推定パラメータ ---
+USE_COARSE_TO_FINE = False  # 低解像度でおおよその位置を求め、その領域内の特徴点だけで本推定する
+COARSE_SCALE = 0.125  # 粗推定のダウンサンプリング倍率
+COARSE_MAX_FEATURES = 500  # 粗推定のSIFT特徴点の上限
+COARSE_MIN_MATCHES = 8  # 粗推定に必要な最小マッチ数
+COARSE_REGION_MARGIN = 0.25  # 予測領域の拡張率（領域の長辺に対する比）
+
+# --- 位置の事前情報による領域限定マッチング ---
+SPATIAL_GRID_CELL_SIZE = 64  # オーバービュー特徴点の空間インデックスのセルサイズ（マッチング解像度のピクセル）
+USE_NEIGHBOR_PRIOR = False  # 順次処理時、直前のクローズアップの位置周辺を優先して探す
+NEIGHBOR_PRIOR_MARGIN = 1.0  # 直前のクローズアップ領域の拡張率（領域の長辺に対する比）
 MAX_FEATURES = 5000  # SIFT特徴点の上限（メモリと速度の最適化）
 DOWNSAMPLE_FOR_MATCHING = True  # マッチング用にダウンサンプリング
 DOWNSAMPLE_SCALE = 0.5  # マッチング時のダウンサンプリング倍率
 USE_PARALLEL = True  # 並列処理を使用
-MAX_WORKERS = None  # 並列処理のワーカー数（Noneで自動：CPU数）
-
-# OpenCV最適化設定
-cv.setNumThreads(multiprocessing.cpu_count())  # OpenCVのマルチスレッド有効化
+MAX_WORKERS = None  # 並列処理のワーカー数（Noneで THREAD_BUDGET_MODE に従って自動）
+# コアの配分: "auto"（枚数と画像サイズから ワーカー数 x OpenCVスレッド数 を決める）/
+# "outer"（ワーカー数を最大化）/ "inner"（ワーカー1つで OpenCV に全コア）
+THREAD_BUDGET_MODE = "auto"
+# 並列処理の方式:
+# "pipeline"（読み込み→特徴量→マッチング→ワープ→合成 の段階を有界キューでつなぐ。メモリ使用量が枚数に比例しない）/
+# "thread"（全クローズアップをスレッドプールに一括投入）/ "process"（プロセスプール。Python 側の処理も並列に動く）
+# process ではワーカーごとに SIFT とオーバービューのインデックスを1回だけ準備し、
+# オーバービューの特徴量は共有メモリで渡す。ワーカーはホモグラフィとマッチング統計だけを返す
+PARALLEL_BACKEND = "pipeline"
+PIPELINE_WINDOW = None  # pipeline で同時に処理中にするクローズアップ数の上限（Noneで ワーカー数 x 2 + 4）
+PIPELINE_QUEUE_SIZE = 2  # pipeline の段階間キューの長さ
+PIPELINE_DECODE_WORKERS = 2  # pipeline の読み込み段階のスレッド数の上限（コアが少なければ減らす）
+PIPELINE_WARP_WORKERS = 2  # pipeline のワープ段階のスレッド数の上限（コアが少なければ減らす）
+USE_TILED_COMPOSITING = True  # canvasをタイル分割して並列に合成（PARALLEL_BACKEND="thread" のみ）
+COMPOSITE_TILE_SIZE = 1024  # 合成タイルの一辺（ピクセル）
+# タイル合成で同時に読み込み・ワープしておくクローズアップ数の上限（メモリはこの枚数分の画像と ROI）
+COMPOSITE_BATCH_SIZE = 16
+USE_FEATURE_CACHE = True  # SIFT特徴量をディスクにキャッシュ（画像内容+検出パラメータがキー）
+FEATURE_CACHE_DIR = ".feature_cache"  # 特徴量キャッシュの保存先
+FEATURE_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 特徴量キャッシュの容量上限（超過分は古いものから削除）
+
+# --- canvas の確保方法 ---
+# "memory": 通常の配列 / "memmap": ローカルディスク上のファイルに対応付けた配列（巨大な出力向け）
+# memmap ではワープ・ブレンドを COMPOSITE_TILE_SIZE のタイル単位で行い、メモリ使用量をタイルサイズで抑える
+CANVAS_BACKEND = "memory"
+CANVAS_MEMMAP_PATH = "canvas.memmap"  # memmap のファイル（処理終了後に削除）
+
+# --- 差分合成 ---
+# 出力画像の隣にマニフェスト（各クローズアップの内容ハッシュ・ホモグラフィ・書き込み範囲）を保存し、
+# 次回は変更・追加・削除されたクローズアップが重なるタイルだけを合成し直す（監視モードでは無効）
+INCREMENTAL_RENDER = False
+
+# --- 監視モード（撮影中にフォルダへ追加されるクローズアップを逐次合成） ---
+WATCH_MODE = False  # True または `python src/main.py --watch` で有効
+WATCH_POLL_INTERVAL = 2.0  # フォルダを走査する間隔（秒）
+WATCH_SETTLE_TIME = 2.0  # ファイルサイズがこの秒数変化しなければ書き込み完了とみなす
+WATCH_IDLE_TIMEOUT = 600  # この秒数新しいクローズアップがなければ終了（Noneで Ctrl+C まで継続）
+CHECKPOINT_INTERVAL = 60  # 合成途中の canvas を OUT に保存する間隔（秒）
+
+# --- 処理時間の計測 ---
+# 処理段階（読み込み・特徴量・マッチング・ワープ・ブレンドなど）ごとの所要時間を、クローズアップごとと
+# 実行全体で集計し、出力画像の隣に JSON で保存する（stitched.png -> stitched.timing.json）
+WRITE_TIMING_REPORT = True
+
+# SIFT検出パラメータ（特徴量キャッシュのキーにも使用）
+SIFT_PARAMS = dict(
+    nfeatures=MAX_FEATURES,      # 特徴点数の上限を設定
+    nOctaveLayers=5,              # デフォルト3→5: より多くのスケールで検出
+    contrastThreshold=0.03,       # デフォルト0.04→0.03: より多くの特徴点
+    edgeThreshold=15              # デフォルト10→15: エッジ応答の閾値を緩和
+)
 
 # --- グローバル変数 ---
 log_f = None
+thread_plan = None  # ワーカー数と OpenCV スレッド数の配分（setup_logging で決定）
+closeup_records = {}  # クローズアップのパス -> 合成結果（マニフェスト用、record_closeup で記録）
+timing_recorder = TimingRecorder()  # 処理段階ごとの所要時間（timing.span で計測した区間）
+
+# 粗推定用SIFT検出パラメータ（特徴点数だけを絞る）
+COARSE_SIFT_PARAMS = dict(SIFT_PARAMS, nfeatures=COARSE_MAX_FEATURES)
 
 # SIFT detectorの初期化（OpenCVのバージョンによって異なる場合に対応）
 try:
-    sift = cv.SIFT_create(
-        nfeatures=MAX_FEATURES,      # 特徴点数の上限を設定
-        nOctaveLayers=5,              # デフォルト3→5: より多くのスケールで検出
-        contrastThreshold=0.03,       # デフォルト0.04→0.03: より多くの特徴点
-        edgeThreshold=15              # デフォルト10→15: エッジ応答の閾値を緩和
-    )
+    sift = cv.SIFT_create(**SIFT_PARAMS)
+    sift_coarse = cv.SIFT_create(**COARSE_SIFT_PARAMS)
 except AttributeError:
     try:
         sift = cv.xfeatures2d.SIFT_create(nfeatures=MAX_FEATURES)
+        sift_coarse = cv.xfeatures2d.SIFT_create(nfeatures=COARSE_MAX_FEATURES)
     except AttributeError:
         print("[CRITICAL ERROR] SIFT is not available in your OpenCV installation. Please install opencv-contrib-python.")
         sys.exit(1)
 
-# FLANNマッチャーの初期化
-if USE_FLANN:
-    # FLANN parameters for SIFT
-    FLANN_INDEX_KDTREE = 1
-    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-    search_params = dict(checks=50)  # より高い値で精度向上、低い値で速度向上
-    flann = cv.FlannBasedMatcher(index_params, search_params)
-else:
-    flann = None
-
 
 # --- 5. 関数シグネチャ (ロギング) ---
 
 def setup_logging():
     """
     ログファイルを初期化し、グローバルファイルハンドルを設定し、開始時刻を書き込む。
+    コアの配分 (thread_plan) もここで決めて [CONFIG] 行に記録する。
     """
-    global log_f
+    global log_f, thread_plan
     try:
         # 追記モード (a) でファイルを開く
         log_f = open(LOG_FILE, "a", encoding="utf-8")
@@ -75,7 +165,22 @@ def setup_logging():
         write_log(f"{start_time} --- Processing Start ---")
         write_log(f"[CONFIG] USE_FLANN={USE_FLANN}, MAX_FEATURES={MAX_FEATURES}, "
                   f"DOWNSAMPLE_FOR_MATCHING={DOWNSAMPLE_FOR_MATCHING}, "
-                  f"USE_PARALLEL={USE_PARALLEL}, MAX_WORKERS={MAX_WORKERS or 'auto'}")
+                  f"USE_PARALLEL={USE_PARALLEL}, MAX_WORKERS={MAX_WORKERS or 'auto'}, "
+                  f"PARALLEL_BACKEND={PARALLEL_BACKEND}, "
+                  f"USE_TILED_COMPOSITING={USE_TILED_COMPOSITING}, "
+                  f"USE_FEATURE_CACHE={USE_FEATURE_CACHE}, "
+                  f"USE_COARSE_TO_FINE={USE_COARSE_TO_FINE}, WATCH_MODE={WATCH_MODE}, "
+                  f"CANVAS_BACKEND={CANVAS_BACKEND}")
+
+        # クローズアップの枚数と1枚目の画素数からコアの配分を決める
+        closeups = sorted(glob.glob(CLOSEUPS_GLOB))
+        thread_plan = plan_thread_budget(
+            len(closeups),
+            estimate_image_pixels(closeups[0] if closeups else None),
+            max_workers=MAX_WORKERS if USE_PARALLEL else 1,
+            mode=THREAD_BUDGET_MODE
+        )
+        write_log(f"[CONFIG] {describe_thread_budget(thread_plan)}")
 
     except IOError as e:
         print(f"[CRITICAL ERROR] Failed to open log file: {LOG_FILE}. {e}")
@@ -98,100 +203,171 @@ def write_log(message: str):
 # --- 5. 関数シグネチャ (コアロジック) ---
 
 
-def downsample_for_matching(img, scale=0.5):
+def downsample_for_matching(img, scale=0.5, force=False):
     """
     マッチング用に画像をダウンサンプリングする（高速化）。
 
     Args:
         img: 入力画像
         scale: ダウンサンプリング倍率（デフォルト0.5 = 半分）
+        force: True の場合 DOWNSAMPLE_FOR_MATCHING に関係なくダウンサンプリングする（粗推定用）
 
     Returns:
         ダウンサンプリングされた画像、スケール倍率
     """
-    if scale >= 1.0 or not DOWNSAMPLE_FOR_MATCHING:
+    if scale >= 1.0 or not (DOWNSAMPLE_FOR_MATCHING or force):
         return img, 1.0
 
     h, w = img.shape[:2]
     new_h, new_w = int(h * scale), int(w * scale)
-    downsampled = cv.resize(img, (new_w, new_h), interpolation=cv.INTER_AREA)
+    with span('downsample'):
+        downsampled = cv.resize(img, (new_w, new_h), interpolation=cv.INTER_AREA)
     return downsampled, scale
 
 
-def homography_sift(img, k1, d1, scale1=1.0):
+def detect_and_compute(img, path=None, scale=0.5, coarse=False):
     """
-    SIFT特徴量に基づき、base (k1, d1) から img へのホモグラフィを計算する。
-    k1, d1 はループ外で計算済みのものを利用する。
+    マッチング用にダウンサンプリングした画像からSIFT特徴量を計算する。
+    USE_FEATURE_CACHE が有効で path が与えられた場合は、画像内容ハッシュ +
+    検出パラメータをキーとするディスクキャッシュを利用する（ヒット時はSIFT計算を省略）。
+
+    Args:
+        img: 入力画像 (BGR)
+        path: img の画像ファイルのパス（キャッシュキーの計算に使用、Noneでキャッシュなし）
+        scale: ダウンサンプリング倍率
+        coarse: True の場合は粗推定用の検出器 (COARSE_SIFT_PARAMS) で常にダウンサンプリングする
+
+    Returns:
+        (points, descriptors, scale)
+        points: キーポイント座標 (N, 2) float32（ダウンサンプリング後の座標系）
+        scale: 実際に適用したダウンサンプリング倍率
+    """
+    applied_scale = scale if (scale < 1.0 and (DOWNSAMPLE_FOR_MATCHING or coarse)) else 1.0
+    detector = sift_coarse if coarse else sift
+    params = COARSE_SIFT_PARAMS if coarse else SIFT_PARAMS
+
+    def compute():
+        img_for_match, _ = downsample_for_matching(img, scale, force=coarse)
+        with span('detectAndCompute'):
+            img_gray = cv.cvtColor(img_for_match, cv.COLOR_BGR2GRAY)
+            return detector.detectAndCompute(img_gray, None)
+
+    if not USE_FEATURE_CACHE or path is None:
+        keypoints, descriptors = compute()
+        points = keypoints_to_points(keypoints)
+    else:
+        detector_params = dict(params, scale=applied_scale)
+        points, descriptors = cached_detect_and_compute(
+            path, detector_params, compute,
+            FEATURE_CACHE_DIR, FEATURE_CACHE_MAX_BYTES, return_points=True
+        )
+
+    return points, descriptors, applied_scale
+
+
+def homography_sift(img, p1, overview_index, scale1=1.0, path=None, region=None, stats=None):
+    """
+    SIFT特徴量に基づき、base (p1, d1) から img へのホモグラフィを計算する。
+    p1 とオーバービューのインデックス (d1 から構築) はループ外で計算済みのものを利用する。
+    特徴量の計算後のマッチングと推定は estimate_homography で行う。
 
     Args:
         img: クローズアップ画像
-        k1: ベース画像のキーポイント
-        d1: ベース画像のディスクリプタ
+        p1: ベース画像のキーポイント座標 (N, 2) float32
+        overview_index: ベース画像のディスクリプタ d1 のインデックス (build_overview_index)
         scale1: ベース画像のダウンサンプリング倍率
+        path: クローズアップ画像のファイルパス（特徴量キャッシュに使用、Noneでキャッシュなし）
+        region: 位置の事前情報（オーバービュー元解像度の多角形）。指定した場合は
+            空間インデックスでその領域内のベース特徴量だけを相手にマッチングする
+        stats: マッチング統計 (features, good_matches, inliers) を書き込む辞書（Noneで記録しない）
 
     Returns:
         ホモグラフィ行列（オリジナルスケール）またはNone
     """
     try:
-        # マッチング用にダウンサンプリング
-        img_for_match, scale2 = downsample_for_matching(img, DOWNSAMPLE_SCALE)
-        img_gray = cv.cvtColor(img_for_match, cv.COLOR_BGR2GRAY)
+        # 位置の事前情報がある場合は、領域内のベース特徴量だけに絞る
+        if region is not None:
+            restricted = restrict_to_region(overview_index, p1, region, scale1)
+            if restricted is not None:
+                p1, overview_index = restricted
+                write_log(f"[DEBUG] Matching against {len(p1)} overview features in prior region")
+                if len(p1) < SIFT_MIN_MATCHES:
+                    return None
+
+        # マッチング用にダウンサンプリングしてimgの特徴量を計算（キャッシュがあれば再利用）
+        p2, d2, scale2 = detect_and_compute(img, path, DOWNSAMPLE_SCALE)
+
+    except cv.error as e:
+        write_log(f"[ERROR] OpenCV error in homography_sift: {e}")
+        return None
+    except Exception as e:
+        write_log(f"[ERROR] Unexpected error in homography_sift: {e}")
+        return None
 
-        # imgの特徴量を計算
-        k2, d2 = sift.detectAndCompute(img_gray, None)
+    return estimate_homography(p1, overview_index, scale1, p2, d2, scale2, stats)
 
+
+def estimate_homography(p1, overview_index, scale1, p2, d2, scale2, stats=None):
+    """
+    計算済みのクローズアップの特徴量 (p2, d2) をオーバービューとマッチングし、ホモグラフィを推定する。
+    マッチング結果は DMatch を作らず、NumPy 配列のまま比率テストと座標の取り出しを行う。
+
+    Args:
+        p1: ベース画像のキーポイント座標 (N, 2) float32
+        overview_index: ベース画像のディスクリプタのインデックス (build_overview_index)
+        scale1: ベース画像のダウンサンプリング倍率
+        p2: クローズアップのキーポイント座標 (M, 2) float32
+        d2: クローズアップのディスクリプタ（特徴点がない場合 None）
+        scale2: クローズアップのダウンサンプリング倍率
+        stats: マッチング統計 (features, good_matches, inliers) を書き込む辞書（Noneで記録しない）
+
+    Returns:
+        ホモグラフィ行列（オリジナルスケール）またはNone
+    """
+    if stats is None:
+        stats = {}
+    stats['features'] = len(p2)
+
+    try:
         if d2 is None or len(d2) < SIFT_MIN_MATCHES:
             write_log(f"[DEBUG] Not enough features found in closeup image. Found: {len(d2) if d2 is not None else 0}")
             return None
 
-        # マッチング（FLANN または BFMatcher）
-        if USE_FLANN and flann is not None:
-            # FLANNマッチャー（高速）
-            matches = flann.knnMatch(d1, d2, k=2)
-        else:
-            # BFMatcher（従来の方法）
-            bf = cv.BFMatcher()
-            matches = bf.knnMatch(d1, d2, k=2)
-
-        # Lowe's ratio test
-        good = []
-        for m_n in matches:
-            if len(m_n) == 2:
-                m, n = m_n
-                # SIFTマッチング閾値: SIFT_RATIO_TEST
-                if m.distance < SIFT_RATIO_TEST * n.distance:
-                    good.append(m)
+        # マッチング: img の各特徴点について、構築済みインデックスからベース側の2近傍を探す
+        with span('knnMatch'):
+            indices, distances = query_overview_index(overview_index, d2, k=2)
+
+        # Lowe's ratio test（SIFTマッチング閾値: SIFT_RATIO_TEST）
+        # 条件を満たしたマッチのベース側・img側の番号配列
+        with span('ratio_test'):
+            base_idx, img_idx = ratio_test(indices, distances, SIFT_RATIO_TEST)
+        good_count = len(img_idx)
+        stats['good_matches'] = good_count
 
         # SIFT最小マッチ数: SIFT_MIN_MATCHES
-        if len(good) < SIFT_MIN_MATCHES:
+        if good_count < SIFT_MIN_MATCHES:
             msg = (
-                f"[DEBUG] Not enough good matches. Found {len(good)}, "
+                f"[DEBUG] Not enough good matches. Found {good_count}, "
                 f"required {SIFT_MIN_MATCHES}."
             )
             write_log(msg)
             return None
 
-        write_log(f"[DEBUG] Found {len(good)} good matches.")
-
-        # ダウンサンプリングを考慮してキーポイント座標をスケーリング
-        src_pts = np.float32([
-            [k1[m.queryIdx].pt[0] / scale1, k1[m.queryIdx].pt[1] / scale1]
-            for m in good
-        ]).reshape(-1, 1, 2)
+        write_log(f"[DEBUG] Found {good_count} good matches.")
 
-        dst_pts = np.float32([
-            [k2[m.trainIdx].pt[0] / scale2, k2[m.trainIdx].pt[1] / scale2]
-            for m in good
-        ]).reshape(-1, 1, 2)
+        # ダウンサンプリングを考慮してキーポイント座標をスケーリング（ファンシーインデックスで一括取得）
+        src_pts = (p1[base_idx] / scale1).astype(np.float32).reshape(-1, 1, 2)
+        dst_pts = (p2[img_idx] / scale2).astype(np.float32).reshape(-1, 1, 2)
 
         # RANSACパラメータを最適化（より厳格な外れ値除去）
-        H, mask = cv.findHomography(
-            dst_pts, src_pts,
-            method=cv.RANSAC,
-            ransacReprojThreshold=5.0,  # 5.0→3.0: より厳格な閾値
-            maxIters=5000,              # デフォルト2000→5000: より徹底的な探索
-            confidence=0.99            # デフォルト0.99→0.995: より高い信頼度
-        )
+        with span('findHomography'):
+            H, mask = cv.findHomography(
+                dst_pts, src_pts,
+                method=cv.RANSAC,
+                ransacReprojThreshold=5.0,  # 5.0→3.0: より厳格な閾値
+                maxIters=5000,              # デフォルト2000→5000: より徹底的な探索
+                confidence=0.99            # デフォルト0.99→0.995: より高い信頼度
+            )
 
         if H is None:
             write_log("[DEBUG] findHomography returned None.")
@@ -200,8 +376,9 @@ def homography_sift(img, k1, d1, scale1=1.0):
         # インライア数とインライア率をログ出力し、品質チェック
         if mask is not None:
             inliers = np.sum(mask)
-            inlier_ratio = inliers / len(good)
-            write_log(f"[DEBUG] RANSAC inliers: {inliers}/{len(good)} ({inlier_ratio:.1%})")
+            inlier_ratio = inliers / good_count
+            stats['inliers'] = int(inliers)
+            write_log(f"[DEBUG] RANSAC inliers: {inliers}/{good_count} ({inlier_ratio:.1%})")
 
             # インライア率が10%未満の場合は拒否
             if inlier_ratio < 0.1:
@@ -211,13 +388,112 @@ def homography_sift(img, k1, d1, scale1=1.0):
         return H
 
     except cv.error as e:
-        write_log(f"[ERROR] OpenCV error in homography_sift: {e}")
+        write_log(f"[ERROR] OpenCV error in estimate_homography: {e}")
         return None
     except Exception as e:
-        write_log(f"[ERROR] Unexpected error in homography_sift: {e}")
+        write_log(f"[ERROR] Unexpected error in estimate_homography: {e}")
         return None
 
 
+def prepare_coarse_overview(base):
+    """
+    粗推定用に、オーバービューを COARSE_SCALE に縮小した特徴量とインデックスを準備する。
+
+    Returns:
+        粗推定用の辞書 (points, index, scale) または None（特徴点が得られない場合）
+    """
+    points, descriptors, scale = detect_and_compute(base, OVERVIEW, COARSE_SCALE, coarse=True)
+    if descriptors is None or len(points) < COARSE_MIN_MATCHES:
+        return None
+
+    # 特徴点が少ないので総当たりで十分（インデックス構築も不要）
+    index = build_overview_index(descriptors, use_flann=False)
+    return {'points': points, 'index': index, 'scale': scale}
+
+
+def locate_closeup_coarse(img, coarse, path=None):
+    """
+    低解像度の特徴量で img のオーバービュー上のおおよその位置を求める。
+
+    Returns:
+        img の四隅をオーバービュー座標系（元解像度）に射影した (4, 2) 配列、または None
+    """
+    pc, dc, scale_c = detect_and_compute(img, path, COARSE_SCALE, coarse=True)
+    if dc is None or len(dc) < COARSE_MIN_MATCHES:
+        return None
+
+    with span('knnMatch'):
+        indices, distances = query_overview_index(coarse['index'], dc, k=2)
+    with span('ratio_test'):
+        base_idx, img_idx = ratio_test(indices, distances, SIFT_RATIO_TEST)
+    if len(img_idx) < COARSE_MIN_MATCHES:
+        return None
+
+    src_pts = (coarse['points'][base_idx] / coarse['scale']).astype(np.float32).reshape(-1, 1, 2)
+    dst_pts = (pc[img_idx] / scale_c).astype(np.float32).reshape(-1, 1, 2)
+
+    # 粗推定は位置の予測だけに使うので、再投影誤差の閾値は縮小率に合わせて緩める
+    with span('findHomography'):
+        H, _ = cv.findHomography(
+            dst_pts, src_pts,
+            method=cv.RANSAC,
+            ransacReprojThreshold=5.0 / coarse['scale'],
+            maxIters=2000,
+            confidence=0.99
+        )
+    if H is None:
+        return None
+
+    h_img, w_img = img.shape[:2]
+    corners = np.float32([[0, 0], [w_img, 0], [w_img, h_img], [0, h_img]]).reshape(-1, 1, 2)
+    projected = cv.perspectiveTransform(corners, H).reshape(-1, 2)
+    if not np.all(np.isfinite(projected)):
+        return None
+    return projected
+
+
+def homography_coarse_to_fine(img, p1, overview_index, scale1, coarse, path=None, stats=None):
+    """
+    2段階でホモグラフィを推定する。
+
+    1. 低解像度 (COARSE_SCALE) の少数の特徴量でオーバービュー上のおおよその位置を求める
+    2. 予測領域（マージン付き）内のオーバービュー特徴量だけを相手に、通常解像度でマッチングする
+       （領域内の特徴量は空間インデックス overview_index['grid'] で取り出す）
+
+    粗推定や領域内での推定に失敗した場合は、オーバービュー全体とのマッチングに戻る。
+
+    Args:
+        img: クローズアップ画像
+        p1: ベース画像のキーポイント座標 (N, 2)
+        overview_index: ベース画像のディスクリプタ d1 のインデックス（空間インデックス付き）
+        scale1: ベース画像のダウンサンプリング倍率
+        coarse: prepare_coarse_overview の戻り値
+        path: クローズアップ画像のファイルパス（特徴量キャッシュに使用）
+        stats: マッチング統計を書き込む辞書（homography_sift と同じ）
+
+    Returns:
+        ホモグラフィ行列（オリジナルスケール）またはNone
+    """
+    try:
+        polygon = locate_closeup_coarse(img, coarse, path)
+    except cv.error as e:
+        write_log(f"[DEBUG] Coarse pass failed: {e}")
+        polygon = None
+
+    if polygon is not None:
+        # 予測領域（マージン付き）内のオーバービュー特徴量だけを相手にマッチングする
+        region = expand_bbox_polygon(polygon, COARSE_REGION_MARGIN)
+        write_log("[DEBUG] Coarse pass located closeup")
+        H = homography_sift(img, p1, overview_index, scale1, path, region=region, stats=stats)
+        if H is not None:
+            return H
+        write_log("[DEBUG] Region-restricted matching failed, falling back to full overview")
+    else:
+        write_log("[DEBUG] Coarse pass could not locate closeup, falling back to full overview")
+
+    return homography_sift(img, p1, overview_index, scale1, path, stats=stats)
+
+
 def validate_homography(H):
     """
     ホモグラフィ行列の妥当性を検証する。
@@ -258,50 +534,24 @@ def validate_homography(H):
         return False
 
 
-def warp_and_blend(canvas, img, H, strength):
+def warp_and_blend(canvas, img, H, strength, closeup=None):
     """
     img を H に従ってワープし、ガウシアンブラーマスクを使用して canvas にブレンディングする。
     canvas はインプレース(参照渡し)で更新される。
-    """
-    h_canvas, w_canvas = canvas.shape[:2]
-    h_img, w_img = img.shape[:2]
+    closeup を指定した場合、ワープ・ブレンドの所要時間をそのクローズアップの区間として記録する。
 
+    ワープ・マスク生成・ブレンディングは、クローズアップの四隅を H で射影した
+    範囲 (ROI) 内だけで行う（canvas 全体サイズの一時配列を作らない）。
+    CANVAS_BACKEND が "memmap" の場合は、さらに ROI をタイル単位に分けて処理する。
+    """
     try:
-        # 1. img を canvas サイズにワープ
-        warped = cv.warpPerspective(img, H, (w_canvas, h_canvas))
-
-        # 2. img のマスクを作成 (imgが存在する領域=255)
-        mask = np.ones((h_img, w_img), dtype=np.uint8) * 255
-        mask_warped = cv.warpPerspective(mask, H, (w_canvas, h_canvas))
-
-        # 3. マスクのエッジをぼかす (STRENGTHを使用)
-        # strength は奇数である必要がある
-        blend_strength = strength if strength % 2 == 1 else strength + 1
-
-        # ガウシアンブラーで滑らかなマスクを作成
-        mask_blur = cv.GaussianBlur(
-            mask_warped, (blend_strength, blend_strength), 0
-        )
-
-        # 4. マスクを 0.0 ～ 1.0 の浮動小数点数に変換
-        mask_float = mask_blur.astype(np.float32) / 255.0
-
-        # 5. 3チャンネル (BGR) に拡張
-        mask_float_3ch = cv.cvtColor(mask_float, cv.COLOR_GRAY2BGR)
-
-        # 6. 計算のために float32 に変換
-        canvas_float = canvas.astype(np.float32)
-        warped_float = warped.astype(np.float32)
-
-        # 7. アルファブレンディング
-        # blended = canvas * (1 - mask) + warped * (mask)
-        blended = (
-            canvas_float * (1.0 - mask_float_3ch)
-            + warped_float * mask_float_3ch
-        )
-
-        # 8. 0-255 の範囲にクリップし、uint8 に戻して canvas を更新
-        canvas[:] = np.clip(blended, 0, 255).astype(np.uint8)
+        with timing_recorder.scope(closeup):
+            if CANVAS_BACKEND == "memmap":
+                blended = warp_and_blend_tiles(canvas, img, H, strength, tile_size=COMPOSITE_TILE_SIZE)
+            else:
+                blended = warp_and_blend_roi(canvas, img, H, strength)
+        if not blended:
+            write_log("[WARNING] Warped closeup does not overlap the canvas, nothing blended")
 
     except cv.error as e:
         write_log(f"[ERROR] OpenCV error in warp_and_blend: {e}")
@@ -309,48 +559,652 @@ def warp_and_blend(canvas, img, H, strength):
         write_log(f"[ERROR] Unexpected error in warp_and_blend: {e}")
 
 
-def process_single_closeup(path, k1, d1, scale1, Hscale):
+def process_single_closeup(path, p1, overview_index, scale1, Hscale, coarse=None, region=None,
+                           stats=None):
     """
     単一のクローズアップ画像を処理する（並列処理用）。
 
     Args:
         path: 画像ファイルパス
-        k1: ベース画像のキーポイント
-        d1: ベース画像のディスクリプタ
+        p1: ベース画像のキーポイント座標 (N, 2)
+        overview_index: ベース画像のディスクリプタのインデックス
         scale1: ベース画像のダウンサンプリング倍率
         Hscale: スケーリング行列
+        coarse: 粗推定用のオーバービュー情報（Noneで2段階推定を行わない）
+        region: 位置の事前情報（オーバービュー元解像度の多角形、Noneで全体から探す）
+        stats: マッチング統計を書き込む辞書（Noneで記録しない）
 
     Returns:
         (filename, status, H_to_canvas, img) または (filename, 'skip', None, None)
     """
     filename = os.path.basename(path)
 
+    with timing_recorder.scope(filename):
+        try:
+            # a. (読み込み)
+            with span('imread'):
+                img = cv.imread(path)
+
+            # b. (読み込み失敗)
+            if img is None:
+                return (filename, 'skip', None, None, "Cannot read image")
+
+            # c. (SIFT推定)
+            if coarse is not None:
+                H = homography_coarse_to_fine(img, p1, overview_index, scale1, coarse, path, stats)
+            else:
+                H = None
+                if region is not None:
+                    # 事前情報の領域内で見つからなければ全体から探す
+                    H = homography_sift(img, p1, overview_index, scale1, path, region=region, stats=stats)
+                    if H is None:
+                        write_log("[DEBUG] Prior region matching failed, falling back to full overview")
+                if H is None:
+                    H = homography_sift(img, p1, overview_index, scale1, path, stats=stats)
+
+            # d. (推定失敗)
+            if H is None:
+                return (filename, 'skip', None, None, "homography failed")
+
+            # e. (ホモグラフィ妥当性検証)
+            with span('validate'):
+                valid = validate_homography(H)
+            if not valid:
+                return (filename, 'skip', None, None, "invalid homography matrix")
+
+            # キャンバス座標系への変換行列
+            H_to_canvas = Hscale @ H
+
+            return (filename, 'success', H_to_canvas, img, None)
+
+        except Exception as e:
+            return (filename, 'skip', None, None, f"Error: {e}")
+
+
+# --- プロセスプール (PARALLEL_BACKEND = "process") ---
+
+# ワーカープロセス内で共有する状態（_init_process_worker で1回だけ設定）
+_worker_state = None
+
+
+def _init_process_worker(spec, scale1, Hscale, coarse_scale, cv_threads):
+    """
+    プロセスワーカーの初期化。共有メモリのオーバービュー特徴量からインデックスを準備する。
+
+    SIFT 検出器はモジュール読み込み時に作られる。FLANN インデックスは PERSIST_FLANN_INDEX が
+    有効ならメインプロセスが保存したものを読み込むだけなので、ワーカー数分構築し直すことはない。
+    """
+    global _worker_state, log_f
+
+    # ワーカーの数だけ OpenCV の内部スレッドを減らして、コア数を超えないようにする
+    apply_stage_threads(cv_threads)
+
+    # DEBUG ログもメインプロセスと同じログファイルに追記する
     try:
-        # a. (読み込み)
-        img = cv.imread(path)
+        log_f = open(LOG_FILE, "a", encoding="utf-8")
+    except IOError:
+        log_f = None
+
+    handles, arrays = attach_shared_arrays(spec)
+    p1 = arrays['p1']
+    overview_index = build_overview_index(
+        arrays['d1'], use_flann=USE_FLANN, trees=FLANN_TREES, checks=FLANN_CHECKS,
+        cache_dir=FEATURE_CACHE_DIR if PERSIST_FLANN_INDEX else None,
+        cache_max_bytes=FEATURE_CACHE_MAX_BYTES
+    )
+    overview_index['grid'] = build_spatial_grid(p1, SPATIAL_GRID_CELL_SIZE)
+
+    coarse = None
+    if 'coarse_points' in arrays:
+        coarse = {
+            'points': arrays['coarse_points'],
+            'index': build_overview_index(arrays['coarse_descriptors'], use_flann=False),
+            'scale': coarse_scale,
+        }
+
+    _worker_state = {
+        'handles': handles,
+        'p1': p1,
+        'overview_index': overview_index,
+        'scale1': scale1,
+        'Hscale': Hscale,
+        'coarse': coarse,
+    }
+
+
+def process_closeup_in_worker(path):
+    """
+    プロセスワーカーで1枚のクローズアップのホモグラフィを推定する。
 
-        # b. (読み込み失敗)
-        if img is None:
-            return (filename, 'skip', None, None, "Cannot read image")
+    画像は pickle で返さず、合成側で読み込み直す。
+
+    Returns:
+        (filename, status, H_to_canvas, error_msg, stats, spans)。spans は推定の所要時間
+        （TimingRecorder.pop_closeup。親プロセスの timing_recorder に記録し直す）
+    """
+    state = _worker_state
+    stats = {}
+    filename, status, H_to_canvas, _, error_msg = process_single_closeup(
+        path, state['p1'], state['overview_index'], state['scale1'], state['Hscale'],
+        state['coarse'], stats=stats
+    )
+    return filename, status, H_to_canvas, error_msg, stats, timing_recorder.pop_closeup(filename)
+
+
+def stitch_with_process_pool(canvas, sorted_paths, p1, d1, scale1, Hscale, coarse):
+    """
+    プロセスプールでホモグラフィを推定し、ファイル名順に canvas へ合成する。
 
-        # c. (SIFT推定)
-        H = homography_sift(img, k1, d1, scale1)
+    オーバービューの特徴量は共有メモリで各ワーカーに渡し、ワーカーからはホモグラフィと
+    マッチング統計だけを受け取る。合成はこのプロセスで画像を読み込み直して行い、
+    後続のクローズアップの推定と並行して進む。
+
+    Returns:
+        (success_count, skip_count)
+    """
+    n_workers = thread_plan['workers']
+    cv_threads = thread_plan['cv_threads']
+    write_log(
+        f"[INFO] Using process pool with {n_workers} workers "
+        f"({cv_threads} OpenCV threads each)"
+    )
+
+    arrays = {'p1': p1, 'd1': d1}
+    coarse_scale = None
+    if coarse is not None:
+        arrays['coarse_points'] = coarse['points']
+        arrays['coarse_descriptors'] = coarse['index']['descriptors']
+        coarse_scale = coarse['scale']
+
+    success_count = 0
+    skip_count = 0
+    handles, spec = share_arrays(arrays)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_process_worker,
+            initargs=(spec, scale1, Hscale, coarse_scale, cv_threads)
+        ) as executor:
+            futures = [executor.submit(process_closeup_in_worker, path) for path in sorted_paths]
+
+            # 投入順（ファイル名順）に結果を受け取って合成する
+            for path, future in zip(sorted_paths, futures):
+                filename = os.path.basename(path)
+                try:
+                    filename, status, H_to_canvas, error_msg, stats, spans = future.result()
+                except Exception as e:
+                    write_log(f"[skip] {filename} : Exception in processing: {e}")
+                    record_closeup(path, error_msg=f"Exception in processing: {e}")
+                    skip_count += 1
+                    continue
+                timing_recorder.merge_closeup(filename, spans)
+
+                if status == 'skip':
+                    write_log(f"[skip] {filename} : {error_msg}")
+                    record_closeup(path, error_msg=error_msg)
+                    skip_count += 1
+                    continue
+
+                with timing_recorder.scope(filename), span('imread'):
+                    img = cv.imread(path)
+                if img is None:
+                    write_log(f"[skip] {filename} : Cannot read image")
+                    record_closeup(path, error_msg="Cannot read image")
+                    skip_count += 1
+                    continue
+
+                write_log(
+                    f"[INFO] Processing: {filename} (matches: {stats.get('good_matches', 0)}, "
+                    f"inliers: {stats.get('inliers', 0)})"
+                )
+                warp_and_blend(canvas, img, H_to_canvas, strength=STRENGTH, closeup=filename)
+                write_log(f"[blend] {filename}")
+                record_closeup(path, H_to_canvas, img.shape)
+                success_count += 1
+    finally:
+        release_shared_arrays(handles)
+
+    return success_count, skip_count
+
+
+def stitch_with_pipeline(canvas, sorted_paths, p1, overview_index, scale1, Hscale, coarse):
+    """
+    段階別のパイプラインでクローズアップを処理し、ファイル名順に canvas へ合成する。
+
+    読み込み → 特徴量 → マッチング/ホモグラフィ → ワープ → 合成 の各段階を有界キューでつなぎ、
+    同時に処理中のクローズアップを PIPELINE_WINDOW 枚までに制限する。
+    合成が推定より遅くても、デコード済みの画像が枚数分たまることはない。
+
+    Returns:
+        (success_count, skip_count)
+    """
+    stage_threads = plan_pipeline_threads(thread_plan, PIPELINE_DECODE_WORKERS, PIPELINE_WARP_WORKERS)
+    window = PIPELINE_WINDOW or thread_plan['workers'] * 2 + 4
+    use_tiles = CANVAS_BACKEND == "memmap"
+    counts = {'success': 0, 'skip': 0}
+
+    def timed(stage):
+        # 各段階の処理中に計測した区間を、そのクローズアップの区間として記録する
+        def run(*args):
+            with timing_recorder.scope(os.path.basename(args[-1]['input'])):
+                return stage(*args)
+        return run
+
+    def decode(job):
+        with span('imread'):
+            img = cv.imread(job['input'])
+        if img is None:
+            job['skip'] = "Cannot read image"
+        else:
+            job['img'] = img
+            job['shape'] = img.shape
+
+    def features(job):
+        # 2段階推定では粗推定の結果で特徴量の使い方が変わるので、マッチング段階でまとめて行う
+        if coarse is None:
+            job['features'] = detect_and_compute(job['img'], job['input'], DOWNSAMPLE_SCALE)
+
+    def match(job):
+        stats = {}
+        if coarse is not None:
+            H = homography_coarse_to_fine(job['img'], p1, overview_index, scale1, coarse, job['input'], stats)
+        else:
+            p2, d2, scale2 = job.pop('features')
+            H = estimate_homography(p1, overview_index, scale1, p2, d2, scale2, stats)
+        job['stats'] = stats
 
-        # d. (推定失敗)
         if H is None:
-            return (filename, 'skip', None, None, "homography failed")
+            job['skip'] = "homography failed"
+            return
+        with span('validate'):
+            valid = validate_homography(H)
+        if not valid:
+            job['skip'] = "invalid homography matrix"
+        else:
+            job['H_to_canvas'] = Hscale @ H
+
+    def warp(job):
+        # memmap の canvas では合成段階でタイル単位にワープする
+        if use_tiles:
+            return
+        prepared = warp_roi(canvas.shape, job.pop('img'), job['H_to_canvas'], STRENGTH)
+        if prepared is None:
+            job['skip'] = "warped closeup does not overlap the canvas"
+        else:
+            job['prepared'] = prepared
+
+    def blend(index, job):
+        filename = os.path.basename(job['input'])
+        if 'skip' in job:
+            write_log(f"[skip] {filename} : {job['skip']}")
+            record_closeup(job['input'], error_msg=job['skip'])
+            counts['skip'] += 1
+            return
+
+        write_log(f"[INFO] Processing: {filename}")
+        if use_tiles:
+            warp_and_blend(canvas, job['img'], job['H_to_canvas'], strength=STRENGTH)
+        else:
+            blend_roi(canvas, *job['prepared'])
+        write_log(f"[blend] {filename}")
+        record_closeup(job['input'], job['H_to_canvas'], job['shape'])
+        counts['success'] += 1
+
+    write_log(
+        f"[INFO] Using pipeline with {stage_threads['decode']} decode, {stage_threads['features']} feature, "
+        f"{stage_threads['match']} match and {stage_threads['warp']} warp workers "
+        f"({stage_threads['cv_threads']} OpenCV threads each), window {window}"
+    )
+    apply_stage_threads(stage_threads['cv_threads'])
+
+    stage_stats = run_pipeline(
+        sorted_paths,
+        [
+            ("decode", timed(decode), stage_threads['decode']),
+            ("features", timed(features), stage_threads['features']),
+            ("match", timed(match), stage_threads['match']),
+            ("warp", timed(warp), stage_threads['warp']),
+        ],
+        timed(blend), sink_name="blend", window=window, queue_size=PIPELINE_QUEUE_SIZE
+    )
+    for line in format_stage_stats(stage_stats):
+        write_log(f"[STATS] {line}")
+
+    return counts['success'], counts['skip']
 
-        # e. (ホモグラフィ妥当性検証)
-        if not validate_homography(H):
-            return (filename, 'skip', None, None, "invalid homography matrix")
 
-        # キャンバス座標系への変換行列
-        H_to_canvas = Hscale @ H
+def record_closeup(path, H_to_canvas=None, img_shape=None, error_msg=None):
+    """
+    クローズアップの合成結果を記録する（マニフェスト用）。error_msg を指定した場合はスキップ扱い。
+    """
+    if error_msg is not None:
+        closeup_records[path] = {'status': 'skip', 'H': None, 'shape': None, 'error': error_msg}
+    else:
+        closeup_records[path] = {
+            'status': 'success', 'H': np.asarray(H_to_canvas, dtype=np.float64),
+            'shape': img_shape[:2], 'error': None
+        }
 
-        return (filename, 'success', H_to_canvas, img, None)
 
+def make_manifest_settings(canvas_shape):
+    """
+    合成結果に影響する設定をまとめる（前回と一致しない場合は差分合成せず全体を合成する）。
+    """
+    return {
+        'overview': file_content_hash(OVERVIEW),
+        'canvas_shape': list(canvas_shape),
+        'canvas_scale': CANVAS_SCALE,
+        'strength': STRENGTH,
+        'sift': SIFT_PARAMS,
+        'downsample_scale': DOWNSAMPLE_SCALE if DOWNSAMPLE_FOR_MATCHING else 1.0,
+        'ratio_test': SIFT_RATIO_TEST,
+        'min_matches': SIFT_MIN_MATCHES,
+        'flann': [USE_FLANN, FLANN_TREES, FLANN_CHECKS],
+        'coarse_to_fine': [
+            USE_COARSE_TO_FINE, COARSE_SCALE, COARSE_MAX_FEATURES,
+            COARSE_MIN_MATCHES, COARSE_REGION_MARGIN
+        ],
+        'neighbor_prior': [USE_NEIGHBOR_PRIOR, NEIGHBOR_PRIOR_MARGIN],
+    }
+
+
+def manifest_entries(paths, hashes, canvas_shape):
+    """
+    closeup_records からマニフェストの closeups を作る。
+    """
+    entries = {}
+    for path in paths:
+        record = closeup_records.get(path)
+        if record is None:
+            continue
+        if record['status'] == 'skip':
+            entries[path] = make_entry(hashes[path], 'skip', error=record['error'])
+            continue
+        h_img, w_img = record['shape']
+        roi = warp_footprint(record['H'], (h_img, w_img), canvas_shape, STRENGTH)
+        entries[path] = make_entry(hashes[path], 'success', record['H'], (w_img, h_img), roi)
+    return entries
+
+
+def render_incremental(canvas, sorted_paths, hashes, settings, p1, overview_index, scale1, Hscale, coarse):
+    """
+    前回のマニフェストと出力画像を使い、変更があった範囲のタイルだけを合成し直す。
+
+    1. 内容ハッシュで 変更なし / 変更・追加 / 削除 のクローズアップを判別する
+    2. 変更・追加されたものだけホモグラフィを推定し直す（変更なしは前回の結果を使う）
+    3. 前回と今回の書き込み範囲が重なるタイルを「要再合成」とし、それ以外のタイルは前回の出力をコピーする
+    4. 要再合成のタイルは元の canvas（オーバービューの拡大）から、重なるクローズアップを
+       ファイル名順にブレンドし直す（全体を合成した場合と同一の結果になる）
+
+    Returns:
+        (success_count, skip_count)。前回の結果が使えない場合は None（全体を合成する）
+    """
+    out_manifest = manifest_path(OUT)
+    previous = load_manifest(out_manifest)
+    if previous is None:
+        write_log(f"[INFO] No previous manifest ({out_manifest}), rendering everything")
+        return None
+    if not settings_match(previous, settings):
+        write_log("[INFO] Settings changed since the previous run, rendering everything")
+        return None
+
+    previous_out = cv.imread(OUT)
+    if previous_out is None or previous_out.shape != canvas.shape:
+        write_log(f"[INFO] Previous output {OUT} is missing or has a different size, rendering everything")
+        return None
+
+    prev_entries = previous['closeups']
+    unchanged, changed, removed = diff_closeups(prev_entries, hashes)
+    write_log(
+        f"[INFO] Incremental render: {len(unchanged)} unchanged, "
+        f"{len(changed)} changed/added, {len(removed)} removed"
+    )
+
+    # 1. 変更なしのクローズアップは前回の推定結果をそのまま使う
+    for path in unchanged:
+        entry = prev_entries[path]
+        if entry['status'] == 'success':
+            width, height = entry['size']
+            record_closeup(path, np.array(entry['H']), (height, width))
+        else:
+            record_closeup(path, error_msg=entry['error'])
+
+    # 2. 変更・追加されたクローズアップのホモグラフィを推定
+    apply_stage_threads(thread_plan['cv_threads'])
+    with ThreadPoolExecutor(max_workers=thread_plan['workers']) as executor:
+        results = executor.map(
+            lambda path: process_single_closeup(path, p1, overview_index, scale1, Hscale, coarse),
+            changed
+        )
+        for path, (filename, status, H_to_canvas, img, error_msg) in zip(changed, results):
+            if status == 'skip':
+                write_log(f"[skip] {filename} : {error_msg}")
+                record_closeup(path, error_msg=error_msg)
+            else:
+                record_closeup(path, H_to_canvas, img.shape)
+
+    # 3. 合成し直すタイルを求め、それ以外は前回の出力から復元
+    current = manifest_entries(sorted_paths, hashes, canvas.shape)
+    tiles = make_tile_grid(canvas.shape, COMPOSITE_TILE_SIZE)
+    dirty = set()
+    for rect in dirty_rects(prev_entries, current, changed, removed):
+        dirty.update(tiles_for_rect(rect, COMPOSITE_TILE_SIZE))
+
+    for key, (x0, y0, x1, y1) in tiles.items():
+        if key not in dirty:
+            canvas[y0:y1, x0:x1] = previous_out[y0:y1, x0:x1]
+    del previous_out
+
+    # 4. 要再合成のタイルに重なるクローズアップをファイル名順にブレンド
+    reblended = 0
+    for path in sorted_paths:
+        entry = current[path]
+        if entry['status'] != 'success' or entry['roi'] is None:
+            continue
+        rects = [tiles[key] for key in tiles_for_rect(entry['roi'], COMPOSITE_TILE_SIZE) if key in dirty]
+        if not rects:
+            continue
+
+        with timing_recorder.scope(os.path.basename(path)):
+            with span('imread'):
+                img = cv.imread(path)
+            if img is None:
+                write_log(f"[ERROR] Failed to re-read {path} for recompositing")
+                continue
+            warp_and_blend_into_rects(canvas, img, closeup_records[path]['H'], STRENGTH, rects)
+        write_log(f"[blend] {os.path.basename(path)} ({len(rects)} tiles)")
+        reblended += 1
+
+    write_log(
+        f"[INFO] Recomposited {len(dirty)}/{len(tiles)} tiles, "
+        f"re-blended {reblended} closeups"
+    )
+
+    success_count = sum(1 for entry in current.values() if entry['status'] == 'success')
+    return success_count, len(current) - success_count
+
+
+def save_canvas(canvas, path):
+    """
+    canvas を一時ファイルに書き出してから置き換える（書き込み途中のファイルを残さない）。
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"
+    with span('imwrite'):
+        written = cv.imwrite(tmp_path, canvas)
+    if not written:
+        raise IOError(f"cv.imwrite failed: {tmp_path}")
+    os.replace(tmp_path, path)
+
+
+class _WakeupHandler(FileSystemEventHandler):
+    """
+    監視フォルダでファイルが作成・移動・更新されたら監視ループを起こす。
+    """
+
+    def __init__(self, wakeup):
+        super().__init__()
+        self.wakeup = wakeup
+
+    def on_any_event(self, event):
+        self.wakeup.set()
+
+
+def start_folder_watcher(watch_dir, wakeup):
+    """
+    watchdog (Linux では inotify) でフォルダを監視する。使えない場合は None（ポーリングのみ）。
+    """
+    if Observer is None:
+        return None
+    try:
+        observer = Observer()
+        observer.schedule(_WakeupHandler(wakeup), watch_dir, recursive=False)
+        observer.start()
+        return observer
     except Exception as e:
-        return (filename, 'skip', None, None, f"Error: {e}")
+        write_log(f"[WARNING] Folder watcher unavailable, falling back to polling: {e}")
+        return None
+
+
+def poll_ready_closeups(seen, candidates, now):
+    """
+    CLOSEUPS_GLOB に一致する未処理ファイルのうち、書き込みが完了したものを返す。
+
+    ファイルサイズと更新時刻が WATCH_SETTLE_TIME 秒変化しなければ完了とみなす。
+
+    Args:
+        seen: 処理済み（投入済み）のパスの集合
+        candidates: 書き込み完了待ちのパス -> (size, mtime, 変化がなくなった時刻)（更新される）
+        now: 現在時刻 (time.monotonic)
+
+    Returns:
+        ファイル名順に並んだ、処理を開始できるパスのリスト
+    """
+    ready = []
+    for path in sorted(glob.glob(CLOSEUPS_GLOB)):
+        if path in seen:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+
+        previous = candidates.get(path)
+        if previous is None or previous[:2] != (stat.st_size, stat.st_mtime):
+            candidates[path] = (stat.st_size, stat.st_mtime, now)
+        elif stat.st_size > 0 and now - previous[2] >= WATCH_SETTLE_TIME:
+            del candidates[path]
+            ready.append(path)
+    return ready
+
+
+def watch_and_stitch(canvas, p1, overview_index, scale1, Hscale, coarse):
+    """
+    クローズアップのフォルダを監視し、追加されたファイルを逐次合成する（監視モード）。
+
+    オーバービューの特徴量・インデックス・canvas は常駐させたまま、新しいファイルを
+    ワーカープールの process_single_closeup に投入し、完了したものから canvas に合成する。
+    CHECKPOINT_INTERVAL 秒ごとに canvas を OUT に保存する。
+    合成順は到着順（同時に完了したものはファイル名順）。
+
+    WATCH_IDLE_TIMEOUT 秒新しいファイルがなければ終了する。Ctrl+C でも処理中のものを合成して終了する。
+
+    Returns:
+        (success_count, skip_count)
+    """
+    watch_dir = os.path.dirname(CLOSEUPS_GLOB) or "."
+    wakeup = threading.Event()
+    observer = start_folder_watcher(watch_dir, wakeup)
+    mode = "watchdog events + polling" if observer is not None else "polling"
+    write_log(f"[INFO] Watching {CLOSEUPS_GLOB} ({mode}, idle timeout: {WATCH_IDLE_TIMEOUT}s)")
+
+    success_count = 0
+    skip_count = 0
+    seen = set()
+    candidates = {}
+    in_flight = {}
+    dirty = False
+    last_activity = time.monotonic()
+    last_checkpoint = time.monotonic()
+    stopping = False
+
+    apply_stage_threads(thread_plan['cv_threads'])
+    executor = ThreadPoolExecutor(max_workers=thread_plan['workers'])
+
+    try:
+        while True:
+            try:
+                now = time.monotonic()
+
+                # 1. 書き込みが完了した新しいファイルをワーカーに投入
+                if not stopping:
+                    for path in poll_ready_closeups(seen, candidates, now):
+                        seen.add(path)
+                        write_log(f"[INFO] New closeup: {os.path.basename(path)}")
+                        future = executor.submit(
+                            process_single_closeup, path, p1, overview_index, scale1, Hscale, coarse
+                        )
+                        future.add_done_callback(lambda _: wakeup.set())
+                        in_flight[future] = path
+                        last_activity = now
+
+                # 2. 完了したものを合成（canvas への書き込みはこのスレッドだけ）
+                done = sorted(
+                    (future for future in in_flight if future.done()),
+                    key=lambda future: in_flight[future]
+                )
+                for future in done:
+                    path = in_flight.pop(future)
+                    try:
+                        filename, status, H_to_canvas, img, error_msg = future.result()
+                    except Exception as e:
+                        filename, status, error_msg = os.path.basename(path), 'skip', f"Exception in processing: {e}"
+
+                    if status == 'skip':
+                        write_log(f"[skip] {filename} : {error_msg}")
+                        skip_count += 1
+                    else:
+                        warp_and_blend(canvas, img, H_to_canvas, strength=STRENGTH, closeup=filename)
+                        write_log(f"[blend] {filename}")
+                        success_count += 1
+                        dirty = True
+                    last_activity = time.monotonic()
+
+                # 3. 定期的に途中結果を保存
+                if dirty and time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    try:
+                        save_canvas(canvas, OUT)
+                        write_log(f"[INFO] Checkpoint saved: {OUT} (blended: {success_count})")
+                    except Exception as e:
+                        write_log(f"[ERROR] Failed to save checkpoint {OUT}: {e}")
+                    dirty = False
+                    last_checkpoint = time.monotonic()
+
+                # 4. 終了判定
+                if stopping and not in_flight:
+                    break
+                if (
+                    WATCH_IDLE_TIMEOUT is not None and not in_flight and not candidates
+                    and time.monotonic() - last_activity >= WATCH_IDLE_TIMEOUT
+                ):
+                    write_log(f"[INFO] No new closeups for {WATCH_IDLE_TIMEOUT}s, stopping watch mode")
+                    break
+
+                wakeup.wait(0.2 if in_flight else WATCH_POLL_INTERVAL)
+                wakeup.clear()
+
+            except KeyboardInterrupt:
+                if stopping:
+                    raise
+                write_log("[INFO] Watch mode interrupted, finishing in-flight closeups")
+                stopping = True
+    finally:
+        executor.shutdown(wait=True)
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+    return success_count, skip_count
 
 
 # --- 4. 実行フロー ---
@@ -361,9 +1215,13 @@ def main():
     # [起動] ログ初期化
     setup_logging()
 
+    # メインスレッドで計測した区間（オーバービューの処理・保存など）は実行全体の区間として記録する
+    timing_recorder.bind()
+
     # [入力検証 1] 広角画像読み込み
     try:
-        base = cv.imread(OVERVIEW)
+        with span('imread'):
+            base = cv.imread(OVERVIEW)
         if base is None:
             write_log(f"[ERROR] Overview image not found: {OVERVIEW}")
             sys.exit(1)  # 処理停止
@@ -376,7 +1234,8 @@ def main():
     # [入力検証 2] 近接画像リスト取得
     try:
         closeups_paths = glob.glob(CLOSEUPS_GLOB)
-        if not closeups_paths:
+        # 監視モードでは、起動時にまだクローズアップがなくてもよい
+        if not closeups_paths and not WATCH_MODE:
             msg = (
                 "[ERROR] No closeup images found matching pattern: "
                 + CLOSEUPS_GLOB
@@ -393,111 +1252,268 @@ def main():
     h_base, w_base = base.shape[:2]
 
     # 1. 広角画像を CANVAS_SCALE 倍にリサイズし、canvas 変数に格納
+    #    (CANVAS_BACKEND="memmap" ではディスク上のファイルに帯ごとに書き込む)
     try:
-        new_w = w_base * CANVAS_SCALE
-        new_h = h_base * CANVAS_SCALE
-        canvas = cv.resize(
-            base, (new_w, new_h), interpolation=cv.INTER_CUBIC
-        )
-    except cv.error as e:
+        with span('canvas'):
+            canvas = create_canvas(
+                base, CANVAS_SCALE, backend=CANVAS_BACKEND, memmap_path=CANVAS_MEMMAP_PATH
+            )
+    except (cv.error, OSError, ValueError) as e:
         write_log(f"[ERROR] Failed to resize canvas: {e}")
         sys.exit(1)
 
     write_log(
         f"[INFO] Canvas created with scale {CANVAS_SCALE}x. "
-        f"Dimensions: {canvas.shape[1]}x{canvas.shape[0]}"
+        f"Dimensions: {canvas.shape[1]}x{canvas.shape[0]} (backend: {CANVAS_BACKEND})"
     )
 
-    # 2. マッチング用にベース画像をダウンサンプリング
-    base_for_match, scale1 = downsample_for_matching(base, DOWNSAMPLE_SCALE)
-
-    # 3. ダウンサンプリングされたbase画像（グレースケール）からSIFT特徴量（k1, d1）を計算
+    canvas_shape = canvas.shape
     try:
-        base_gray = cv.cvtColor(base_for_match, cv.COLOR_BGR2GRAY)
-        k1, d1 = sift.detectAndCompute(base_gray, None)
-        if d1 is None or len(k1) == 0:
-            write_log(
-                "[ERROR] Could not compute SIFT features "
-                "from overview image."
-            )
+        # 2-3. マッチング用にダウンサンプリングしたbase画像（グレースケール）からSIFT特徴量を計算
+        # （特徴量キャッシュがあれば再利用）。キーポイントは座標配列 p1 として1回だけ変換しておく
+        # 1枚だけの処理なので OpenCV に全コアを使わせる
+        apply_stage_threads(thread_plan['single_cv_threads'])
+        try:
+            p1, d1, scale1 = detect_and_compute(base, OVERVIEW, DOWNSAMPLE_SCALE)
+            if d1 is None or len(p1) == 0:
+                write_log(
+                    "[ERROR] Could not compute SIFT features "
+                    "from overview image."
+                )
+                sys.exit(1)
+            write_log(f"[INFO] Computed {len(p1)} SIFT features from overview image (scale={scale1:.2f})")
+        except cv.error as e:
+            write_log(f"[ERROR] Failed to compute SIFT on base image: {e}")
             sys.exit(1)
-        write_log(f"[INFO] Computed {len(k1)} SIFT features from overview image (scale={scale1:.2f})")
-    except cv.error as e:
-        write_log(f"[ERROR] Failed to compute SIFT on base image: {e}")
-        sys.exit(1)
-
-    # 4. スケーリング行列の準備 (base座標系 -> canvas座標系)
-    Hscale = np.array([
-        [CANVAS_SCALE, 0, 0],
-        [0, CANVAS_SCALE, 0],
-        [0, 0, 1]
-    ], dtype=np.float32)
-
-    # 5. カウンター変数初期化
-    success_count = 0
-    skip_count = 0
 
-    # [メイン処理] 合成ループ（並列処理版）
-    # ファイル名順 (sorted) でループ
-    sorted_paths = sorted(closeups_paths)
+        # 4. ベース画像のディスクリプタ d1 に対するマッチング用インデックスを1回だけ構築
+        #    (保存済みのインデックスがあれば読み込む。全ワーカーで共有し、検索のみ行う)
+        try:
+            with span('build_index'):
+                overview_index = build_overview_index(
+                    d1, use_flann=USE_FLANN, trees=FLANN_TREES, checks=FLANN_CHECKS,
+                    cache_dir=FEATURE_CACHE_DIR if PERSIST_FLANN_INDEX else None,
+                    cache_max_bytes=FEATURE_CACHE_MAX_BYTES
+                )
+        except cv.error as e:
+            write_log(f"[ERROR] Failed to build matcher index for overview image: {e}")
+            sys.exit(1)
+        if overview_index['kind'] == 'flann':
+            source = "loaded" if overview_index['loaded'] else "built"
+            write_log(f"[INFO] FLANN index {source} for {len(d1)} overview descriptors")
+
+        # オーバービュー特徴点の空間インデックス（位置の事前情報による領域限定マッチング用）
+        overview_index['grid'] = build_spatial_grid(p1, SPATIAL_GRID_CELL_SIZE)
+
+        # 4b. 2段階推定用の低解像度オーバービュー特徴量
+        coarse = None
+        if USE_COARSE_TO_FINE:
+            try:
+                coarse = prepare_coarse_overview(base)
+            except cv.error as e:
+                write_log(f"[WARNING] Failed to prepare coarse overview features: {e}")
+            if coarse is None:
+                write_log("[WARNING] Coarse-to-fine disabled: not enough coarse overview features")
+            else:
+                write_log(
+                    f"[INFO] Coarse-to-fine enabled: {len(coarse['points'])} coarse overview "
+                    f"features (scale={coarse['scale']:.3f})"
+                )
+
+        # 5. スケーリング行列の準備 (base座標系 -> canvas座標系)
+        Hscale = np.array([
+            [CANVAS_SCALE, 0, 0],
+            [0, CANVAS_SCALE, 0],
+            [0, 0, 1]
+        ], dtype=np.float32)
+
+        # 6. カウンター変数初期化
+        success_count = 0
+        skip_count = 0
+
+        # [メイン処理] 合成ループ（並列処理版）
+        # ファイル名順 (sorted) でループ
+        sorted_paths = sorted(closeups_paths)
+
+        # 差分合成: 前回のマニフェストと出力があれば、変更部分のタイルだけを合成し直す
+        incremental = None
+        if INCREMENTAL_RENDER and not WATCH_MODE:
+            closeup_hashes = {path: file_content_hash(path) for path in sorted_paths}
+            manifest_settings = make_manifest_settings(canvas.shape)
+            incremental = render_incremental(
+                canvas, sorted_paths, closeup_hashes, manifest_settings,
+                p1, overview_index, scale1, Hscale, coarse
+            )
 
-    if USE_PARALLEL:
-        # 並列処理版
-        write_log(f"[INFO] Using parallel processing with {MAX_WORKERS or multiprocessing.cpu_count()} workers")
+        if incremental is not None:
+            success_count, skip_count = incremental
+        elif WATCH_MODE:
+            # 監視モード（起動時にあるファイルも、後から追加されたファイルも到着順に合成）
+            success_count, skip_count = watch_and_stitch(
+                canvas, p1, overview_index, scale1, Hscale, coarse
+            )
+        elif USE_PARALLEL and PARALLEL_BACKEND == "pipeline":
+            # 並列処理版（段階別パイプライン）
+            success_count, skip_count = stitch_with_pipeline(
+                canvas, sorted_paths, p1, overview_index, scale1, Hscale, coarse
+            )
+        elif USE_PARALLEL and PARALLEL_BACKEND == "process":
+            # 並列処理版（プロセスプール）
+            success_count, skip_count = stitch_with_process_pool(
+                canvas, sorted_paths, p1, d1, scale1, Hscale, coarse
+            )
+        elif USE_PARALLEL:
+            # 並列処理版
+            write_log(
+                f"[INFO] Using parallel processing with {thread_plan['workers']} workers "
+                f"({thread_plan['cv_threads']} OpenCV threads each)"
+            )
+            apply_stage_threads(thread_plan['cv_threads'])
+
+            # タイル合成は COMPOSITE_BATCH_SIZE 枚分のワープ結果を保持するため、memmap では完了順に1枚ずつ合成する
+            use_tiled_compositing = USE_TILED_COMPOSITING and CANVAS_BACKEND != "memmap"
+
+            with ThreadPoolExecutor(max_workers=thread_plan['workers']) as executor:
+                # すべてのタスクを投入
+                future_to_path = {
+                    executor.submit(process_single_closeup, path, p1, overview_index, scale1, Hscale, coarse): path
+                    for path in sorted_paths
+                }
+
+                # タイル合成用: 推定に成功したクローズアップ (ファイル名 -> H_to_canvas)。
+                # 画像は保持せず、合成時にバッチごとに読み直す（全クローズアップを同時にメモリに置かない）
+                accepted = {}
+
+                # 完了したものから順次処理
+                for future in as_completed(future_to_path):
+                    try:
+                        filename, status, H_to_canvas, img, error_msg = future.result()
+
+                        if status == 'skip':
+                            write_log(f"[skip] {filename} : {error_msg}")
+                            record_closeup(future_to_path[future], error_msg=error_msg)
+                            skip_count += 1
+                        elif use_tiled_compositing:
+                            # 合成はすべての推定が終わってからファイル名順に行う
+                            accepted[filename] = H_to_canvas
+                        else:
+                            # 合成処理（メインスレッドで実行：canvasへの書き込みは非スレッドセーフ）
+                            write_log(f"[INFO] Processing: {filename}")
+                            warp_and_blend(canvas, img, H_to_canvas, strength=STRENGTH, closeup=filename)
+                            write_log(f"[blend] {filename}")
+                            record_closeup(future_to_path[future], H_to_canvas, img.shape)
+                            success_count += 1
+
+                    except Exception as e:
+                        path = future_to_path[future]
+                        filename = os.path.basename(path)
+                        write_log(f"[skip] {filename} : Exception in processing: {e}")
+                        record_closeup(path, error_msg=f"Exception in processing: {e}")
+                        skip_count += 1
 
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            # すべてのタスクを投入
-            future_to_path = {
-                executor.submit(process_single_closeup, path, k1, d1, scale1, Hscale): path
-                for path in sorted_paths
-            }
+            if accepted:
+                # タイル分割による並列合成（タイル内はファイル名順でブレンド）
+                path_by_name = {os.path.basename(path): path for path in sorted_paths}
+                order = [
+                    os.path.basename(path) for path in sorted_paths
+                    if os.path.basename(path) in accepted
+                ]
+                write_log(
+                    f"[INFO] Compositing {len(order)} closeups with "
+                    f"{COMPOSITE_TILE_SIZE}px tiles ({COMPOSITE_BATCH_SIZE} closeups per batch)"
+                )
+                apply_stage_threads(thread_plan['composite_cv_threads'])
+                # ファイル名順のバッチを順に合成するので、タイル内のブレンド順は全体でもファイル名順になる
+                for start in range(0, len(order), max(1, COMPOSITE_BATCH_SIZE)):
+                    batch = order[start:start + max(1, COMPOSITE_BATCH_SIZE)]
+                    with ThreadPoolExecutor(max_workers=thread_plan['composite_workers']) as executor:
+                        images = list(executor.map(cv.imread, [path_by_name[filename] for filename in batch]))
+                    readable = [(filename, img) for filename, img in zip(batch, images) if img is not None]
+                    # タイルごとのワープ・ブレンドはクローズアップ単位に分けられないので、まとめて1区間として記録する
+                    with span('composite'):
+                        errors = composite_tiled(
+                            canvas, [(img, accepted[filename]) for filename, img in readable], STRENGTH,
+                            tile_size=COMPOSITE_TILE_SIZE, max_workers=thread_plan['composite_workers']
+                        )
+                    errors = dict(zip((filename for filename, _ in readable), errors))
+                    shapes = {filename: img.shape for filename, img in readable}
+                    del images, readable
+
+                    for filename in batch:
+                        error_msg = errors.get(filename, "Cannot read image")
+                        if error_msg is None:
+                            write_log(f"[blend] {filename}")
+                            record_closeup(path_by_name[filename], accepted[filename], shapes[filename])
+                            success_count += 1
+                        else:
+                            write_log(f"[skip] {filename} : {error_msg}")
+                            record_closeup(path_by_name[filename], error_msg=error_msg)
+                            skip_count += 1
+        else:
+            # 順次処理版（従来の方法）
+            write_log(f"[INFO] Using sequential processing")
+            apply_stage_threads(thread_plan['cv_threads'])
 
-            # 完了したものから順次処理
-            for future in as_completed(future_to_path):
-                try:
-                    filename, status, H_to_canvas, img, error_msg = future.result()
+            # 直前に合成できたクローズアップの位置（USE_NEIGHBOR_PRIOR 用の事前情報）
+            prior_region = None
 
-                    if status == 'skip':
-                        write_log(f"[skip] {filename} : {error_msg}")
-                        skip_count += 1
-                    else:
-                        # 合成処理（メインスレッドで実行：canvasへの書き込みは非スレッドセーフ）
-                        write_log(f"[INFO] Processing: {filename}")
-                        warp_and_blend(canvas, img, H_to_canvas, strength=STRENGTH)
-                        write_log(f"[blend] {filename}")
-                        success_count += 1
+            for path in sorted_paths:
+                filename, status, H_to_canvas, img, error_msg = process_single_closeup(
+                    path, p1, overview_index, scale1, Hscale, coarse, prior_region
+                )
 
-                except Exception as e:
-                    path = future_to_path[future]
-                    filename = os.path.basename(path)
-                    write_log(f"[skip] {filename} : Exception in processing: {e}")
+                if status == 'skip':
+                    write_log(f"[skip] {filename} : {error_msg}")
+                    record_closeup(path, error_msg=error_msg)
                     skip_count += 1
-    else:
-        # 順次処理版（従来の方法）
-        write_log(f"[INFO] Using sequential processing")
-
-        for path in sorted_paths:
-            filename, status, H_to_canvas, img, error_msg = process_single_closeup(
-                path, k1, d1, scale1, Hscale
+                else:
+                    if USE_NEIGHBOR_PRIOR:
+                        # ファイル名順で隣のクローズアップは近くに写っていることが多い
+                        h_img, w_img = img.shape[:2]
+                        corners = np.float32([[0, 0], [w_img, 0], [w_img, h_img], [0, h_img]]).reshape(-1, 1, 2)
+                        footprint = cv.perspectiveTransform(corners, H_to_canvas.astype(np.float64))
+                        prior_region = expand_bbox_polygon(
+                            footprint.reshape(-1, 2) / CANVAS_SCALE, NEIGHBOR_PRIOR_MARGIN
+                        )
+                    write_log(f"[INFO] Processing: {filename}")
+                    warp_and_blend(canvas, img, H_to_canvas, strength=STRENGTH, closeup=filename)
+                    write_log(f"[blend] {filename}")
+                    record_closeup(path, H_to_canvas, img.shape)
+                    success_count += 1
+
+        # [終了処理 1] 結果保存
+        try:
+            save_canvas(canvas, OUT)
+            write_log(f"Saved: {OUT}")
+        except cv.error as e:
+            write_log(f"[ERROR] Failed to save output image {OUT}: {e}")
+        except Exception as e:
+            write_log(f"[ERROR] Unexpected error saving {OUT}: {e}")
+    finally:
+        # memmap の canvas のファイルを削除（途中で sys.exit した場合も残さない）
+        release_canvas(canvas)
+
+    # [終了処理 1b] 次回の差分合成のためにマニフェストを保存
+    if INCREMENTAL_RENDER and not WATCH_MODE:
+        try:
+            save_manifest(
+                manifest_path(OUT), manifest_settings,
+                manifest_entries(sorted_paths, closeup_hashes, canvas_shape)
             )
-
-            if status == 'skip':
-                write_log(f"[skip] {filename} : {error_msg}")
-                skip_count += 1
-            else:
-                write_log(f"[INFO] Processing: {filename}")
-                warp_and_blend(canvas, img, H_to_canvas, strength=STRENGTH)
-                write_log(f"[blend] {filename}")
-                success_count += 1
-
-    # [終了処理 1] 結果保存
-    try:
-        cv.imwrite(OUT, canvas)
-        write_log(f"Saved: {OUT}")
-    except cv.error as e:
-        write_log(f"[ERROR] Failed to save output image {OUT}: {e}")
-    except Exception as e:
-        write_log(f"[ERROR] Unexpected error saving {OUT}: {e}")
+            write_log(f"[INFO] Manifest saved: {manifest_path(OUT)}")
+        except (OSError, ValueError) as e:
+            write_log(f"[ERROR] Failed to save manifest: {e}")
+
+    # [終了処理 1c] 処理段階ごとの所要時間
+    timing_report = timing_recorder.report()
+    for line in format_timing_report(timing_report):
+        write_log(f"[TIMING] {line}")
+    if WRITE_TIMING_REPORT:
+        try:
+            save_timing_report(timing_report_path(OUT), timing_report)
+            write_log(f"[INFO] Timing report saved: {timing_report_path(OUT)}")
+        except OSError as e:
+            write_log(f"[ERROR] Failed to save timing report: {e}")
 
     # [終了処理 2] ログ集計
     write_log(
@@ -511,4 +1527,6 @@ def main():
 
 
 if __name__ == "__main__":
+    if "--watch" in sys.argv[1:]:
+        WATCH_MODE = True
     main()
@@ -0,0 +1,131 @@
+"""
+合成結果のマニフェスト（前回の実行内容の記録）。
+
+出力画像の隣に JSON で保存し、次回の実行で変更・追加・削除されたクローズアップを検出して、
+その範囲のタイルだけを合成し直すために使う（src/main.py の INCREMENTAL_RENDER）。
+
+記録する内容:
+    settings: 合成結果に影響する設定（オーバービューの内容ハッシュ、canvas の倍率・大きさ、
+        ブレンディング強度、SIFT・マッチングのパラメータなど）。一致しない場合は全体を合成し直す
+    closeups: クローズアップのパス -> 内容ハッシュ、推定結果 (status)、canvas へのホモグラフィ (H)、
+        画像サイズ (size)、canvas 上の書き込み範囲 (roi)、スキップ理由 (error)
+"""
+
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(out_path):
+    """
+    出力画像のパスからマニフェストのパスを決める（例: stitched.png -> stitched.manifest.json）。
+    """
+    root, _ = os.path.splitext(out_path)
+    return f"{root}.manifest.json"
+
+
+def load_manifest(path):
+    """
+    マニフェストを読み込む。存在しない・壊れている・形式が違う場合は None。
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return None
+    if not isinstance(manifest.get("closeups"), dict):
+        return None
+    return manifest
+
+
+def save_manifest(path, settings, closeups):
+    """
+    マニフェストを一時ファイルに書き出してから置き換える。
+    """
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "settings": settings,
+        "closeups": closeups,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def settings_match(manifest, settings):
+    """
+    マニフェストの settings が現在の設定と一致するか（JSON に変換した形で比較する）。
+    """
+    return manifest.get("settings") == json.loads(json.dumps(settings))
+
+
+def make_entry(content_hash, status, H=None, size=None, roi=None, error=None):
+    """
+    クローズアップ1枚分のマニフェストの項目を作る（JSON に書ける型に変換する）。
+
+    Args:
+        content_hash: 画像ファイルの内容ハッシュ
+        status: 'success' または 'skip'
+        H: canvas へのホモグラフィ (3x3)
+        size: 画像サイズ (width, height)
+        roi: canvas 上の書き込み範囲 (x0, y0, x1, y1)
+        error: スキップ理由
+    """
+    return {
+        "hash": content_hash,
+        "status": status,
+        "H": [[float(v) for v in row] for row in H] if H is not None else None,
+        "size": [int(v) for v in size] if size is not None else None,
+        "roi": [int(v) for v in roi] if roi is not None else None,
+        "error": error,
+    }
+
+
+def diff_closeups(previous, current_hashes):
+    """
+    前回のマニフェストと現在のクローズアップを比べる。
+
+    Args:
+        previous: 前回のマニフェストの closeups
+        current_hashes: 現在のクローズアップのパス -> 内容ハッシュ
+
+    Returns:
+        (unchanged, changed, removed)。changed には追加されたものも含む
+    """
+    unchanged = []
+    changed = []
+    for path, content_hash in current_hashes.items():
+        entry = previous.get(path)
+        if entry is not None and entry.get("hash") == content_hash:
+            unchanged.append(path)
+        else:
+            changed.append(path)
+    removed = [path for path in previous if path not in current_hashes]
+    return unchanged, changed, removed
+
+
+def dirty_rects(previous, current, changed, removed):
+    """
+    合成し直す必要がある canvas 上の範囲を返す。
+
+    変更・追加されたクローズアップは前回と今回の両方の書き込み範囲、
+    削除されたクローズアップは前回の書き込み範囲が対象になる。
+
+    Returns:
+        (x0, y0, x1, y1) のリスト
+    """
+    rects = []
+    for path in changed:
+        for entry in (previous.get(path), current.get(path)):
+            if entry is not None and entry.get("status") == "success" and entry.get("roi"):
+                rects.append(tuple(entry["roi"]))
+    for path in removed:
+        entry = previous[path]
+        if entry.get("status") == "success" and entry.get("roi"):
+            rects.append(tuple(entry["roi"]))
+    return rects
@@ -0,0 +1,292 @@
+"""
+ベース画像（オーバービュー）側の特徴量マッチング処理。
+
+オーバービューのディスクリプタ d1 に対する FLANN KD-tree インデックスを1回だけ構築し、
+各クローズアップのディスクリプタをクエリとして k 近傍探索する。
+構築済みインデックスはディスクに保存でき、同じオーバービューでの再実行時は読み込むだけで済む。
+
+構築後のインデックスは検索のみ（読み取り専用）なので、複数スレッドから同時に検索できる。
+"""
+
+import hashlib
+import os
+
+import cv2 as cv
+import numpy as np
+
+from feature_cache import record_cache_file
+
+FLANN_INDEX_KDTREE = 1
+
+
+def overview_index_path(cache_dir, descriptors, trees):
+    """
+    オーバービューのディスクリプタとインデックスパラメータから保存先のパスを決める。
+    """
+    digest = hashlib.sha256()
+    digest.update(cv.__version__.encode("utf-8"))
+    digest.update(f"kdtree:{trees}:{descriptors.shape}".encode("utf-8"))
+    digest.update(np.ascontiguousarray(descriptors).tobytes())
+    return os.path.join(cache_dir, f"{digest.hexdigest()}.flann")
+
+
+def build_overview_index(descriptors, use_flann=True, trees=5, checks=50, cache_dir=None,
+                         cache_max_bytes=None):
+    """
+    オーバービューのディスクリプタに対するマッチング用インデックスを作る。
+
+    Args:
+        descriptors: オーバービューのディスクリプタ (N, 128) float32
+        use_flann: True で FLANN KD-tree、False で総当たり (BFMatcher)
+        trees: KD-tree の本数
+        checks: 探索時にたどる葉の数（高いほど精度向上、低いほど高速）
+        cache_dir: 構築済みインデックスの保存先（None で保存しない）
+        cache_max_bytes: cache_dir 全体の容量上限（特徴量キャッシュと共通、None で無制限）
+
+    Returns:
+        インデックス情報の辞書 (kind, index, descriptors, checks, loaded)
+    """
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.float32)
+    overview_index = {
+        'kind': 'bf',
+        'index': None,
+        'descriptors': descriptors,
+        'checks': checks,
+        'loaded': False,
+    }
+
+    if not use_flann:
+        return overview_index
+
+    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=trees)
+    index_path = None
+    if cache_dir is not None:
+        index_path = overview_index_path(cache_dir, descriptors, trees)
+
+    index = None
+    if index_path is not None and os.path.exists(index_path):
+        # 保存済みインデックスを読み込む（失敗した場合は作り直す）
+        index = cv.flann_Index()
+        if index.load(descriptors, index_path):
+            overview_index['loaded'] = True
+            try:
+                os.utime(index_path, None)  # 特徴量キャッシュと同じく LRU 用に最終アクセス時刻を更新
+            except OSError:
+                pass
+        else:
+            index = None
+
+    if index is None:
+        index = cv.flann_Index(descriptors, index_params)
+        if index_path is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f"{index_path}.{os.getpid()}.tmp"
+                index.save(tmp_path)
+                os.replace(tmp_path, index_path)
+                record_cache_file(cache_dir, index_path, cache_max_bytes)
+            except (OSError, cv.error):
+                # 保存できなくても構築済みのインデックスはそのまま使える
+                pass
+
+    overview_index['kind'] = 'flann'
+    overview_index['index'] = index
+    return overview_index
+
+
+def query_overview_index(overview_index, query_descriptors, k=2):
+    """
+    クエリ（クローズアップ）の各ディスクリプタについて、オーバービュー側の k 近傍を探す。
+
+    Returns:
+        (indices, distances)
+        indices: (M, k) int32 オーバービュー側のディスクリプタ番号（見つからない場合 -1）
+        distances: (M, k) float32 L2 距離
+    """
+    query_descriptors = np.ascontiguousarray(query_descriptors, dtype=np.float32)
+    descriptors = overview_index['descriptors']
+
+    if len(query_descriptors) == 0 or len(descriptors) < k:
+        return (
+            np.empty((0, k), dtype=np.int32),
+            np.empty((0, k), dtype=np.float32),
+        )
+
+    if overview_index['kind'] == 'flann':
+        indices, distances = overview_index['index'].knnSearch(
+            query_descriptors, k, params=dict(checks=overview_index['checks'])
+        )
+        # KD-tree の距離は二乗 L2 なので、BFMatcher と同じ L2 距離に揃える
+        return indices.astype(np.int32), np.sqrt(distances)
+
+    # 総当たり (BFMatcher.knnMatch と同じ結果を DMatch を作らずに配列で得る)
+    distances, indices = cv.batchDistance(
+        query_descriptors, descriptors, cv.CV_32F, normType=cv.NORM_L2, K=k
+    )
+    return indices.astype(np.int32, copy=False), distances
+
+
+def keypoints_to_points(keypoints):
+    """
+    cv.KeyPoint のリストを (N, 2) float32 の座標配列に変換する。
+    """
+    if len(keypoints) == 0:
+        return np.empty((0, 2), dtype=np.float32)
+    return cv.KeyPoint_convert(keypoints).reshape(-1, 2).astype(np.float32, copy=False)
+
+
+def ratio_test(indices, distances, ratio):
+    """
+    Lowe's ratio test を配列演算で行う。
+
+    Args:
+        indices: query_overview_index の戻り値 (M, 2)
+        distances: query_overview_index の戻り値 (M, 2)
+        ratio: 1位と2位の距離比の閾値
+
+    Returns:
+        (overview_idx, query_idx) 条件を満たしたマッチのオーバービュー側・クエリ側の番号配列
+    """
+    good = (
+        (indices[:, 0] >= 0)
+        & (indices[:, 1] >= 0)
+        & (distances[:, 0] < ratio * distances[:, 1])
+    )
+    query_idx = np.flatnonzero(good)
+    return indices[query_idx, 0], query_idx
+
+
+def build_spatial_grid(points, cell_size=64.0):
+    """
+    キーポイント座標に対する一様格子の空間インデックスを作る。
+
+    点を格子セル番号（行優先）でソートし、各セルの開始位置を持つ (CSR 形式)。
+    同じ行の連続したセルはソート後も連続するので、矩形検索は行ごとに1スライスで済む。
+
+    Args:
+        points: キーポイント座標 (N, 2)
+        cell_size: セルの一辺（points と同じ座標系）
+
+    Returns:
+        空間インデックスの辞書
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    if len(points) == 0:
+        origin = np.zeros(2, dtype=np.float32)
+        n_cols = n_rows = 1
+    else:
+        origin = points.min(axis=0)
+        extent = points.max(axis=0) - origin
+        n_cols = int(extent[0] // cell_size) + 1
+        n_rows = int(extent[1] // cell_size) + 1
+
+    cols = ((points[:, 0] - origin[0]) // cell_size).astype(np.int64)
+    rows = ((points[:, 1] - origin[1]) // cell_size).astype(np.int64)
+    cell_ids = rows * n_cols + cols
+
+    order = np.argsort(cell_ids, kind='stable')
+    starts = np.searchsorted(cell_ids[order], np.arange(n_rows * n_cols + 1))
+
+    return {
+        'points': points,
+        'cell_size': float(cell_size),
+        'origin': origin,
+        'n_cols': n_cols,
+        'n_rows': n_rows,
+        'order': order,
+        'starts': starts,
+    }
+
+
+def grid_query_bbox(grid, x0, y0, x1, y1):
+    """
+    矩形 [x0, x1] x [y0, y1] 内のキーポイント番号を昇順で返す。
+    """
+    cell_size = grid['cell_size']
+    origin = grid['origin']
+    c0 = max(int((x0 - origin[0]) // cell_size), 0)
+    c1 = min(int((x1 - origin[0]) // cell_size), grid['n_cols'] - 1)
+    r0 = max(int((y0 - origin[1]) // cell_size), 0)
+    r1 = min(int((y1 - origin[1]) // cell_size), grid['n_rows'] - 1)
+    if c0 > c1 or r0 > r1:
+        return np.empty(0, dtype=np.int64)
+
+    # 各行の c0..c1 セルはソート済み配列上で連続している
+    order, starts, n_cols = grid['order'], grid['starts'], grid['n_cols']
+    candidates = np.concatenate([
+        order[starts[r * n_cols + c0]:starts[r * n_cols + c1 + 1]]
+        for r in range(r0, r1 + 1)
+    ])
+
+    # 境界セルには矩形外の点も含まれるので座標で絞り込む
+    pts = grid['points'][candidates]
+    inside = (
+        (pts[:, 0] >= x0) & (pts[:, 0] <= x1)
+        & (pts[:, 1] >= y0) & (pts[:, 1] <= y1)
+    )
+    return np.sort(candidates[inside])
+
+
+def points_in_polygon(points, polygon):
+    """
+    各点が多角形の内側にあるかを判定する（交差数判定、配列演算）。
+
+    Returns:
+        (N,) bool 配列
+    """
+    x = points[:, 0:1]
+    y = points[:, 1:2]
+    xi, yi = polygon[:, 0], polygon[:, 1]
+    xj, yj = np.roll(xi, 1), np.roll(yi, 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crosses = ((yi > y) != (yj > y)) & (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+    return np.count_nonzero(crosses, axis=1) % 2 == 1
+
+
+def grid_query_polygon(grid, polygon):
+    """
+    多角形内のキーポイント番号を昇順で返す（外接矩形で候補を絞ってから内外判定）。
+    """
+    polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    x0, y0 = polygon.min(axis=0)
+    x1, y1 = polygon.max(axis=0)
+    candidates = grid_query_bbox(grid, x0, y0, x1, y1)
+    if len(candidates) == 0:
+        return candidates
+    return candidates[points_in_polygon(grid['points'][candidates], polygon)]
+
+
+def expand_bbox_polygon(polygon, margin_ratio):
+    """
+    多角形の外接矩形を、長辺に対する margin_ratio だけ四方に広げた矩形（4頂点）を返す。
+    """
+    polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    x0, y0 = polygon.min(axis=0)
+    x1, y1 = polygon.max(axis=0)
+    margin = margin_ratio * max(x1 - x0, y1 - y0)
+    x0, y0, x1, y1 = x0 - margin, y0 - margin, x1 + margin, y1 + margin
+    return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+
+
+def restrict_to_region(overview_index, points, region, scale=1.0):
+    """
+    オーバービューの特徴量を、指定領域内のものだけに絞ったマッチング用インデックスを作る。
+
+    Args:
+        overview_index: build_overview_index の戻り値（'grid' に build_spatial_grid の結果を持つ）
+        points: オーバービューのキーポイント座標 (N, 2)（grid と同じ座標系）
+        region: 領域の多角形 (K, 2)（オーバービュー元解像度の座標系）
+        scale: points の座標系の倍率（元解像度 -> points の座標系）
+
+    Returns:
+        (points_subset, region_index)。空間インデックスがない場合は None
+    """
+    grid = overview_index.get('grid')
+    if grid is None:
+        return None
+
+    selected = grid_query_polygon(grid, np.asarray(region, dtype=np.float64) * scale)
+    # 領域内の特徴点は少数なので総当たりで厳密にマッチングする
+    region_index = build_overview_index(overview_index['descriptors'][selected], use_flann=False)
+    return points[selected], region_index
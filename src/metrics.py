@@ -0,0 +1,219 @@
+"""
+Web API の稼働状況のメトリクス（Prometheus のテキスト形式で出力する）。
+
+prometheus_client などの外部パッケージやサービスは使わず、カウンタ・ゲージ・ヒストグラムを
+このモジュールだけで持つ。src/api.py の /metrics がこの出力を返すので、Prometheus や
+テスト用の簡易スクレイパーから HTTP で取得できる。
+
+    registry = MetricsRegistry()
+    jobs = registry.counter('stitch_jobs_finished_total', 'Finished jobs', ['status'])
+    jobs.inc(status='completed')
+    text = registry.render()
+
+ラベルはメトリクスの作成時に名前を決めておき、inc / set / observe のキーワード引数で値を渡す
+（ラベルの値の種類が増え続けないよう、ファイル名やエラーメッセージはそのまま使わないこと）。
+"""
+
+import math
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 処理時間のヒストグラムの既定の区切り（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    """
+    メトリクスの共通部分（名前・説明・ラベル名と、ラベルの値ごとの値）。
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # ラベルの値のタプル -> 値
+        if not self.labelnames:
+            self._values[()] = self._initial()
+
+    def _initial(self):
+        return 0.0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name}: expected labels {list(self.labelnames)}, got {sorted(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """
+        (サンプル名の接尾辞, 追加のラベル, ラベルの値, 値) のリスト。
+        """
+        with self._lock:
+            return [('', (), key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {_escape_help(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, extra, key, value in self._samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(_Metric):
+    """
+    増えるだけの値（件数・バイト数など）。名前は慣例どおり _total で終える。
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError(f"{self.name}: counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """
+    増減する現在値（待ち行列の長さ・使用中のメモリなど）。
+    set_function で関数を登録すると、出力のたびにその戻り値を使う（ラベルなしのみ）。
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        if self.labelnames:
+            raise ValueError(f"{self.name}: set_function is only supported without labels")
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            return [('', (), (), float(self._function()))]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    """
+    観測値の分布（処理時間など）。区切りごとの累積件数・合計・件数を出力する。
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _initial(self):
+        # 区切りごとの件数（累積ではない）、最後は +Inf の分。合計、件数
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = self._initial()
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', (('le', _format_value(bound)),), key, cumulative))
+                samples.append(('_sum', (), key, total))
+                samples.append(('_count', (), key, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    メトリクスの登録先。render() で登録順に Prometheus のテキスト形式にする。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,173 @@
+"""
+段階 (stage) ごとのスレッドを有界キューでつないだ処理パイプライン。
+
+各入力は「ジョブ」（辞書）として段階を順に流れ、最後に呼び出し元のスレッドで
+入力と同じ順序で sink に渡される。同時に処理中のジョブ数は window で制限する
+（先頭のジョブが sink に渡されるまで新しい入力を投入しない）ので、
+メモリ使用量は入力の総数ではなく window x ジョブ1つの大きさで抑えられる。
+キューも有界なので、後段が遅い場合は前段が待たされる（バックプレッシャー）。
+
+段階の関数はジョブの辞書を書き換える。job['skip'] に理由を設定すると、
+以降の段階はそのジョブを処理せずに sink まで素通しする。
+"""
+
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+def _new_stage_stats(workers):
+    return {
+        'workers': workers,
+        'items': 0,
+        'busy_seconds': 0.0,
+        'first_start': None,
+        'last_end': None,
+        'max_queue_depth': 0,
+    }
+
+
+def _record(stats, lock, started, ended):
+    with lock:
+        stats['items'] += 1
+        stats['busy_seconds'] += ended - started
+        if stats['first_start'] is None or started < stats['first_start']:
+            stats['first_start'] = started
+        if stats['last_end'] is None or ended > stats['last_end']:
+            stats['last_end'] = ended
+
+
+def _finish_stats(stats):
+    """
+    段階ごとの統計に経過時間とスループット (items/s) を加える。
+    """
+    for stage_stats in stats.values():
+        first, last = stage_stats.pop('first_start'), stage_stats.pop('last_end')
+        wall = (last - first) if first is not None else 0.0
+        stage_stats['wall_seconds'] = wall
+        stage_stats['items_per_second'] = stage_stats['items'] / wall if wall > 0 else 0.0
+    return stats
+
+
+def run_pipeline(inputs, stages, sink, sink_name="sink", window=8, queue_size=4):
+    """
+    inputs を stages の順に処理し、入力順に sink へ渡す。
+
+    Args:
+        inputs: 入力のリスト（各ジョブの job['input'] になる）
+        stages: (名前, 関数, スレッド数) のリスト。関数はジョブの辞書を受け取って書き換える
+        sink: sink(index, job)。呼び出し元のスレッドで入力順に呼ばれる
+        sink_name: 統計での sink の名前
+        window: 同時に処理中にできるジョブ数の上限
+        queue_size: 段階間のキューの長さの上限
+
+    Returns:
+        段階名 -> 統計 (workers, items, busy_seconds, wall_seconds, items_per_second,
+        max_queue_depth) の辞書
+    """
+    inputs = list(inputs)
+    lock = threading.Lock()
+    abort = threading.Event()
+    window_slots = threading.Semaphore(window)
+
+    # 段階 i は queues[i] から取り出して queues[i + 1] に入れる。最後のキューは sink 用
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    queues.append(queue.Queue())
+    remaining = [workers for _, _, workers in stages]
+    stats = {name: _new_stage_stats(workers) for name, _, workers in stages}
+    stats[sink_name] = _new_stage_stats(1)
+
+    def put(stage_index, entry):
+        q = queues[stage_index]
+        q.put(entry)
+        name = stages[stage_index][0] if stage_index < len(stages) else sink_name
+        with lock:
+            stats[name]['max_queue_depth'] = max(stats[name]['max_queue_depth'], q.qsize())
+
+    def feeder():
+        first_workers = stages[0][2] if stages else 1
+        for index, value in enumerate(inputs):
+            window_slots.acquire()
+            if abort.is_set():
+                break
+            put(0, (index, {'input': value}))
+        for _ in range(first_workers):
+            put(0, _STOP)
+
+    def worker(stage_index):
+        name, func, _ = stages[stage_index]
+        while True:
+            entry = queues[stage_index].get()
+            if entry is _STOP:
+                break
+            index, job = entry
+            if 'skip' not in job and not abort.is_set():
+                started = time.perf_counter()
+                try:
+                    func(job)
+                except Exception as e:
+                    job['skip'] = f"Error in {name}: {e}"
+                _record(stats[name], lock, started, time.perf_counter())
+            put(stage_index + 1, entry)
+
+        # 段階の最後のスレッドが終了したら次の段階に終了を伝える
+        with lock:
+            remaining[stage_index] -= 1
+            last = remaining[stage_index] == 0
+        if last:
+            next_workers = stages[stage_index + 1][2] if stage_index + 1 < len(stages) else 1
+            for _ in range(next_workers):
+                put(stage_index + 1, _STOP)
+
+    threads = [threading.Thread(target=feeder, daemon=True)]
+    for stage_index, (_, _, workers) in enumerate(stages):
+        threads.extend(
+            threading.Thread(target=worker, args=(stage_index,), daemon=True)
+            for _ in range(workers)
+        )
+    for thread in threads:
+        thread.start()
+
+    # sink: 入力順に並べ直して呼び出す（並べ直し待ちのジョブも window 内に収まる）
+    pending = {}
+    next_index = 0
+    try:
+        while next_index < len(inputs):
+            entry = queues[-1].get()
+            if entry is _STOP:
+                continue
+            index, job = entry
+            pending[index] = job
+            while next_index in pending:
+                job = pending.pop(next_index)
+                started = time.perf_counter()
+                try:
+                    sink(next_index, job)
+                finally:
+                    _record(stats[sink_name], lock, started, time.perf_counter())
+                    window_slots.release()
+                next_index += 1
+    except BaseException:
+        # 残りのジョブは処理せずに流し、スレッドを終了させる
+        abort.set()
+        window_slots.release()
+        raise
+
+    for thread in threads:
+        thread.join()
+
+    return _finish_stats(stats)
+
+
+def format_stage_stats(stats):
+    """
+    段階ごとの統計をログ用の行のリストにする。
+    """
+    return [
+        f"{name}: {s['items']} items, {s['items_per_second']:.2f} items/s, "
+        f"busy {s['busy_seconds']:.2f}s ({s['workers']} workers), "
+        f"max queue {s['max_queue_depth']}"
+        for name, s in stats.items()
+    ]
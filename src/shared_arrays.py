@@ -0,0 +1,70 @@
+"""
+NumPy 配列をプロセス間で共有するための multiprocessing.shared_memory の薄いラッパー。
+
+プロセスプールのワーカーにオーバービューの特徴量（座標・ディスクリプタ）を渡す際に使う。
+ワーカーは共有メモリを名前で開いてコピーせずに参照するので、pickle による転送は発生しない。
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def share_arrays(arrays):
+    """
+    配列を共有メモリにコピーする。
+
+    Args:
+        arrays: 名前 -> np.ndarray の辞書
+
+    Returns:
+        (handles, spec)
+        handles: SharedMemory のリスト（release_shared_arrays で解放する）
+        spec: 名前 -> (共有メモリ名, shape, dtype) の辞書（ワーカーに渡す。pickle 可能）
+    """
+    handles = []
+    spec = {}
+    try:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            # サイズ 0 の共有メモリは作れないので最低1バイト確保する
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            handles.append(shm)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            spec[name] = (shm.name, array.shape, array.dtype.str)
+    except Exception:
+        release_shared_arrays(handles)
+        raise
+    return handles, spec
+
+
+def attach_shared_arrays(spec):
+    """
+    share_arrays の spec から共有メモリを開き、配列として参照する（コピーしない）。
+
+    Returns:
+        (handles, arrays)。handles は配列を使い終わるまで保持すること
+    """
+    handles = []
+    arrays = {}
+    for name, (shm_name, shape, dtype) in spec.items():
+        try:
+            # 削除は作成側が行うので、ワーカー側では resource_tracker に登録しない (Python 3.13+)
+            shm = shared_memory.SharedMemory(name=shm_name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=shm_name)
+        handles.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return handles, arrays
+
+
+def release_shared_arrays(handles):
+    """
+    share_arrays で作った共有メモリを閉じて削除する（作成したプロセスで呼ぶ）。
+    """
+    for shm in handles:
+        try:
+            shm.close()
+            shm.unlink()
+        except (BufferError, FileNotFoundError):
+            pass
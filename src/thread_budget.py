@@ -0,0 +1,139 @@
+"""
+CPU コアを「クローズアップ単位の並列ワーカー数」と「OpenCV 内部のスレッド数」に配分する。
+
+cv.setNumThreads はプロセス全体の設定なので、処理段階（特徴量計算・推定、タイル合成など）の
+開始時にその段階の配分を設定する。ワーカー数 x OpenCV スレッド数がコア数を超えないようにして、
+スレッドの取り合い（オーバーサブスクリプション）を防ぐ。
+
+src/main.py と src/api.py から利用される。
+"""
+
+import multiprocessing
+
+import cv2 as cv
+
+THREAD_BUDGET_MODES = ("auto", "outer", "inner")
+
+# 1枚あたりの画素数がこれ以上なら OpenCV 内部の並列化が効きやすい（auto モード）
+LARGE_IMAGE_PIXELS = 24_000_000
+MEDIUM_IMAGE_PIXELS = 8_000_000
+
+
+def estimate_image_pixels(path):
+    """
+    画像の画素数を、1/8 縮小で読み込んだサイズから見積もる（全画素のデコードを避ける）。
+
+    Returns:
+        画素数。読み込めない場合は 0
+    """
+    if path is None:
+        return 0
+    img = cv.imread(path, cv.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        return 0
+    h, w = img.shape[:2]
+    return h * w * 64
+
+
+def plan_thread_budget(n_items, image_pixels, max_workers=None, mode="auto", cpus=None):
+    """
+    ワーカー数と OpenCV スレッド数の配分を決める。
+
+    Args:
+        n_items: クローズアップの枚数（0 は不明として扱う）
+        image_pixels: クローズアップ1枚あたりの画素数（estimate_image_pixels）
+        max_workers: ワーカー数の上限（None で自動）。指定した場合は残りのコアを OpenCV に回す
+        mode: "auto"（枚数と画像サイズから決める）/ "outer"（ワーカー数を最大化）/
+            "inner"（ワーカー1つで OpenCV に全コア）
+        cpus: 使えるコア数（None で multiprocessing.cpu_count()）
+
+    Returns:
+        配分の辞書
+        workers / cv_threads: 推定段階（クローズアップ単位の並列処理）
+        composite_workers / composite_cv_threads: タイル合成の段階
+        single_cv_threads: オーバービューなど1枚だけを処理する段階
+    """
+    if mode not in THREAD_BUDGET_MODES:
+        raise ValueError(f"Unknown thread budget mode: {mode} (expected one of {THREAD_BUDGET_MODES})")
+
+    cpus = cpus or multiprocessing.cpu_count()
+    n_items = n_items if n_items > 0 else cpus
+
+    if max_workers:
+        workers = max_workers
+    elif mode == "inner":
+        workers = 1
+    elif mode == "outer":
+        workers = cpus
+    else:
+        # 大きな画像ほど1枚あたりの OpenCV 並列化が効くので、内側にコアを多めに回す
+        if image_pixels >= LARGE_IMAGE_PIXELS:
+            inner = 4
+        elif image_pixels >= MEDIUM_IMAGE_PIXELS:
+            inner = 2
+        else:
+            inner = 1
+        workers = max(1, cpus // inner)
+
+    # 枚数より多いワーカーは使われないので、余ったコアは OpenCV に回す
+    workers = max(1, min(workers, n_items, cpus))
+    cv_threads = max(1, cpus // workers)
+
+    return {
+        'mode': mode,
+        'cpus': cpus,
+        'workers': workers,
+        'cv_threads': cv_threads,
+        # タイル合成はタイル数が多く1タイルの処理が小さいので、外側で全コアを使う
+        'composite_workers': cpus,
+        'composite_cv_threads': 1,
+        'single_cv_threads': cpus,
+    }
+
+
+def plan_pipeline_threads(plan, decode_workers, warp_workers):
+    """
+    段階別パイプラインの各段階のスレッド数を、plan のコアの配分の中で決める。
+
+    パイプラインでは読み込み・特徴量・マッチング・ワープの段階が同時に動くので、
+    段階のスレッド数の合計 x OpenCV スレッド数がコア数を超えないように配分する
+    （読み込み・ワープは decode_workers / warp_workers を上限に少なめにし、残りを特徴量とマッチングで分ける）。
+    コアが少なく各段階に1スレッドずつも確保できない場合は、OpenCV を1スレッドにする。
+
+    Returns:
+        {'decode', 'features', 'match', 'warp': 各段階のスレッド数, 'cv_threads': OpenCV スレッド数}
+    """
+    cv_threads = plan['cv_threads']
+    slots = plan['cpus'] // cv_threads  # 同時に OpenCV の処理を行えるスレッド数
+    if slots < 4:
+        cv_threads = 1
+        slots = max(4, plan['cpus'])
+
+    decode = max(1, min(decode_workers, slots // 4))
+    warp = max(1, min(warp_workers, slots // 4))
+    rest = max(2, slots - decode - warp)
+    return {
+        'decode': decode,
+        'features': (rest + 1) // 2,  # 特徴量計算（SIFT）の方が重いので端数はこちらに回す
+        'match': rest // 2,
+        'warp': warp,
+        'cv_threads': cv_threads,
+    }
+
+
+def describe_thread_budget(plan):
+    """
+    配分をログ用の1行にする。
+    """
+    return (
+        f"THREAD_BUDGET={plan['mode']} (cpus={plan['cpus']}): "
+        f"estimate {plan['workers']} workers x {plan['cv_threads']} OpenCV threads, "
+        f"composite {plan['composite_workers']} workers x {plan['composite_cv_threads']} OpenCV threads"
+    )
+
+
+def apply_stage_threads(cv_threads):
+    """
+    これから始まる処理段階の OpenCV 内部スレッド数を設定する。
+    """
+    cv.setNumThreads(max(1, int(cv_threads)))
@@ -0,0 +1,171 @@
+"""
+処理段階ごとの所要時間の計測（imread / downsample / detectAndCompute / knnMatch / ratio_test /
+findHomography / validate / warp / blend / imwrite など）。
+
+計測する側は `with span('knnMatch'):` で囲むだけで、どのジョブ・どのクローズアップの時間かは
+スレッドごとに TimingRecorder.scope で設定しておく（設定していないスレッドでは何もしない）。
+そのため blending.py などの共通処理は、呼び出し元が CLI か Web API かを気にせずに計測できる。
+
+集計はクローズアップごと（scope にファイル名を渡した区間）と実行全体（ファイル名なしの区間を含む）。
+並列に処理した区間はそれぞれのスレッドの時間を合計するので、合計が経過時間を超えることがある。
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class TimingRecorder:
+    """
+    1回の合成処理（CLI の実行、Web API のジョブ）の区間の所要時間を集める。
+
+    Args:
+        on_span: on_span(区間名, 秒)。区間を記録するたびに呼ぶ（メトリクスへの反映など、Noneで呼ばない）
+    """
+
+    def __init__(self, on_span=None):
+        self._on_span = on_span
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._spans = {}  # 区間名 -> [回数, 合計秒, 最大秒]
+        self._run = {}  # クローズアップに属さない区間（オーバービューの処理、出力の保存など）: 区間名 -> 秒
+        self._closeups = {}  # クローズアップ名 -> {区間名: 秒}
+
+    @contextmanager
+    def scope(self, closeup=None):
+        """
+        このスレッドで計測した区間を、この記録先（closeup を指定した場合はそのクローズアップ）に記録する。
+        """
+        previous = getattr(_local, 'current', None)
+        _local.current = (self, closeup)
+        try:
+            yield self
+        finally:
+            _local.current = previous
+
+    def bind(self):
+        """
+        このスレッドで以降に計測した区間を、クローズアップに属さない区間としてこの記録先に記録する
+        （scope と違い元に戻さない。実行・ジョブを処理するスレッドの最初に呼ぶ）。
+        """
+        _local.current = (self, None)
+
+    def record(self, name, seconds, closeup=None):
+        with self._lock:
+            entry = self._spans.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            target = self._run if closeup is None else self._closeups.setdefault(closeup, {})
+            target[name] = target.get(name, 0.0) + seconds
+        if self._on_span is not None:
+            self._on_span(name, seconds)
+
+    def pop_closeup(self, closeup):
+        """
+        クローズアップの区間を取り出して記録から消す（プロセスワーカーから親プロセスへ渡す用）。
+
+        Returns:
+            [(区間名, 秒), ...]。merge_closeup に渡す
+        """
+        with self._lock:
+            return list(self._closeups.pop(closeup, {}).items())
+
+    def merge_closeup(self, closeup, spans):
+        """
+        pop_closeup で取り出したクローズアップの区間を記録する（1区間1回として数える）。
+        """
+        for name, seconds in spans:
+            self.record(name, seconds, closeup)
+
+    def report(self):
+        """
+        JSON に書き出せる集計結果。
+
+        Returns:
+            {
+                'wall_seconds': 記録を開始してからの経過秒,
+                'spans': {区間名: {count, total_seconds, mean_ms, max_ms}}（全体）,
+                'run': {区間名: 秒}（クローズアップに属さない区間）,
+                'closeups': {クローズアップ名: {total_seconds, spans: {区間名: 秒}}},
+            }
+        """
+        with self._lock:
+            spans = {
+                name: {
+                    'count': count,
+                    'total_seconds': round(total, 6),
+                    'mean_ms': round(total / count * 1000, 3) if count else 0.0,
+                    'max_ms': round(longest * 1000, 3),
+                }
+                for name, (count, total, longest) in self._spans.items()
+            }
+            closeups = {
+                closeup: {
+                    'total_seconds': round(sum(values.values()), 6),
+                    'spans': {name: round(seconds, 6) for name, seconds in values.items()},
+                }
+                for closeup, values in self._closeups.items()
+            }
+            return {
+                'wall_seconds': round(time.perf_counter() - self._started, 6),
+                'spans': spans,
+                'run': {name: round(seconds, 6) for name, seconds in self._run.items()},
+                'closeups': closeups,
+            }
+
+
+@contextmanager
+def span(name):
+    """
+    with ブロックの所要時間を、このスレッドの scope の記録先に記録する（scope の外では何もしない）。
+    """
+    current = getattr(_local, 'current', None)
+    if current is None:
+        yield
+        return
+    recorder, closeup = current
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(name, time.perf_counter() - started, closeup)
+
+
+def timing_report_path(output_path):
+    """
+    出力画像に対応する計測結果のパス（stitched.png -> stitched.timing.json）。
+    """
+    root, _ = os.path.splitext(output_path)
+    return f"{root}.timing.json"
+
+
+def save_timing_report(path, report):
+    """
+    計測結果を JSON で書き出す（一時ファイルに書いてから置き換える）。
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def format_timing_report(report, slowest=5):
+    """
+    計測結果をログ用の行のリストにする（区間ごとの合計と、時間のかかったクローズアップ）。
+    """
+    lines = [
+        f"{name}: {s['count']} calls, total {s['total_seconds']:.2f}s, "
+        f"mean {s['mean_ms']:.1f}ms, max {s['max_ms']:.1f}ms"
+        for name, s in sorted(report['spans'].items(), key=lambda item: -item[1]['total_seconds'])
+    ]
+    closeups = sorted(report['closeups'].items(), key=lambda item: -item[1]['total_seconds'])[:slowest]
+    if closeups:
+        lines.append("slowest closeups: " + ", ".join(
+            f"{closeup} {values['total_seconds']:.2f}s" for closeup, values in closeups
+        ))
+    return lines
@@ -0,0 +1,81 @@
+"""
+Web API の合成処理 (process_stitching) で、オーバービューの特徴量計算の倍率ごとに
+1ジョブあたりの処理時間を比較するベンチマーク。
+
+    python tools/benchmark_api_overview_scale.py OVERVIEW CLOSEUPS_GLOB [--scales 1.0 0.5] [--repeat 3]
+
+--scales の 1.0 が従来の動作（オーバービューを元解像度で SIFT）。
+特徴量キャッシュは無効にして、毎回 SIFT を計算した場合の時間を測る。
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import api  # noqa: E402
+
+
+def run_job(overview, closeups, params):
+    """
+    process_stitching を1回実行し、(経過秒, ジョブ情報) を返す。
+    """
+    job_id = f"bench-{time.time_ns()}"
+    api.processing_jobs.create(job_id, {'status': 'uploaded', 'progress': 0})
+
+    start = time.perf_counter()
+    api.process_stitching(job_id, overview, closeups, params)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, api.processing_jobs.discard(job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('overview', help='オーバービュー画像')
+    parser.add_argument('closeups', help='クローズアップ画像の glob パターン')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.5],
+                        help='比較するオーバービューの倍率 (overview_scale)')
+    parser.add_argument('--downsample-scale', type=float, default=0.5,
+                        help='クローズアップの倍率 (downsample_scale)')
+    parser.add_argument('--canvas-scale', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sequential', action='store_true', help='use_parallel=False で実行')
+    args = parser.parse_args()
+
+    closeups = sorted(glob.glob(args.closeups))
+    if not closeups:
+        sys.exit(f"No closeups match {args.closeups}")
+
+    print(f"overview={args.overview}, closeups={len(closeups)}, "
+          f"downsample_scale={args.downsample_scale}, repeat={args.repeat}")
+    print(f"{'overview_scale':>14} {'median[s]':>10} {'min[s]':>8} {'success':>8} {'skip':>5}")
+
+    for scale in args.scales:
+        params = {
+            'canvas_scale': args.canvas_scale,
+            'downsample_matching': True,
+            'downsample_scale': args.downsample_scale,
+            'overview_scale': scale,
+            'use_parallel': not args.sequential,
+            'use_feature_cache': False,
+        }
+        times = []
+        job = None
+        for _ in range(args.repeat):
+            elapsed, job = run_job(args.overview, closeups, params)
+            if job['status'] != 'completed':
+                sys.exit(f"Job failed at overview_scale={scale}: {job.get('error')}")
+            times.append(elapsed)
+
+        stats = job.get('stats', {})
+        print(f"{scale:>14.2f} {statistics.median(times):>10.2f} {min(times):>8.2f} "
+              f"{stats.get('success_count', 0):>8} {stats.get('skip_count', 0):>5}")
+
+
+if __name__ == '__main__':
+    main()
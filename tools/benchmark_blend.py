@@ -0,0 +1,127 @@
+"""
+ブレンディング (src/blending.py の blend_roi) の正しさと速度を確認するベンチマーク。
+
+    python tools/benchmark_blend.py [--size 4000x3000] [--strength 31] [--repeat 5]
+
+ランダムな canvas・ワープ済み画像と、回転した四角形の footprint_mask を使って、
+以前の float32 の計算（canvas * (1 - mask) + warped * mask を切り捨て）、
+uint16 の固定小数点による計算、blend_roi を比較する。
+float32 との差が1階調を超える方式があれば終了コード 1 で終了する。
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from blending import blend_roi, footprint_mask  # noqa: E402
+
+
+def blend_float32(canvas, roi, warped, mask_blur):
+    """
+    以前の blend_roi（float32 で計算して切り捨て）。比較の基準。
+    """
+    x0, y0, x1, y1 = roi
+    canvas_roi = canvas[y0:y1, x0:x1]
+    mask_float_3ch = cv.cvtColor(mask_blur.astype(np.float32) / 255.0, cv.COLOR_GRAY2BGR)
+    blended = (
+        canvas_roi.astype(np.float32) * (1.0 - mask_float_3ch)
+        + warped.astype(np.float32) * mask_float_3ch
+    )
+    canvas_roi[:] = np.clip(blended, 0, 255).astype(np.uint8)
+
+
+def blend_uint16(canvas, roi, warped, mask_blur):
+    """
+    uint16 の固定小数点: (c * (255 - a) + w * a + 128) を 255 で割る（x + (x >> 8)) >> 8 で四捨五入）。
+    """
+    x0, y0, x1, y1 = roi
+    canvas_roi = canvas[y0:y1, x0:x1]
+    alpha = mask_blur.astype(np.uint16)[..., None]
+    mixed = canvas_roi.astype(np.uint16)
+    mixed *= 255 - alpha
+    term = warped.astype(np.uint16)
+    term *= alpha
+    mixed += term
+    mixed += 128
+    mixed += mixed >> 8
+    mixed >>= 8
+    canvas_roi[:] = mixed
+
+
+KERNELS = [
+    ('float32', blend_float32),
+    ('uint16', blend_uint16),
+    ('blend_roi', blend_roi),
+]
+
+
+def make_inputs(width, height, strength, seed=0):
+    """
+    canvas、ワープ済み画像（ROI 全体）、回転した四角形のぼかしマスクを作る。
+    """
+    rng = np.random.default_rng(seed)
+    canvas = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    warped = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    # ROI の内側に収まる、少し回転した四角形
+    angle = np.deg2rad(7.0)
+    cx, cy = width / 2, height / 2
+    H = np.array([
+        [np.cos(angle), -np.sin(angle), 0],
+        [np.sin(angle), np.cos(angle), 0],
+        [0, 0, 1]
+    ]) @ np.array([[0.8, 0, -0.4 * width], [0, 0.8, -0.4 * height], [0, 0, 1]])
+    H = np.array([[1, 0, cx], [0, 1, cy], [0, 0, 1]]) @ H
+    mask = footprint_mask(H, (height, width), (0, 0, width, height), strength)
+    return canvas, warped, mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', default='4000x3000', help='ROI の大きさ (幅x高さ)')
+    parser.add_argument('--strength', type=int, default=31, help='ブレンディング強度（奇数）')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    canvas, warped, mask = make_inputs(width, height, args.strength)
+    roi = (0, 0, width, height)
+    megapixels = width * height / 1e6
+
+    reference = canvas.copy()
+    blend_float32(reference, roi, warped, mask)
+
+    print(f"ROI {width}x{height} ({megapixels:.1f} MP), strength={args.strength}, repeat={args.repeat}")
+    print(f"{'kernel':>10} {'median[s]':>10} {'MP/s':>8} {'max diff':>9} {'diff px':>9}")
+
+    failed = False
+    for name, kernel in KERNELS:
+        result = canvas.copy()
+        kernel(result, roi, warped, mask)
+        diff = np.abs(result.astype(np.int16) - reference.astype(np.int16)).max(axis=2)
+        failed |= bool(diff.max() > 1)
+
+        times = []
+        for _ in range(args.repeat):
+            target = canvas.copy()
+            start = time.perf_counter()
+            kernel(target, roi, warped, mask)
+            times.append(time.perf_counter() - start)
+
+        median = statistics.median(times)
+        print(f"{name:>10} {median:>10.3f} {megapixels / median:>8.1f} "
+              f"{int(diff.max()):>9} {int(np.count_nonzero(diff)):>9}")
+
+    if failed:
+        sys.exit("Max difference from float32 exceeds 1 LSB")
+
+
+if __name__ == '__main__':
+    main()
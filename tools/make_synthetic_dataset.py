@@ -0,0 +1,153 @@
+"""
+任意のオーバービュー画像から、正解のホモグラフィ付きのベンチマーク用データセットを作る。
+
+    python tools/make_synthetic_dataset.py OVERVIEW OUT_DIR [--count 20] [--seed 0]
+
+オーバービューの一部を切り出して拡大し、ランダムな射影変形・回転・明るさの変化・ノイズを加えて
+クローズアップを作る。出力は src/main.py の既定のパス構成に合わせる:
+
+    OUT_DIR/overview.jpg
+    OUT_DIR/closeups/syn_000.jpg ...
+    OUT_DIR/ground_truth.json
+
+ground_truth.json の closeups には、クローズアップのファイル名ごとに
+クローズアップ画素 -> オーバービュー画素のホモグラフィ (H) と画像サイズ (size: [幅, 高さ]) を記録する
+（src/main.py の H_to_canvas から canvas の倍率を除いたものに相当）。
+tools/run_benchmark.py がこれを使って推定結果の四隅の誤差を求める。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import cv2 as cv
+import numpy as np
+
+
+def random_footprint(rng, overview_size, crop_size, max_rotation, perspective):
+    """
+    クローズアップが写すオーバービュー上の四角形（四隅の座標）をランダムに決める。
+    オーバービューからはみ出す場合は None。
+    """
+    w_base, h_base = overview_size
+    w_crop, h_crop = crop_size
+
+    cx = rng.uniform(w_crop / 2, w_base - w_crop / 2)
+    cy = rng.uniform(h_crop / 2, h_base - h_crop / 2)
+    angle = np.deg2rad(rng.uniform(-max_rotation, max_rotation))
+
+    corners = np.array([
+        [-w_crop / 2, -h_crop / 2], [w_crop / 2, -h_crop / 2],
+        [w_crop / 2, h_crop / 2], [-w_crop / 2, h_crop / 2]
+    ])
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    corners = corners @ rotation.T + (cx, cy)
+
+    # 四隅を独立にずらして射影変形にする（撮影方向の違いに相当）
+    corners += rng.uniform(-perspective, perspective, size=(4, 2)) * (w_crop, h_crop)
+
+    inside = (
+        (corners[:, 0] >= 0).all() and (corners[:, 0] <= w_base - 1).all()
+        and (corners[:, 1] >= 0).all() and (corners[:, 1] <= h_base - 1).all()
+    )
+    return corners if inside else None
+
+
+def render_closeup(rng, base, footprint, closeup_size, gain, bias, noise):
+    """
+    footprint の範囲をクローズアップの大きさに射影して、明るさの変化とノイズを加える。
+
+    Returns:
+        (closeup, H)。H はクローズアップ画素 -> オーバービュー画素のホモグラフィ
+    """
+    w_img, h_img = closeup_size
+    corners = np.float32([[0, 0], [w_img - 1, 0], [w_img - 1, h_img - 1], [0, h_img - 1]])
+    H = cv.getPerspectiveTransform(corners, np.float32(footprint))
+
+    closeup = cv.warpPerspective(
+        base, H, (w_img, h_img),
+        flags=cv.INTER_CUBIC | cv.WARP_INVERSE_MAP, borderMode=cv.BORDER_REFLECT
+    )
+
+    # 明るさ: 全体のゲイン・オフセットに、画像の横方向のなだらかな変化（照明むら）を加える
+    ramp = np.linspace(-0.5, 0.5, w_img, dtype=np.float32)[None, :, None]
+    gradient = 1.0 + rng.uniform(-gain, gain) * ramp
+    adjusted = closeup.astype(np.float32) * rng.uniform(1 - gain, 1 + gain) * gradient
+    adjusted += rng.uniform(-bias, bias)
+    if noise > 0:
+        adjusted += rng.normal(0.0, noise, size=adjusted.shape).astype(np.float32)
+
+    return np.clip(adjusted, 0, 255).astype(np.uint8), H
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('overview', help='元にするオーバービュー画像')
+    parser.add_argument('out_dir', help='出力先ディレクトリ')
+    parser.add_argument('--count', type=int, default=20, help='クローズアップの枚数')
+    parser.add_argument('--crop', type=float, default=0.25,
+                        help='クローズアップが写す範囲の幅（オーバービューの幅に対する比）')
+    parser.add_argument('--upscale', type=float, default=3.0,
+                        help='クローズアップの拡大率（オーバービュー1画素あたりの画素数）')
+    parser.add_argument('--rotation', type=float, default=10.0, help='回転の最大角度（度）')
+    parser.add_argument('--perspective', type=float, default=0.05,
+                        help='四隅をずらす最大量（写す範囲の大きさに対する比）')
+    parser.add_argument('--gain', type=float, default=0.15, help='明るさのゲインの最大変化量')
+    parser.add_argument('--bias', type=float, default=10.0, help='明るさのオフセットの最大値（階調）')
+    parser.add_argument('--noise', type=float, default=3.0, help='ガウスノイズの標準偏差（階調）')
+    parser.add_argument('--quality', type=int, default=92, help='JPEG 品質')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    base = cv.imread(args.overview)
+    if base is None:
+        sys.exit(f"Failed to read overview image: {args.overview}")
+    h_base, w_base = base.shape[:2]
+
+    aspect = h_base / w_base
+    crop_size = (args.crop * w_base, args.crop * w_base * aspect)
+    closeup_size = (int(round(crop_size[0] * args.upscale)), int(round(crop_size[1] * args.upscale)))
+
+    closeup_dir = os.path.join(args.out_dir, 'closeups')
+    os.makedirs(closeup_dir, exist_ok=True)
+    shutil.copyfile(args.overview, os.path.join(args.out_dir, 'overview.jpg'))
+
+    rng = np.random.default_rng(args.seed)
+    ground_truth = {
+        'overview': 'overview.jpg',
+        'overview_size': [w_base, h_base],
+        'settings': vars(args),
+        'closeups': {},
+    }
+
+    for index in range(args.count):
+        footprint = None
+        for _ in range(100):
+            footprint = random_footprint(
+                rng, (w_base, h_base), crop_size, args.rotation, args.perspective
+            )
+            if footprint is not None:
+                break
+        if footprint is None:
+            sys.exit("Could not place a closeup inside the overview (reduce --crop or --perspective)")
+
+        closeup, H = render_closeup(
+            rng, base, footprint, closeup_size, args.gain, args.bias, args.noise
+        )
+        filename = f'syn_{index:03d}.jpg'
+        cv.imwrite(os.path.join(closeup_dir, filename), closeup, [cv.IMWRITE_JPEG_QUALITY, args.quality])
+        ground_truth['closeups'][filename] = {
+            'H': H.tolist(),
+            'size': list(closeup_size),
+        }
+
+    with open(os.path.join(args.out_dir, 'ground_truth.json'), 'w', encoding='utf-8') as f:
+        json.dump(ground_truth, f, indent=1)
+
+    print(f"Wrote {args.count} closeups ({closeup_size[0]}x{closeup_size[1]}) to {closeup_dir}")
+
+
+if __name__ == '__main__':
+    main()
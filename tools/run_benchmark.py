@@ -0,0 +1,303 @@
+"""
+tools/make_synthetic_dataset.py で作ったデータセットで合成処理を実行し、
+処理時間・スループット・ピークメモリ・処理段階ごとの所要時間・推定したホモグラフィの四隅の誤差を
+報告するベンチマーク。
+
+    python tools/run_benchmark.py DATASET_DIR [--target cli|api] [--repeat 3]
+        [--set MAX_FEATURES=3000 --set FLANN_CHECKS=32]      # cli: src/main.py の定数を上書き
+        [--param max_features=3000 --param downsample_scale=0.4]  # api: process_stitching の params
+
+cli は src/main.py を、api は src/api.py の process_stitching を、毎回別プロセスで実行する
+（ピークメモリはそのプロセスの最大 RSS。プロセスプールのワーカーは含まない）。
+特徴量キャッシュは --feature-cache を付けない限り使わない。
+cli の設定は --set で上書きしない限り main.py の既定のまま（推定結果は終了時に closeup_records から読む）。
+処理段階ごとの所要時間は src/timing.py の計測結果（cli は stitched.timing.json、api は stats['timing']）。
+
+誤差は、クローズアップの四隅を正解のホモグラフィと推定したホモグラフィで射影したときの距離
+（オーバービューの画素単位）。--error-threshold を超えたものは誤推定として数える。
+"""
+
+import argparse
+import ast
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC_DIR = os.path.abspath(os.path.join(REPO_DIR, 'src'))
+
+# src/main.py の定数の行を置き換えてから実行する（SIFT_PARAMS など定数から作られる値にも反映される）
+CLI_RUNNER = """
+import json, os, re, sys
+main_path, results_path = sys.argv[1], sys.argv[2]
+overrides = dict(arg.split('=', 1) for arg in sys.argv[3:])
+sys.path.insert(0, os.path.dirname(main_path))
+with open(main_path, encoding='utf-8') as f:
+    code = f.read()
+for name, value in overrides.items():
+    code, n = re.subn(rf'^{name} = .*$', f'{name} = {value}', code, count=1, flags=re.M)
+    if n == 0:
+        sys.exit(f'Unknown constant in main.py: {name}')
+sys.argv = [main_path]
+# 本物の __main__ モジュールで実行する（プロセスプールのワーカー関数を pickle で参照できるように）
+import __main__
+__main__.__file__ = main_path
+exec(compile(code, main_path, 'exec'), __main__.__dict__)
+# 推定結果は closeup_records から書き出す（INCREMENTAL_RENDER のハッシュ計算を計測に含めないため）
+with open(results_path, 'w', encoding='utf-8') as f:
+    json.dump({
+        'canvas_scale': __main__.CANVAS_SCALE,
+        'closeups': {
+            os.path.basename(path): {
+                'status': record['status'],
+                'H': None if record['H'] is None else record['H'].tolist(),
+                'error': record['error'],
+            }
+            for path, record in __main__.closeup_records.items()
+        },
+    }, f)
+"""
+
+API_RUNNER = """
+import json, os, sys
+sys.path.insert(0, sys.argv[1])
+import api
+overview, closeups, params = sys.argv[2], json.loads(sys.argv[3]), json.loads(sys.argv[4])
+job_id = 'benchmark-%d' % os.getpid()
+api.processing_jobs.create(job_id, {'status': 'uploaded', 'progress': 0})
+api.process_stitching(job_id, overview, closeups, params)
+job = api.processing_jobs.discard(job_id)
+if job.get('result_path') and os.path.exists(job['result_path']):
+    os.remove(job['result_path'])
+print('BENCHMARK_RESULT ' + json.dumps({'status': job['status'], 'error': job.get('error'), 'stats': job.get('stats', {})}))
+"""
+
+STATS_LINE = re.compile(r'\[STATS\] (\S+): (\d+) items, [\d.]+ items/s, busy ([\d.]+)s')
+
+
+def run_child(args, cwd):
+    """
+    子プロセスを実行し、(終了コード, 標準出力, 経過秒, 最大 RSS [バイト] または None) を返す。
+    """
+    # 標準出力は一時ファイルに書かせる（パイプだと、バッファが一杯になった子プロセスが書き込みで止まり、
+    # 終了を待つ wait4 と互いに待ち続ける）
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as output:
+        start = time.perf_counter()
+        proc = subprocess.Popen(args, cwd=cwd, stdout=output, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            elapsed = time.perf_counter() - start
+            returncode = os.waitstatus_to_exitcode(status)
+            proc.returncode = returncode
+            # ru_maxrss は Linux では KB、macOS ではバイト
+            peak = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        else:
+            returncode = proc.wait()
+            elapsed = time.perf_counter() - start
+            peak = None
+        output.seek(0)
+        stdout = output.read()
+    return returncode, stdout, elapsed, peak
+
+
+def parse_overrides(items):
+    """
+    NAME=VALUE のリストを辞書にする（VALUE は Python のリテラル）。
+    """
+    overrides = {}
+    for item in items:
+        name, sep, value = item.partition('=')
+        if not sep:
+            sys.exit(f"Expected NAME=VALUE: {item}")
+        overrides[name.strip()] = ast.literal_eval(value.strip())
+    return overrides
+
+
+def run_cli(dataset, overrides, use_cache):
+    """
+    データセットのディレクトリで src/main.py を実行する。
+
+    Returns:
+        (経過秒, 最大 RSS, {ファイル名: (status, canvas への H, スキップ理由)}, canvas の倍率,
+         パイプラインの段階ごとの処理時間, 処理時間の計測結果)
+    """
+    constants = {
+        'WATCH_MODE': False,
+        'USE_FEATURE_CACHE': use_cache,
+    }
+    constants.update(overrides)
+    for name in ('stitched.png', 'stitched.manifest.json', 'stitched.timing.json', 'stitch.log'):
+        path = os.path.join(dataset, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    main_path = os.path.join(SRC_DIR, 'main.py')
+    fd, results_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        returncode, stdout, elapsed, peak = run_child(
+            [sys.executable, '-c', CLI_RUNNER, main_path, results_path]
+            + [f'{name}={value!r}' for name, value in constants.items()],
+            dataset
+        )
+        if returncode != 0:
+            sys.exit(f"main.py failed ({returncode}):\n{stdout}")
+        with open(results_path, encoding='utf-8') as f:
+            recorded = json.load(f)
+    finally:
+        os.remove(results_path)
+    results = {
+        name: (entry['status'], entry['H'], entry['error'])
+        for name, entry in recorded['closeups'].items()
+    }
+
+    stages = {}
+    with open(os.path.join(dataset, 'stitch.log'), encoding='utf-8') as f:
+        for line in f:
+            m = STATS_LINE.search(line)
+            if m:
+                stages[m.group(1)] = float(m.group(3))
+
+    with open(os.path.join(dataset, 'stitched.timing.json'), encoding='utf-8') as f:
+        timing = json.load(f)
+
+    return elapsed, peak, results, recorded['canvas_scale'], stages, timing
+
+
+def run_api(dataset, params, use_cache):
+    """
+    src/api.py の process_stitching を別プロセスで実行する。戻り値は run_cli と同じ。
+    """
+    closeup_dir = os.path.join(dataset, 'closeups')
+    closeups = sorted(
+        os.path.join(closeup_dir, name) for name in os.listdir(closeup_dir)
+        if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )
+    params = dict({'use_feature_cache': use_cache}, **params)
+    returncode, stdout, elapsed, peak = run_child(
+        [sys.executable, '-c', API_RUNNER, SRC_DIR, os.path.join(dataset, 'overview.jpg'),
+         json.dumps(closeups), json.dumps(params)],
+        dataset
+    )
+    lines = [line for line in stdout.splitlines() if line.startswith('BENCHMARK_RESULT ')]
+    if returncode != 0 or not lines:
+        sys.exit(f"process_stitching failed ({returncode}):\n{stdout}")
+    job = json.loads(lines[-1][len('BENCHMARK_RESULT '):])
+    if job['status'] != 'completed':
+        sys.exit(f"Job {job['status']}: {job['error']}")
+
+    stats = job['stats']
+    results = {
+        name: (entry['status'], entry['H'], entry['error'])
+        for name, entry in stats.get('closeups', {}).items()
+    }
+    return elapsed, peak, results, stats['canvas_scale'], {}, stats['timing']
+
+
+def corner_errors(ground_truth, results, canvas_scale):
+    """
+    正解のホモグラフィと推定結果で四隅を射影し、クローズアップごとの誤差（四隅の距離の最大値）を返す。
+
+    Returns:
+        (errors, skipped)。errors はファイル名 -> 誤差、skipped はファイル名 -> スキップ理由
+    """
+    to_overview = np.diag([1.0 / canvas_scale, 1.0 / canvas_scale, 1.0])
+    errors = {}
+    skipped = {}
+    for name, truth in ground_truth['closeups'].items():
+        status, H_canvas, error = results.get(name, ('skip', None, 'not processed'))
+        if status != 'success':
+            skipped[name] = error
+            continue
+
+        w_img, h_img = truth['size']
+        corners = np.array([[0, 0, 1], [w_img - 1, 0, 1], [w_img - 1, h_img - 1, 1], [0, h_img - 1, 1]], float).T
+        expected = np.asarray(truth['H']) @ corners
+        estimated = to_overview @ np.asarray(H_canvas) @ corners
+        distances = np.linalg.norm(expected[:2] / expected[2] - estimated[:2] / estimated[2], axis=0)
+        errors[name] = float(distances.max())
+    return errors, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dataset', help='make_synthetic_dataset.py の出力ディレクトリ')
+    parser.add_argument('--target', choices=('cli', 'api'), default='cli')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--set', dest='constants', action='append', default=[], metavar='NAME=VALUE',
+                        help='cli: src/main.py の定数を上書き（複数指定可）')
+    parser.add_argument('--param', dest='params', action='append', default=[], metavar='KEY=VALUE',
+                        help='api: process_stitching の params（複数指定可）')
+    parser.add_argument('--feature-cache', action='store_true', help='特徴量キャッシュを使う')
+    parser.add_argument('--error-threshold', type=float, default=5.0,
+                        help='誤推定とみなす四隅の誤差（オーバービューの画素）')
+    parser.add_argument('--json', help='結果を JSON で書き出すパス')
+    args = parser.parse_args()
+
+    dataset = os.path.abspath(args.dataset)
+    with open(os.path.join(dataset, 'ground_truth.json'), encoding='utf-8') as f:
+        ground_truth = json.load(f)
+    total = len(ground_truth['closeups'])
+
+    runs = []
+    for repeat in range(args.repeat):
+        if args.target == 'cli':
+            elapsed, peak, results, canvas_scale, stages, timing = run_cli(
+                dataset, parse_overrides(args.constants), args.feature_cache
+            )
+        else:
+            elapsed, peak, results, canvas_scale, stages, timing = run_api(
+                dataset, parse_overrides(args.params), args.feature_cache
+            )
+        errors, skipped = corner_errors(ground_truth, results, canvas_scale)
+        runs.append({
+            'seconds': elapsed,
+            'closeups_per_second': total / elapsed if elapsed > 0 else 0.0,
+            'peak_rss_bytes': peak,
+            'success': len(errors),
+            'skipped': skipped,
+            'wrong': sorted(name for name, e in errors.items() if e > args.error_threshold),
+            'corner_error': errors,
+            'stage_busy_seconds': stages,
+            'span_seconds': {name: span['total_seconds'] for name, span in timing['spans'].items()},
+        })
+        print(f"run {repeat + 1}/{args.repeat}: {elapsed:.2f}s, {runs[-1]['closeups_per_second']:.2f} closeups/s")
+
+    last = runs[-1]
+    errors = sorted(last['corner_error'].values())
+    peaks = [run['peak_rss_bytes'] for run in runs if run['peak_rss_bytes'] is not None]
+    print()
+    print(f"dataset={dataset} ({total} closeups), target={args.target}, repeat={args.repeat}")
+    print(f"time [s]            median {statistics.median(r['seconds'] for r in runs):.2f}, "
+          f"min {min(r['seconds'] for r in runs):.2f}")
+    print(f"throughput          {statistics.median(r['closeups_per_second'] for r in runs):.2f} closeups/s")
+    print(f"peak memory         {max(peaks) / 1024 ** 2:.0f} MB" if peaks else "peak memory         n/a")
+    print(f"success / skipped   {last['success']} / {len(last['skipped'])}")
+    if errors:
+        print(f"corner error [px]   mean {statistics.mean(errors):.2f}, median {statistics.median(errors):.2f}, "
+              f"max {errors[-1]:.2f}")
+    print(f"wrong (> {args.error_threshold:g}px)     {len(last['wrong'])}"
+          + (f": {', '.join(last['wrong'])}" if last['wrong'] else ""))
+    for name, reason in sorted(last['skipped'].items()):
+        print(f"  skipped {name}: {reason}")
+    spans = sorted(last['span_seconds'].items(), key=lambda item: -item[1])
+    print("span total [s]      " + ", ".join(f"{name} {seconds:.2f}" for name, seconds in spans))
+    if last['stage_busy_seconds']:
+        print("stage busy [s]      " + ", ".join(
+            f"{name} {seconds:.2f}" for name, seconds in last['stage_busy_seconds'].items()
+        ))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'target': args.target, 'dataset': dataset, 'runs': runs}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
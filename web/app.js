@@ -4,11 +4,13 @@ const state = {
     overviewFile: null,
     closeupFiles: [],
     jobId: null,
-    eventSource: null
+    eventSource: null,
+    cancelled: false
 };
 
 // API Configuration
 const API_BASE = window.location.origin;
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;  // bytes per upload request
 
 // DOM Elements
 const overviewDropZone = document.getElementById('overview-drop-zone');
@@ -87,7 +89,9 @@ function updateStatus(status, text) {
         'processing': 'bg-blue-100 text-blue-800 status-badge',
         'completed': 'bg-green-100 text-green-800',
         'failed': 'bg-red-100 text-red-800',
-        'uploaded': 'bg-yellow-100 text-yellow-800'
+        'uploaded': 'bg-yellow-100 text-yellow-800',
+        'queued': 'bg-yellow-100 text-yellow-800',
+        'cancelled': 'bg-gray-100 text-gray-800'
     };
 
     statusBadge.className = `inline-flex items-center px-3 py-1 rounded-full text-sm font-medium ${statusClasses[status] || 'bg-gray-100 text-gray-800'}`;
@@ -175,18 +179,76 @@ function setupDropZone(dropZone, input, handler) {
 }
 
 // API Calls
-async function uploadFiles() {
-    const formData = new FormData();
-    formData.append('overview', state.overviewFile);
+// Files are sent in chunks (PUT with Content-Range) so that large sets are not limited by
+// a request size and an interrupted file resumes from the bytes the server already has.
+// Closeups carry their index so the server keeps files whose names sanitize alike apart
+async function uploadFileChunked(jobId, kind, file, chunkSize, index = null) {
+    let url = `${API_BASE}/api/upload/${jobId}/${kind}/${encodeURIComponent(file.name)}`;
+    if (index !== null) {
+        url += `?index=${index}`;
+    }
 
-    state.closeupFiles.forEach((file) => {
-        formData.append('closeups', file);
-    });
+    const status = await fetch(url);
+    let offset = status.ok ? (await status.json()).offset : 0;
+    if (offset >= file.size) {
+        return;
+    }
+
+    while (offset < file.size) {
+        if (state.cancelled) {
+            throw new Error('Upload cancelled');
+        }
+        const end = Math.min(offset + chunkSize, file.size);
+        const response = await fetch(url, {
+            method: 'PUT',
+            headers: {
+                'Content-Range': `bytes ${offset}-${end - 1}/${file.size}`
+            },
+            body: file.slice(offset, end)
+        });
+
+        const result = await response.json();
+        if (response.status === 409 && result.offset !== undefined) {
+            // The server has a different offset (e.g. after a retry); continue from there
+            offset = result.offset;
+            continue;
+        }
+        if (!response.ok) {
+            throw new Error(result.error || `Upload failed: ${file.name}`);
+        }
+        offset = result.offset;
+    }
+}
 
+async function uploadFiles(params) {
     try {
-        const response = await fetch(`${API_BASE}/api/upload`, {
+        // Features are extracted on the server while the remaining files are uploading
+        const jobResponse = await fetch(`${API_BASE}/api/jobs`, {
             method: 'POST',
-            body: formData
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                prefetch_features: true,
+                params: params
+            })
+        });
+        if (!jobResponse.ok) {
+            const error = await jobResponse.json();
+            throw new Error(error.error || 'Upload failed');
+        }
+        const job = await jobResponse.json();
+        // Known from here on so that Cancel can stop the job while files are still uploading
+        state.jobId = job.job_id;
+
+        await uploadFileChunked(job.job_id, 'overview', state.overviewFile, UPLOAD_CHUNK_SIZE);
+        for (const [index, file] of state.closeupFiles.entries()) {
+            await uploadFileChunked(job.job_id, 'closeup', file, UPLOAD_CHUNK_SIZE, index);
+            updateProgress(Math.round((index + 1) / state.closeupFiles.length * 100));
+        }
+
+        const response = await fetch(`${API_BASE}/api/upload/${job.job_id}/complete`, {
+            method: 'POST'
         });
 
         if (!response.ok) {
@@ -243,6 +305,8 @@ function streamProgress(jobId) {
 
                 if (data.data.status === 'processing') {
                     updateStatus('processing', '処理中...');
+                } else if (data.data.status === 'queued') {
+                    updateStatus('queued', `待機中 (${data.data.queue_position || '-'}番目)`);
                 }
                 break;
 
@@ -254,6 +318,14 @@ function streamProgress(jobId) {
                 eventSource.close();
                 break;
 
+            case 'cancelled':
+                updateStatus('cancelled', '中断');
+                eventSource.close();
+                startBtn.disabled = false;
+                startBtn.textContent = '合成を開始';
+                cancelBtn.classList.add('hidden');
+                break;
+
             case 'error':
                 updateStatus('failed', 'エラー');
                 addLog(`エラー: ${data.data.error}`);
@@ -264,9 +336,13 @@ function streamProgress(jobId) {
         }
     };
 
+    // On a dropped connection the browser reconnects by itself and sends
+    // Last-Event-ID, so only events after the last received one are replayed
     eventSource.onerror = (error) => {
         console.error('EventSource error:', error);
-        eventSource.close();
+        if (eventSource.readyState === EventSource.CLOSED) {
+            state.eventSource = null;
+        }
     };
 }
 
@@ -284,9 +360,18 @@ function handleCompletion(stats) {
 }
 
 // Cancel Process
-function cancelProcess() {
+async function cancelProcess() {
     addLog('処理を中断しました');
 
+    // Stop the job on the server (queued jobs are dropped, running jobs stop at the next closeup)
+    if (state.jobId) {
+        try {
+            await fetch(`${API_BASE}/api/cancel/${state.jobId}`, { method: 'POST' });
+        } catch (error) {
+            console.error('Cancel error:', error);
+        }
+    }
+
     // Close EventSource if active
     if (state.eventSource) {
         state.eventSource.close();
@@ -294,17 +379,19 @@ function cancelProcess() {
     }
 
     // Reset UI
-    updateStatus('failed', '中断');
+    updateStatus('cancelled', '中断');
     startBtn.disabled = false;
     startBtn.textContent = '合成を開始';
     cancelBtn.classList.add('hidden');
 
-    // Clear job ID
+    // Clear job ID (also stops an upload in progress at its next chunk)
     state.jobId = null;
+    state.cancelled = true;
 }
 
 // Main Process
 async function processStitching() {
+    state.cancelled = false;
     try {
         startBtn.disabled = true;
         startBtn.textContent = '処理中...';
@@ -318,11 +405,6 @@ async function processStitching() {
 
         addLog('画像をアップロード中...');
 
-        const uploadResult = await uploadFiles();
-        state.jobId = uploadResult.job_id;
-
-        addLog(`アップロード完了: Overview 1枚, Closeups ${uploadResult.closeup_count}枚`);
-
         const params = {
             canvas_scale: parseInt(canvasScale.value),
             strength: parseInt(strength.value),
@@ -338,6 +420,14 @@ async function processStitching() {
             max_workers: maxWorkers.value ? parseInt(maxWorkers.value) : null
         };
 
+        const uploadResult = await uploadFiles(params);
+        if (state.cancelled) {
+            return;
+        }
+
+        addLog(`アップロード完了: Overview 1枚, Closeups ${uploadResult.closeup_count}枚`);
+        updateProgress(0);
+
         addLog('処理を開始します...');
         updateStatus('processing', '処理中...');
 
@@ -346,6 +436,10 @@ async function processStitching() {
         streamProgress(state.jobId);
 
     } catch (error) {
+        if (state.cancelled) {
+            // Cancelled during upload: requests to the cancelled job fail, which is expected
+            return;
+        }
         alert(`エラーが発生しました: ${error.message}`);
         addLog(`エラー: ${error.message}`);
         updateStatus('failed', 'エラー');